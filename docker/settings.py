@@ -16,6 +16,14 @@ CELERYBEAT_SCHEDULE.update({
         },
         'schedule': timedelta(minutes=5)
     },
+    'catch-up-whatsapp-channels': {
+        'task': 'warapidpro.tasks.catch_up_channels',
+        'schedule': timedelta(minutes=10),
+    },
+    'flush-whatsapp-lookup-queues': {
+        'task': 'warapidpro.tasks.flush_lookup_queues',
+        'schedule': timedelta(seconds=30),
+    },
 })
 
 WASSUP_AUTH_URL = env('WASSUP_AUTH_URL', 'https://wassup.p16n.org')
@@ -24,11 +24,20 @@ setup(
     url='https://github.com/praekeltfoundation/wa-rapidpro',
     packages=[
         'warapidpro',
+        'warapidpro.benchmarks',
+        'warapidpro.management',
+        'warapidpro.management.commands',
+        'warapidpro.migrations',
     ],
     package_dir={'warapidpro':
                  'warapidpro'},
     include_package_data=True,
     install_requires=[],
+    extras_require={
+        'websocket': ['websocket-client'],
+        'fastjson': ['ujson'],
+        'statsd': ['statsd'],
+    },
     zip_safe=False,
     keywords='warapidpro',
     classifiers=[
@@ -14,14 +14,19 @@ class IntegrationConfig(AppConfig):
     verbose_name = "WhatsApp RapidPro integration"
 
     def ready(self):
+        # NOTE: Only what registration needs is imported here, every
+        #       web and Celery process pays for it on boot. Modules
+        #       with slow imports of their own (requests sessions,
+        #       the metrics backend, JSON codecs, the package version)
+        #       defer them to first use.
         from temba.channels import types
         from .types import WhatsAppDirectType, WhatsAppGroupType
-        from .handlers import WhatsAppHandler
+        from . import signals  # noqa
 
         # NOTE: Loading WhatsAppHandler so when RapidPro
         # looks for ChannelHandler implementations it will
         # load this one into the urlpatterns too
-        WhatsAppHandler
+        from . import handlers  # noqa
 
         types.register_channel_type(WhatsAppDirectType)
         types.register_channel_type(WhatsAppGroupType)
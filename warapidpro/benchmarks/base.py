@@ -0,0 +1,113 @@
+"""
+Shared measuring for the benchmark suite.
+
+Benchmarks are TembaTest cases in bench_*.py modules, which keeps them
+out of the test run, and are run with the run_whatsapp_benchmarks
+management command. Each one calls measure() for its hot path and the
+command writes the collected results as JSON.
+"""
+import gc
+import itertools
+import math
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover, Python 2
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:  # pragma: no cover, Windows
+    resource = None
+
+# Benchmark name -> result, filled in as benchmarks run
+results = {}
+
+
+def percentile(ordered, fraction):
+    index = int(math.ceil(fraction * len(ordered))) - 1
+    return ordered[max(index, 0)]
+
+
+def max_rss_kb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class BenchmarkMixin(object):
+    """
+    Runs a callable repeatedly and records its throughput, latency
+    percentiles, queries per call and memory use.
+
+    Timings are taken without query capturing or allocation tracing,
+    which are both slow, queries and memory are measured over a further
+    ``profile_iterations`` calls.
+    """
+    iterations = 200
+    warmup = 10
+    profile_iterations = 10
+
+    def measure(self, name, func, setup=None, iterations=None):
+        """
+        Calls ``func(setup(i))``, or ``func()`` without a setup, for each
+        iteration. The setup isn't timed.
+        """
+        iterations = iterations or self.iterations
+
+        counter = itertools.count()
+
+        def prepare():
+            if setup is None:
+                return func
+            args = setup(next(counter))
+            return lambda: func(args)
+
+        for _ in range(self.warmup):
+            prepare()()
+
+        gc.collect()
+        latencies = []
+        for _ in range(iterations):
+            run = prepare()
+            started = time.time()
+            run()
+            latencies.append(time.time() - started)
+
+        runs = [prepare() for _ in range(self.profile_iterations)]
+        with CaptureQueriesContext(connection) as queries:
+            for run in runs:
+                run()
+        queries_per_call = float(
+            len(queries.captured_queries)) / self.profile_iterations
+
+        peak_alloc_kb = None
+        if tracemalloc is not None:
+            runs = [prepare() for _ in range(self.profile_iterations)]
+            tracemalloc.start()
+            for run in runs:
+                run()
+            peak_alloc_kb = tracemalloc.get_traced_memory()[1] / 1024.0
+            tracemalloc.stop()
+
+        ordered = sorted(latencies)
+        total = sum(latencies)
+        results[name] = {
+            'iterations': iterations,
+            'ops_per_sec': iterations / total if total else None,
+            'latency_ms': {
+                'mean': total / iterations * 1000,
+                'p50': percentile(ordered, 0.5) * 1000,
+                'p90': percentile(ordered, 0.9) * 1000,
+                'p99': percentile(ordered, 0.99) * 1000,
+                'max': ordered[-1] * 1000,
+            },
+            'queries_per_call': queries_per_call,
+            'peak_alloc_kb': peak_alloc_kb,
+            'max_rss_kb': max_rss_kb(),
+        }
+        return results[name]
@@ -0,0 +1,69 @@
+"""
+Measures cold start costs, each statement is timed in a fresh
+interpreter so nothing is already imported.
+
+    python -m warapidpro.benchmarks.bench_import
+    DJANGO_SETTINGS_MODULE=temba.settings \\
+        python -m warapidpro.benchmarks.bench_import --setup
+
+--setup also times django.setup(), which runs IntegrationConfig.ready.
+"""
+from __future__ import print_function
+
+import argparse
+import subprocess
+import sys
+
+# name, untimed setup, timed statement
+STATEMENTS = (
+    ('pkg_resources version', 'pass',
+     "import pkg_resources; "
+     "pkg_resources.get_distribution('warapidpro').version"),
+    ('import warapidpro.utils', 'import requests',
+     'import warapidpro.utils'),
+    ('get_version()', 'import warapidpro.utils',
+     'warapidpro.utils.get_version()'),
+    ('import warapidpro.codec', 'import django.conf',
+     'import warapidpro.codec'),
+    ('import warapidpro.metrics', 'import django.conf',
+     'import warapidpro.metrics'),
+    ('import warapidpro.timing', 'import django.conf',
+     'import warapidpro.timing'),
+)
+SETUP = ('django.setup()', 'import django', 'django.setup()')
+
+TIMER = (
+    '%s; import time; started = time.time(); %s; '
+    'print(time.time() - started)')
+
+
+def time_statement(setup, statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', TIMER % (setup, statement)])
+        timings.append(float(output.strip().splitlines()[-1]))
+    return sorted(timings)[len(timings) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--setup', action='store_true')
+    args = parser.parse_args(argv)
+
+    statements = list(STATEMENTS)
+    if args.setup:
+        statements.append(SETUP)
+
+    for name, setup, statement in statements:
+        try:
+            median = time_statement(setup, statement, args.repeat)
+        except subprocess.CalledProcessError:
+            print('%-30s failed' % (name,))
+            continue
+        print('%-30s %8.1fms' % (name, median * 1000))
+
+
+if __name__ == '__main__':
+    main()
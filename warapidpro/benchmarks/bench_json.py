@@ -0,0 +1,103 @@
+"""
+Compares the JSON codecs available to warapidpro.codec on payloads
+shaped like the ones on the webhook and send paths.
+
+    python -m warapidpro.benchmarks.bench_json
+"""
+from __future__ import print_function
+
+import json
+import sys
+import timeit
+
+from warapidpro.codec import available_codecs, load_codec
+
+INBOUND = {
+    'hook': {
+        'id': 1234,
+        'event': 'message.direct_inbound',
+        'url': 'https://rapidpro.example.org/handlers/whatsapp/'
+               '00000000-0000-0000-0000-000000001234/',
+    },
+    'data': {
+        'uuid': '4c4d6b7e-8fd1-4bcd-9a2b-70a5c1f5a1d2',
+        'from_addr': '+27820000000',
+        'to_addr': '+27830000000',
+        'number': '+27830000000',
+        'content': u'Sawubona! \xe9 \U0001f44d ' * 10,
+        'image_attachment': 'https://wassup.p16n.org/media/image.jpg',
+        'image_attachment_caption': 'A caption',
+        'location': {'type': 'Point', 'coordinates': [18.42, -33.92]},
+        'group': None,
+        'in_reply_to': None,
+        'created_at': '2018-03-01T10:00:00.000000Z',
+    },
+}
+
+SEND = {
+    'to_addr': '+27820000000',
+    'number': '+27830000000',
+    'group': '',
+    'in_reply_to': '4c4d6b7e-8fd1-4bcd-9a2b-70a5c1f5a1d2',
+    'content': 'Thanks for your message, ' * 20,
+}
+
+CONFIG = {
+    'authorization': {
+        'access_token': 'a' * 30,
+        'refresh_token': 'b' * 30,
+        'token_type': 'Bearer',
+        'expires_in': 36000,
+        'scope': 'numbers:read messages:read messages:write',
+    },
+    'expires_at': '2018-03-01T20:00:00.000000',
+    'number': '+27830000000',
+    'wassup_webhook_ids': [1, 2],
+}
+
+LOOKUP = [
+    {'msisdn': '+2782%07d' % (i,), 'wa_exists': bool(i % 2)}
+    for i in range(500)]
+
+PAYLOADS = (
+    ('inbound', INBOUND),
+    ('send', SEND),
+    ('config', CONFIG),
+    ('lookup', LOOKUP),
+)
+
+
+def bench(name, number):
+    loads, dumps = load_codec(name)
+    results = {}
+    for payload_name, payload in PAYLOADS:
+        encoded = json.dumps(payload)
+        assert loads(dumps(payload)) == json.loads(encoded)
+        results[payload_name] = (
+            min(timeit.repeat(
+                lambda: loads(encoded), number=number, repeat=3)) / number,
+            min(timeit.repeat(
+                lambda: dumps(payload), number=number, repeat=3)) / number,
+        )
+    return results
+
+
+def main(argv):
+    number = int(argv[1]) if len(argv) > 1 else 2000
+    results = dict(
+        (name, bench(name, number)) for name in available_codecs())
+    baseline = results['json']
+
+    print('%-10s %-8s %12s %12s %8s' % (
+        'codec', 'payload', 'loads (us)', 'dumps (us)', 'speedup'))
+    for name in sorted(results):
+        for payload_name, _ in PAYLOADS:
+            load_time, dump_time = results[name][payload_name]
+            base_load, base_dump = baseline[payload_name]
+            print('%-10s %-8s %12.2f %12.2f %7.1fx' % (
+                name, payload_name, load_time * 1e6, dump_time * 1e6,
+                (base_load + base_dump) / (load_time + dump_time)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,51 @@
+from django.test import override_settings
+
+from temba.tests import TembaTest
+from temba.channels.models import Channel
+
+from warapidpro.benchmarks.base import BenchmarkMixin
+from warapidpro.fakewassup import FakeWassup, FakeWassupServer
+from warapidpro.tasks import check_contact_whatsappable
+from warapidpro.types import WhatsAppDirectType
+
+
+class LookupBenchmark(BenchmarkMixin, TembaTest):
+
+    iterations = 20
+    warmup = 2
+    profile_iterations = 2
+    batch_size = 100
+
+    @classmethod
+    def setUpClass(cls):
+        super(LookupBenchmark, cls).setUpClass()
+        cls.server = FakeWassupServer(('127.0.0.1', 0), FakeWassup())
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super(LookupBenchmark, cls).tearDownClass()
+
+    def setUp(self):
+        super(LookupBenchmark, self).setUp()
+        self.channel = Channel.create(
+            self.org, self.user, 'RW', WhatsAppDirectType.code,
+            None, '+27000000000',
+            config=dict(api_token='api-token', secret='secret'),
+            uuid='00000000-0000-0000-0000-000000001234',
+            role=Channel.DEFAULT_ROLE)
+        self.contact_pks = [
+            self.create_contact('Contact %s' % (i,), '+2782%07d' % (i,)).pk
+            for i in range(self.batch_size)]
+        # Every batch goes to Wassup rather than the lookup cache
+        settings = override_settings(
+            WASSUP_AUTH_URL=self.server.url, WASSUP_LOOKUP_CACHE_TTL=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_check_contact_whatsappable(self):
+        self.measure(
+            'lookup.batch_%s' % (self.batch_size,),
+            lambda: check_contact_whatsappable(
+                self.contact_pks, self.channel.pk))
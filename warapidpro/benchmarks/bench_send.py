@@ -0,0 +1,60 @@
+from django.test import override_settings
+
+from temba.tests import TembaTest
+from temba.channels.models import Channel
+from temba.utils import dict_to_struct
+
+from warapidpro.benchmarks.base import BenchmarkMixin
+from warapidpro.fakewassup import FakeWassup, FakeWassupServer
+from warapidpro.types import WhatsAppDirectType
+
+
+class SendBenchmark(BenchmarkMixin, TembaTest):
+
+    iterations = 100
+
+    @classmethod
+    def setUpClass(cls):
+        super(SendBenchmark, cls).setUpClass()
+        cls.server = FakeWassupServer(
+            ('127.0.0.1', 0), FakeWassup(status_delay=None))
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super(SendBenchmark, cls).tearDownClass()
+
+    def setUp(self):
+        super(SendBenchmark, self).setUp()
+        self.type = WhatsAppDirectType()
+        self.channel = Channel.create(
+            self.org, self.user, 'RW', WhatsAppDirectType.code,
+            None, '+27000000000',
+            config=dict(api_token='api-token', secret='secret'),
+            uuid='00000000-0000-0000-0000-000000001234',
+            role=Channel.DEFAULT_ROLE)
+        self.joe = self.create_contact('Joe Biden', '+254788383383')
+        settings = override_settings(
+            WASSUP_API_URL='%s/api/v1' % (self.server.url,))
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def send(self, attachments=None):
+        [msg] = self.joe.send(
+            "Hey Joe, it's Obama, pick up!", self.admin,
+            attachments=attachments)
+        msg_struct = dict_to_struct('MsgStruct', msg.as_task_json())
+        channel_struct = dict_to_struct(
+            'ChannelStruct', self.channel.as_cached_json())
+
+        def send():
+            self.type.send(channel_struct, msg_struct, msg.text)
+        return send
+
+    def test_send(self):
+        self.measure('send.text', self.send())
+
+    def test_send_with_attachment(self):
+        self.measure('send.attachment', self.send(attachments=[
+            'image/jpeg:%s/media/pic.jpg' % (self.server.url,)]))
@@ -0,0 +1,96 @@
+import json
+
+from django.test import RequestFactory
+
+from temba.tests import TembaTest
+from temba.channels.models import Channel
+from temba.msgs.models import Msg
+
+from warapidpro.benchmarks.base import BenchmarkMixin
+from warapidpro.handlers import WhatsAppHandler
+from warapidpro.types import WhatsAppDirectType, WhatsAppGroupType
+
+DIRECT_UUID = '00000000-0000-0000-0000-000000001234'
+GROUP_UUID = '00000000-0000-0000-0000-000000005678'
+
+
+class WebhookBenchmark(BenchmarkMixin, TembaTest):
+
+    def setUp(self):
+        super(WebhookBenchmark, self).setUp()
+        self.factory = RequestFactory()
+        self.handler = WhatsAppHandler()
+        self.direct_channel = Channel.create(
+            self.org, self.user, 'RW', WhatsAppDirectType.code,
+            None, '+27000000000',
+            config=dict(access_token='access-token', secret='secret'),
+            uuid=DIRECT_UUID, role=Channel.DEFAULT_ROLE)
+        self.group_channel = Channel.create(
+            self.org, self.user, 'RW', WhatsAppGroupType.code,
+            None, '+27000000001',
+            config=dict(
+                access_token='access-token', secret='secret',
+                group_uuid='the-group-uuid'),
+            uuid=GROUP_UUID, role=Channel.DEFAULT_ROLE)
+
+    def request(self, event, data):
+        return self.factory.post('/', data=json.dumps({
+            'hook': {'event': event},
+            'data': data,
+        }), content_type='application/json')
+
+    def post(self, uuid):
+        def post(request):
+            response = self.handler.dispatch(request, uuid=uuid)
+            self.assertTrue(response.status_code < 400, response.content)
+        return post
+
+    def inbound(self, i, group=None):
+        return self.request(
+            'message.%s_inbound' % ('group' if group else 'direct',), {
+                'uuid': 'inbound-%s' % (i,),
+                'from_addr': '+2782%07d' % (i % 500,),
+                'to_addr': '+27000000000',
+                'content': 'Hello from contact %s' % (i,),
+                'group': group,
+            })
+
+    def test_direct_inbound(self):
+        self.measure(
+            'webhook.direct_inbound', self.post(DIRECT_UUID),
+            setup=lambda i: self.inbound(i))
+
+    def test_group_inbound(self):
+        self.measure(
+            'webhook.group_inbound', self.post(GROUP_UUID),
+            setup=lambda i: self.inbound(i, group={'uuid': 'the-group-uuid'}))
+
+    def test_duplicate_inbound(self):
+        request = self.inbound(0)
+        self.post(DIRECT_UUID)(request)
+        self.measure(
+            'webhook.duplicate_inbound', self.post(DIRECT_UUID),
+            setup=lambda i: request)
+
+    def test_outbound_status(self):
+        joe = self.create_contact('Joe Biden', '+254788383383')
+
+        def setup(i):
+            [msg] = joe.send('Hey Joe', self.admin)
+            Msg.objects.filter(pk=msg.pk).update(
+                channel=self.direct_channel, external_id='outbound-%s' % (i,))
+            return self.request('message.direct_outbound.status', {
+                'message_uuid': 'outbound-%s' % (i,),
+                'status': 'delivered',
+            })
+
+        self.measure(
+            'webhook.outbound_status', self.post(DIRECT_UUID), setup=setup)
+
+    def test_foreign_status(self):
+        self.measure(
+            'webhook.foreign_status', self.post(DIRECT_UUID),
+            setup=lambda i: self.request('message.direct_outbound.status', {
+                'message_uuid': 'foreign-%s' % (i,),
+                'status': 'delivered',
+            }))
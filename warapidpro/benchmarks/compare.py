@@ -0,0 +1,82 @@
+"""
+Compares two run_whatsapp_benchmarks result files and exits non-zero
+if the second regressed beyond the threshold.
+
+    python -m warapidpro.benchmarks.compare old.json new.json
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+# Metric -> (getter, whether bigger is better)
+METRICS = (
+    ('ops_per_sec', lambda result: result['ops_per_sec'], True),
+    ('p90_ms', lambda result: result['latency_ms']['p90'], False),
+    ('queries', lambda result: result['queries_per_call'], False),
+    ('peak_kb', lambda result: result['peak_alloc_kb'], False),
+)
+
+
+def compare(old, new, threshold):
+    """
+    Returns a list of (benchmark, metric, old, new, change, regressed)
+    tuples. Any extra query counts as a regression, other metrics
+    regress by more than ``threshold``. Benchmarks missing from the new
+    run, e.g. because they crashed, are regressions with the metric
+    'missing' and None for the values.
+    """
+    rows = [
+        (name, 'missing', None, None, None, True)
+        for name in sorted(set(old) - set(new))]
+    for name in sorted(set(old) & set(new)):
+        for metric, get, bigger_is_better in METRICS:
+            before, after = get(old[name]), get(new[name])
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else 0.0
+            if metric == 'queries':
+                regressed = after > before
+            elif bigger_is_better:
+                regressed = change < -threshold
+            else:
+                regressed = change > threshold
+            rows.append((name, metric, before, after, change, regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='Relative change that counts as a regression (default 0.1).')
+    args = parser.parse_args(argv)
+
+    with open(args.old) as fp:
+        old = json.load(fp)
+    with open(args.new) as fp:
+        new = json.load(fp)
+
+    print('%s (%s) -> %s (%s)' % (
+        args.old, old['version'], args.new, new['version']))
+    rows = compare(old['results'], new['results'], args.threshold)
+    for name, metric, before, after, change, regressed in rows:
+        if metric == 'missing':
+            print('%-28s MISSING' % (name,))
+            continue
+        print('%-28s %-12s %10.2f %10.2f %+7.1f%% %s' % (
+            name, metric, before, after, change * 100,
+            'REGRESSED' if regressed else ''))
+
+    regressions = [row for row in rows if row[-1]]
+    if regressions:
+        print('%s regressions.' % (len(regressions),))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
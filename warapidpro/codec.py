@@ -0,0 +1,91 @@
+"""
+A pluggable JSON codec, uses the fastest JSON library installed and
+falls back to the standard library's json module.
+
+Set WASSUP_JSON_CODEC to one of the names in CODECS to pick one.
+"""
+import json
+
+from django.conf import settings
+
+
+def stdlib_codec():
+    return json.loads, json.dumps
+
+
+def ujson_codec():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, escape_forward_slashes=False)
+
+    return ujson.loads, dumps
+
+
+def rapidjson_codec():
+    import rapidjson
+    return rapidjson.loads, rapidjson.dumps
+
+
+def orjson_codec():
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+
+    return orjson.loads, dumps
+
+
+CODECS = {
+    'json': stdlib_codec,
+    'ujson': ujson_codec,
+    'rapidjson': rapidjson_codec,
+    'orjson': orjson_codec,
+}
+
+# In order of preference
+PREFERRED_CODECS = ('orjson', 'rapidjson', 'ujson', 'json')
+
+_codec = None
+
+
+def load_codec(name):
+    """
+    Returns the (loads, dumps) pair for the named codec, raises
+    ImportError if its library isn't installed.
+    """
+    return CODECS[name]()
+
+
+def available_codecs():
+    available = []
+    for name in PREFERRED_CODECS:
+        try:
+            load_codec(name)
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+def get_codec():
+    global _codec
+    if _codec is None:
+        name = getattr(settings, 'WASSUP_JSON_CODEC', None)
+        _codec = load_codec(name or available_codecs()[0])
+    return _codec
+
+
+def loads(data):
+    return get_codec()[0](data)
+
+
+def dumps(obj):
+    return get_codec()[1](obj)
+
+
+def channel_config(channel):
+    """
+    Channel.config_json() parsed with the codec.
+    """
+    return loads(channel.config) if channel.config else {}
@@ -0,0 +1,144 @@
+"""
+Parsing and validation of Wassup webhook events.
+
+Each payload is parsed once into a compact event object, malformed
+payloads raise InvalidEvent before any database work is done.
+"""
+import logging
+
+import six
+
+from temba.msgs.models import Msg
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+class InboundEvent(object):
+    __slots__ = (
+        'name', 'uuid', 'from_addr', 'content', 'attachments', 'group_uuid')
+
+    def __init__(self, name, uuid, from_addr, content, attachments,
+                 group_uuid):
+        self.name = name
+        self.uuid = uuid
+        self.from_addr = from_addr
+        self.content = content
+        self.attachments = attachments
+        self.group_uuid = group_uuid
+
+
+class StatusEvent(object):
+    __slots__ = ('name', 'message_uuid', 'status')
+
+    def __init__(self, name, message_uuid, status):
+        self.name = name
+        self.message_uuid = message_uuid
+        self.status = status
+
+
+MEDIA_ATTACHMENTS = (
+    ('image_attachment', Msg.MEDIA_IMAGE),
+    ('audio_attachment', Msg.MEDIA_AUDIO),
+    ('video_attachment', Msg.MEDIA_VIDEO),
+)
+
+CONTENT_FIELDS = (
+    'content',
+    'image_attachment_caption',
+    'document_attachment_caption',
+)
+
+
+def required_string(data, key):
+    value = data.get(key)
+    if not value or not isinstance(value, six.string_types):
+        raise InvalidEvent('Missing or invalid %r.' % (key,))
+    return value
+
+
+def parse_attachments(data):
+    attachments = []
+    for key, media_type in MEDIA_ATTACHMENTS:
+        value = data.get(key)
+        if value:
+            attachments.append('%s:%s' % (media_type, value))
+    if data.get('document_attachment'):
+        logger.warning(
+            'Received document but RapidPro is not able to handle it.')
+
+    location = data.get('location')
+    if location:
+        try:
+            coordinates = location['coordinates']
+            attachments.append('%s:%s,%s' % (
+                Msg.MEDIA_GPS, coordinates[1], coordinates[0]))
+        except (TypeError, KeyError, IndexError):
+            raise InvalidEvent('Invalid location %r.' % (location,))
+    return attachments
+
+
+def parse_content(data):
+    # RP doesn't allow None for content fields
+    for key in CONTENT_FIELDS:
+        value = data.get(key)
+        if value:
+            return value
+    return ''
+
+
+def parse_inbound(name, data):
+    group = data.get('group') or {}
+    if not isinstance(group, dict):
+        raise InvalidEvent('Invalid group %r.' % (group,))
+    return InboundEvent(
+        name,
+        required_string(data, 'uuid'),
+        required_string(data, 'from_addr'),
+        parse_content(data),
+        parse_attachments(data),
+        group.get('uuid'))
+
+
+def parse_status(name, data):
+    return StatusEvent(
+        name,
+        required_string(data, 'message_uuid'),
+        required_string(data, 'status'))
+
+
+# Event name -> (handler method name, parser)
+EVENT_ROUTES = {
+    'message.direct_inbound': ('handle_direct_inbound', parse_inbound),
+    'message.group_inbound': ('handle_group_inbound', parse_inbound),
+    'message.direct_outbound.status': (
+        'handle_outbound_status', parse_status),
+    'message.group_outbound.status': (
+        'handle_outbound_status', parse_status),
+}
+
+
+def parse_event(body):
+    """
+    Returns a (handler method name, event) tuple for a webhook body or
+    None for events we don't handle. Raises InvalidEvent if the body
+    isn't a valid event.
+    """
+    if not isinstance(body, dict):
+        raise InvalidEvent('Expected a JSON object.')
+
+    hook = body.get('hook') or {}
+    data = body.get('data') or {}
+    if not isinstance(hook, dict) or not isinstance(data, dict):
+        raise InvalidEvent('Expected hook and data to be JSON objects.')
+
+    name = hook.get('event')
+    route = EVENT_ROUTES.get(name)
+    if route is None:
+        return None
+
+    method_name, parser = route
+    return method_name, parser(name, data)
@@ -0,0 +1,485 @@
+"""
+A local stand-in for the parts of the Wassup API warapidpro uses, for
+load and integration testing without touching production.
+
+    python -m warapidpro.fakewassup --port 8005 --latency 0.05 \\
+        --error-rate 0.01 --rate-limit 50 --inbound-rate 20
+
+Point WASSUP_AUTH_URL at ``http://localhost:8005`` and WASSUP_API_URL at
+``http://localhost:8005/api/v1``. Channels claimed against it register
+webhooks as usual, the fake then delivers delivery receipts for every
+message sent and, with ``--inbound-rate``, a steady stream of inbound
+messages to WhatsAppHandler. ``--drop-webhooks`` skips a fraction of
+webhooks, those messages can still be fetched from ``/messages/`` by the
+catch up task.
+
+Only the standard library and requests are used so it can run outside
+of a RapidPro install.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+from six.moves import BaseHTTPServer, queue, socketserver
+from six.moves.urllib.parse import parse_qs, urlencode, urlparse
+
+API_PREFIX = '/api/v1'
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_NUMBER = '+27000000000'
+MULTIPART_FIELD = re.compile(
+    br'name="([^"]+)"\r\n\r\n(.*?)\r\n--', re.DOTALL)
+
+
+def now():
+    return datetime.utcnow().isoformat()
+
+
+def parse_multipart_fields(body):
+    """
+    The plain fields of a multipart body, files are skipped.
+    """
+    return dict(
+        (name.decode('utf-8'), value.decode('utf-8'))
+        for name, value in MULTIPART_FIELD.findall(body))
+
+
+class FakeWassup(object):
+    """
+    The fake's state and behaviour, shared by all request threads.
+
+    latency: mean seconds added to every request, with +/- 50% jitter
+    error_rate: fraction of requests answered with a 500
+    rate_limit: requests per second allowed per access token, requests
+        over the limit are answered with a 429
+    wa_exists_rate: fraction of msisdns that are on WhatsApp
+    pending_rate: fraction of msisdns still pending for lookups that
+        don't wait
+    status_delay: seconds before a sent message's delivery receipt,
+        None to not send receipts
+    drop_webhooks: fraction of webhooks that are never delivered
+    media_size: size in bytes of the files served from /media/, for
+        messages with attachments
+    """
+
+    def __init__(self, latency=0, error_rate=0, rate_limit=None,
+                 page_size=DEFAULT_PAGE_SIZE, numbers=(DEFAULT_NUMBER,),
+                 groups=2, wa_exists_rate=0.8, pending_rate=0,
+                 status_delay=0.1, drop_webhooks=0, webhook_workers=4,
+                 media_size=64 * 1024):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.page_size = page_size
+        self.wa_exists_rate = wa_exists_rate
+        self.pending_rate = pending_rate
+        self.status_delay = status_delay
+        self.drop_webhooks = drop_webhooks
+        self.webhook_workers = webhook_workers
+        self.media = b'\xff\xd8' + b'\0' * max(media_size - 2, 0)
+
+        self.numbers = [
+            {'from_addr': number, 'vname': 'Fake %s' % (number,)}
+            for number in numbers]
+        self.groups = [
+            {
+                'uuid': str(uuid.uuid4()),
+                'subject': 'Fake group %s' % (index,),
+                'number': number,
+            }
+            for number in numbers
+            for index in range(groups)]
+
+        self.lock = threading.Lock()
+        self.webhooks = {}
+        self.messages = []
+        self.lookups = {}
+        self.request_windows = {}
+        self.webhook_queue = queue.Queue()
+        self.stats = {
+            'requests': 0,
+            'errors': 0,
+            'throttled': 0,
+            'webhooks_sent': 0,
+            'webhooks_failed': 0,
+            'webhooks_dropped': 0,
+        }
+        self.running = False
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def start(self):
+        self.running = True
+        self.workers = [
+            threading.Thread(target=self.deliver_webhooks)
+            for _ in range(self.webhook_workers)]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def stop(self):
+        self.running = False
+        for _ in self.workers:
+            self.webhook_queue.put(None)
+
+    # Request handling
+
+    def throttled(self, token):
+        if not self.rate_limit:
+            return False
+        second = int(time.time())
+        with self.lock:
+            window, count = self.request_windows.get(token, (second, 0))
+            if window != second:
+                window, count = second, 0
+            self.request_windows[token] = (window, count + 1)
+        return count >= self.rate_limit
+
+    def handle(self, method, path, query, headers, body, base_url=''):
+        """
+        Returns a (status, body) tuple for a request, body being
+        something json serialisable, bytes or None. Pagination links are
+        relative to base_url.
+        """
+        self.count('requests')
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+
+        if self.throttled(headers.get('Authorization')):
+            self.count('throttled')
+            return 429, {'detail': 'Request was throttled.'}
+
+        if random.random() < self.error_rate:
+            self.count('errors')
+            return 500, {'detail': 'Fake server error.'}
+
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX):]
+
+        content_type = headers.get('Content-Type') or ''
+        if content_type.startswith('application/json'):
+            data = json.loads(body.decode('utf-8')) if body else {}
+        elif content_type.startswith('multipart/form-data'):
+            data = parse_multipart_fields(body)
+        else:
+            data = dict(
+                (key, values[0])
+                for key, values in parse_qs(body.decode('utf-8')).items())
+
+        if path.startswith('/media/') and method == 'GET':
+            return 200, self.media
+        if path == '/oauth/token/' and method == 'POST':
+            return self.token(data)
+        if path == '/numbers/' and method == 'GET':
+            return self.page(base_url, path, query, self.numbers)
+        if path == '/groups/' and method == 'GET':
+            return self.page(base_url, path, query, self.groups)
+        if path == '/lookups/' and method == 'POST':
+            return self.lookup(data)
+        if path == '/webhooks/' and method == 'POST':
+            return self.add_webhook(data)
+        match = re.match(r'^/webhooks/(\d+)/$', path)
+        if match and method == 'DELETE':
+            return self.remove_webhook(int(match.group(1)))
+        if path == '/messages/' and method == 'POST':
+            return self.send_message(data)
+        if path == '/messages/' and method == 'GET':
+            return self.list_messages(base_url, path, query)
+        return 404, {'detail': 'Not found.'}
+
+    def page(self, base_url, path, query, results):
+        page = int(query.get('page', 1))
+        start = (page - 1) * self.page_size
+        end = start + self.page_size
+        next_url = None
+        if end < len(results):
+            params = dict(query, page=page + 1)
+            next_url = '%s%s%s?%s' % (
+                base_url, API_PREFIX, path, urlencode(params))
+        return 200, {
+            'count': len(results),
+            'next': next_url,
+            'results': results[start:end],
+        }
+
+    def token(self, data):
+        if data.get('grant_type') not in (
+                'authorization_code', 'refresh_token'):
+            return 400, {'error': 'unsupported_grant_type'}
+        return 200, {
+            'access_token': uuid.uuid4().hex,
+            'refresh_token': uuid.uuid4().hex,
+            'token_type': 'Bearer',
+            'expires_in': 36000,
+            'scope': 'numbers:read messages:read messages:write',
+        }
+
+    def lookup(self, data):
+        results = []
+        for msisdn in data.get('msisdns', []):
+            with self.lock:
+                wa_exists = self.lookups.get(msisdn)
+                if wa_exists is None and (
+                        data.get('wait', True) or
+                        random.random() >= self.pending_rate):
+                    wa_exists = self.lookups[msisdn] = (
+                        random.random() < self.wa_exists_rate)
+            results.append({'msisdn': msisdn, 'wa_exists': wa_exists})
+        return 200, results
+
+    def add_webhook(self, data):
+        with self.lock:
+            webhook_id = len(self.webhooks) + 1
+            self.webhooks[webhook_id] = dict(data, id=webhook_id)
+        return 201, self.webhooks[webhook_id]
+
+    def remove_webhook(self, webhook_id):
+        with self.lock:
+            if self.webhooks.pop(webhook_id, None) is None:
+                return 404, {'detail': 'Not found.'}
+        return 204, None
+
+    def send_message(self, data):
+        group = data.get('group') or None
+        kind = 'group' if group else 'direct'
+        message = {
+            'uuid': str(uuid.uuid4()),
+            'number': data.get('number'),
+            'from_addr': data.get('number'),
+            'to_addr': data.get('to_addr'),
+            'group': group,
+            'in_reply_to': data.get('in_reply_to'),
+            'content': data.get('content'),
+            'status': 'sent',
+            'created_at': now(),
+        }
+        with self.lock:
+            self.messages.append(message)
+
+        if self.status_delay is not None:
+            timer = threading.Timer(
+                self.status_delay, self.deliver, (message, kind))
+            timer.daemon = True
+            timer.start()
+        return 201, message
+
+    def deliver(self, message, kind):
+        message['status'] = 'delivered'
+        self.emit(
+            'message.%s_outbound.status' % (kind,), message['number'], {
+                'message_uuid': message['uuid'],
+                'status': 'delivered',
+                'created_at': now(),
+            })
+
+    def list_messages(self, base_url, path, query):
+        number = query.get('number')
+        since = query.get('since', '')
+        with self.lock:
+            messages = [
+                message for message in self.messages
+                if message['number'] == number and
+                message['created_at'] >= since]
+        return self.page(base_url, path, query, messages)
+
+    # Webhooks
+
+    def receive(self, number, from_addr, content, group=None):
+        """
+        Records an inbound message and emits its webhook.
+        """
+        message = {
+            'uuid': str(uuid.uuid4()),
+            'number': number,
+            'from_addr': from_addr,
+            'to_addr': number,
+            'group': group,
+            'content': content,
+            'created_at': now(),
+        }
+        with self.lock:
+            self.messages.append(message)
+        kind = 'group' if group else 'direct'
+        self.emit('message.%s_inbound' % (kind,), number, message)
+        return message
+
+    def emit(self, event, number, data):
+        with self.lock:
+            webhooks = [
+                webhook for webhook in self.webhooks.values()
+                if webhook.get('event') == event and
+                webhook.get('number') == number]
+        for webhook in webhooks:
+            if random.random() < self.drop_webhooks:
+                self.count('webhooks_dropped')
+                continue
+            self.webhook_queue.put({
+                'hook': {
+                    'id': webhook['id'],
+                    'event': event,
+                    'url': webhook['url'],
+                },
+                'data': data,
+            })
+
+    def deliver_webhooks(self):
+        session = requests.Session()
+        while True:
+            body = self.webhook_queue.get()
+            if body is None:
+                return
+            try:
+                response = session.post(
+                    body['hook']['url'], data=json.dumps(body),
+                    headers={'Content-Type': 'application/json'},
+                    timeout=30)
+                response.raise_for_status()
+                self.count('webhooks_sent')
+            except requests.RequestException:
+                self.count('webhooks_failed')
+
+    def generate_inbound(self, rate):
+        """
+        Emits ``rate`` inbound messages a second, spread over the
+        numbers and groups, until stopped.
+        """
+        destinations = [
+            (number['from_addr'], None) for number in self.numbers]
+        destinations.extend([
+            (group['number'], {'uuid': group['uuid']})
+            for group in self.groups])
+        while self.running:
+            number, group = random.choice(destinations)
+            self.receive(
+                number, '+2782%07d' % (random.randint(0, 9999999),),
+                'Fake inbound message', group=group)
+            time.sleep(1.0 / rate)
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self):
+        url = urlparse(self.path)
+        query = dict(
+            (key, values[0]) for key, values in parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        status, data = self.server.wassup.handle(
+            self.command, url.path, query, self.headers, body,
+            base_url='http://%s' % (self.headers.get('Host'),))
+
+        if isinstance(data, bytes):
+            payload, content_type = data, 'application/octet-stream'
+        else:
+            payload = b'' if data is None else json.dumps(data).encode('utf-8')
+            content_type = 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_DELETE = respond
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+
+class FakeWassupServer(socketserver.ThreadingMixIn,
+                       BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, wassup, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RequestHandler)
+        self.wassup = wassup
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def start(self):
+        """
+        Serves from a background thread, for use in tests and benchmarks.
+        """
+        self.wassup.start()
+        self.thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.1})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.wassup.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8005)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--rate-limit', type=int, default=None)
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument(
+        '--number', action='append', dest='numbers', default=None)
+    parser.add_argument('--groups', type=int, default=2)
+    parser.add_argument('--wa-exists-rate', type=float, default=0.8)
+    parser.add_argument('--pending-rate', type=float, default=0)
+    parser.add_argument('--status-delay', type=float, default=0.1)
+    parser.add_argument('--drop-webhooks', type=float, default=0)
+    parser.add_argument('--webhook-workers', type=int, default=4)
+    parser.add_argument('--media-size', type=int, default=64 * 1024)
+    parser.add_argument('--inbound-rate', type=float, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    wassup = FakeWassup(
+        latency=args.latency, error_rate=args.error_rate,
+        rate_limit=args.rate_limit, page_size=args.page_size,
+        numbers=args.numbers or [DEFAULT_NUMBER], groups=args.groups,
+        wa_exists_rate=args.wa_exists_rate, pending_rate=args.pending_rate,
+        status_delay=args.status_delay, drop_webhooks=args.drop_webhooks,
+        webhook_workers=args.webhook_workers, media_size=args.media_size)
+    server = FakeWassupServer(
+        (args.host, args.port), wassup, verbose=args.verbose)
+    wassup.start()
+
+    if args.inbound_rate:
+        generator = threading.Thread(
+            target=wassup.generate_inbound, args=(args.inbound_rate,))
+        generator.daemon = True
+        generator.start()
+
+    print('Fake Wassup listening on %s' % (server.url,))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        wassup.stop()
+        server.server_close()
+        print(json.dumps(wassup.stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,45 @@
-import json
 import logging
+import time
 
 from temba.channels.handlers import BaseChannelHandler
 from temba.channels.models import Channel, ChannelLog
 from temba.contacts.models import URN
-from temba.msgs.models import Msg, OUTGOING
+from temba.msgs.models import Msg, INCOMING, OUTGOING
 from temba.utils.http import HttpEvent
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.http import HttpResponse, JsonResponse
 
+from warapidpro import metrics
+from warapidpro.codec import channel_config, dumps, loads
+from warapidpro.events import (
+    InvalidEvent, parse_event, parse_attachments, parse_content)
+from warapidpro.timing import PhaseTimer
+
 logger = logging.getLogger(__name__)
 
+EVENT_CURSOR_KEY = 'warapidpro:event-cursor:%s'
+INBOUND_DESCRIPTION = 'Handled inbound message.'
+INBOUND_EXTERNAL_ID_KEY = 'warapidpro:inbound:%s:%s'
+DEFAULT_INBOUND_DEDUPE_TTL = 60 * 60
+DEFAULT_INBOUND_CLAIM_TTL = 60
+# Marks an external id that is claimed but not yet stored
+IN_FLIGHT = 0
+
+
+def get_event_cursor(channel_uuid):
+    """
+    The time the last completed catch up for the channel started, the
+    next catch up fetches missed events from here.
+    """
+    return cache.get(EVENT_CURSOR_KEY % (channel_uuid,))
+
+
+def set_event_cursor(channel_uuid, timestamp):
+    cache.set(EVENT_CURSOR_KEY % (channel_uuid,), timestamp, None)
+
 
 class WhatsAppHandler(BaseChannelHandler):
 
@@ -26,69 +55,152 @@ class WhatsAppHandler(BaseChannelHandler):
 
     def post(self, request, *args, **kwargs):
         uuid = kwargs['uuid']
+        timer = self.phase_timer(request)
         # parse our response
         try:
-            body = json.loads(request.body)
+            with timer.phase('json'):
+                body = loads(request.body)
         except Exception as e:  # pragma: needs cover
             logger.error(e)
             return HttpResponse(
                 "Invalid JSON in POST body: %s" % str(e), status=400)
 
-        handler = {
-            'message.direct_inbound': self.handle_direct_inbound,
-            'message.group_inbound': self.handle_group_inbound,
-            'message.direct_outbound.status': (
-                self.handle_outbound_status),
-            'message.group_outbound.status': (
-                self.handle_outbound_status),
-        }.get(body.get('hook', {}).get('event'), self.noop)
-        return handler(request, uuid, body.get('data', {}))
+        return self.handle_event(request, uuid, body)
+
+    def handle_event(self, request, uuid, body):
+        """
+        Processes a parsed Wassup event for the channel, this is shared
+        by webhooks, the websocket consumer in warapidpro.streaming and
+        the catch up task. Only the catch up task moves the event
+        cursor, a delivered event says nothing about the ones before it.
+        """
+        started = time.time()
+        timer = self.phase_timer(request)
+        try:
+            with timer.phase('parse'):
+                route = parse_event(body)
+        except InvalidEvent as e:
+            logger.warning('Invalid event for %s: %s' % (uuid, e))
+            metrics.incr('webhook.invalid')
+            return HttpResponse("Invalid event: %s" % (e,), status=400)
+
+        if route is None:
+            metrics.incr('webhook.ignored')
+            return self.noop(request, uuid, body)
+
+        method_name, event = route
+        with metrics.count_queries('webhook.queries', event=event.name):
+            response = getattr(self, method_name)(request, uuid, event)
+        metrics.timing(
+            'webhook.time', time.time() - started,
+            event=event.name, status=response.status_code)
+        return response
+
+    def phase_timer(self, request):
+        """
+        The timing breakdown for the request, it is logged with the
+        message's ChannelLog.
+        """
+        if getattr(request, 'phase_timer', None) is None:
+            request.phase_timer = PhaseTimer('webhook')
+        return request.phase_timer
+
+    def claim_external_id(self, channel, external_id):
+        """
+        Claims an inbound external id for this request. Returns None if
+        the message is new, otherwise the id of the message already
+        created for it (IN_FLIGHT if that's still being created).
+        Recently seen ids are answered from the cache, older ones from
+        the database. A claim only lasts WASSUP_INBOUND_CLAIM_TTL so a
+        request that dies before storing its message doesn't hold up
+        the retries for long.
+        """
+        key = INBOUND_EXTERNAL_ID_KEY % (channel.pk, external_id)
+        claim_ttl = getattr(
+            settings, 'WASSUP_INBOUND_CLAIM_TTL', DEFAULT_INBOUND_CLAIM_TTL)
+        if not cache.add(key, IN_FLIGHT, claim_ttl):
+            return cache.get(key, IN_FLIGHT)
+
+        message_id = Msg.objects.filter(
+            channel=channel, direction=INCOMING,
+            external_id=external_id).values_list('pk', flat=True).first()
+        if message_id is not None:
+            self.cache_external_id(channel, external_id, message_id)
+        return message_id
+
+    def cache_external_id(self, channel, external_id, message_id):
+        ttl = getattr(
+            settings, 'WASSUP_INBOUND_DEDUPE_TTL', DEFAULT_INBOUND_DEDUPE_TTL)
+        cache.set(
+            INBOUND_EXTERNAL_ID_KEY % (channel.pk, external_id),
+            message_id, ttl)
+
+    def store_external_id(self, channel, external_id, message_id):
+        """
+        Remembers the message created for an external id once it is
+        committed, until then retries find the id still in flight.
+        """
+        transaction.on_commit(lambda: self.cache_external_id(
+            channel, external_id, message_id))
+
+    def release_external_id(self, channel, external_id):
+        cache.delete(INBOUND_EXTERNAL_ID_KEY % (channel.pk, external_id))
+
+    def create_incoming(self, channel, event):
+        """
+        Creates the inbound message for an external id claimed with
+        claim_external_id, releasing the claim if that fails so Wassup's
+        retry can succeed.
+        """
+        external_id = event.uuid
+        try:
+            message = Msg.create_incoming(
+                channel, URN.from_tel(event.from_addr), event.content,
+                external_id=external_id, attachments=event.attachments)
+        except Exception:
+            self.release_external_id(channel, external_id)
+            raise
+        self.store_external_id(channel, external_id, message.pk)
+        return message
+
+    def duplicate_response(self, external_id, message_id):
+        if message_id == IN_FLIGHT:
+            # The message may still fail to be created, have Wassup
+            # retry rather than risk losing it
+            logger.info('Inbound message %s is still being handled.' % (
+                external_id,))
+            return HttpResponse(
+                "Message %s is still being handled." % (external_id,),
+                status=409)
+        # Wassup only needs a 2xx to stop retrying
+        logger.info('Ignoring duplicate inbound message %s.' % (
+            external_id,))
+        return JsonResponse({'message_id': message_id}, status=200)
 
     def get_attachments(self, data):
-        attachments = []
-        if data.get('image_attachment'):
-            attachments.append('%s:%s' % (
-                Msg.MEDIA_IMAGE, data.get('image_attachment')))
-        if data.get('audio_attachment'):
-            attachments.append('%s:%s' % (
-                Msg.MEDIA_AUDIO, data.get('audio_attachment')))
-        if data.get('video_attachment'):
-            attachments.append('%s:%s' % (
-                Msg.MEDIA_VIDEO, data.get('video_attachment')))
-        if data.get('document_attachment'):
-            logger.warning(
-                'Received document but RapidPro is not able to handle it.')
-        if data.get('location'):
-            attachments.append('%s:%s,%s' % (
-                Msg.MEDIA_GPS,
-                data['location']['coordinates'][1],
-                data['location']['coordinates'][0]))
-
-        return attachments
+        return parse_attachments(data)
 
     def get_content(self, data):
-        # RP doesn't allow None for content fields
-        return (
-            data.get('content') or
-            data.get('image_attachment_caption') or
-            data.get('document_attachment_caption') or
-            '')
-
-    def handle_direct_inbound(self, request, uuid, data):
+        return parse_content(data)
+
+    def handle_direct_inbound(self, request, uuid, event):
         from warapidpro.types import WhatsAppDirectType
-        channel = self.lookup_channel(WhatsAppDirectType.code, uuid)
+        timer = self.phase_timer(request)
+        with timer.phase('channel'):
+            channel = self.lookup_channel(WhatsAppDirectType.code, uuid)
         if not channel:
             error_msg = "Channel not found for id: %s" % (uuid,)
             logger.error(error_msg)
             return HttpResponse(error_msg, status=400)
 
-        from_addr = data['from_addr']
-        content = self.get_content(data)
-        attachments = self.get_attachments(data)
+        with timer.phase('dedupe'):
+            duplicate_id = self.claim_external_id(channel, event.uuid)
+        if duplicate_id is not None:
+            return self.duplicate_response(event.uuid, duplicate_id)
+
+        with timer.phase('db'):
+            message = self.create_incoming(channel, event)
 
-        message = Msg.create_incoming(
-            channel, URN.from_tel(from_addr), content,
-            external_id=data['uuid'], attachments=attachments)
         response_body = {
             'message_id': message.pk,
         }
@@ -99,32 +211,34 @@ class WhatsAppHandler(BaseChannelHandler):
 
         event = HttpEvent(
             request_method, request_path, request_body, 201,
-            json.dumps(response_body))
-        ChannelLog.log_message(message, 'Handled inbound message.', event)
+            dumps(response_body))
+        ChannelLog.log_message(
+            message, timer.describe(INBOUND_DESCRIPTION), event)
         return JsonResponse(response_body, status=201)
 
-    def handle_group_inbound(self, request, uuid, data):
+    def handle_group_inbound(self, request, uuid, event):
         from warapidpro.types import WhatsAppGroupType
-        channel = self.lookup_channel(WhatsAppGroupType.code, uuid)
+        timer = self.phase_timer(request)
+        with timer.phase('channel'):
+            channel = self.lookup_channel(WhatsAppGroupType.code, uuid)
         if not channel:
             error_msg = "Channel not found for id: %s" % (uuid,)
             logger.error(error_msg)
             return HttpResponse(error_msg, status=400)
 
-        from_addr = data['from_addr']
-        content = self.get_content(data)
-        attachments = self.get_attachments(data)
-        group_uuid = data.get('group', {}).get('uuid')
-
         # The group webhook receives messages for all groups,
         # only grab the message if it's a group we're a channel for.
-        if channel.config_json()['group_uuid'] != group_uuid:
+        if channel_config(channel)['group_uuid'] != event.group_uuid:
             logger.info('Received message for a different group.')
             return JsonResponse({}, status=200)
 
-        message = Msg.create_incoming(
-            channel, URN.from_tel(from_addr), content,
-            external_id=data['uuid'], attachments=attachments)
+        with timer.phase('dedupe'):
+            duplicate_id = self.claim_external_id(channel, event.uuid)
+        if duplicate_id is not None:
+            return self.duplicate_response(event.uuid, duplicate_id)
+
+        with timer.phase('db'):
+            message = self.create_incoming(channel, event)
 
         response_body = {
             'message_id': message.pk,
@@ -136,11 +250,12 @@ class WhatsAppHandler(BaseChannelHandler):
 
         event = HttpEvent(
             request_method, request_path, request_body, 201,
-            json.dumps(response_body))
-        ChannelLog.log_message(message, 'Handled inbound message.', event)
+            dumps(response_body))
+        ChannelLog.log_message(
+            message, timer.describe(INBOUND_DESCRIPTION), event)
         return JsonResponse(response_body, status=201)
 
-    def handle_outbound_status(self, request, uuid, data):
+    def handle_outbound_status(self, request, uuid, event):
         from warapidpro.types import (
             WhatsAppDirectType, WhatsAppGroupType)
 
@@ -155,8 +270,8 @@ class WhatsAppHandler(BaseChannelHandler):
             logger.error(error_msg)
             return HttpResponse(error_msg, status=400)
 
-        message_id = data['message_uuid']
-        event_type = data['status']
+        message_id = event.message_uuid
+        event_type = event.status
 
         message = Msg.objects.filter(
             channel=channel,
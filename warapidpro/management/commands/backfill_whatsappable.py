@@ -0,0 +1,174 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from warapidpro.tasks import (
+    dispatch_lookups, get_lookup_channels, DEFAULT_LOOKUP_BATCH_SIZE,
+    DEFAULT_LOOKUP_CONCURRENCY)
+
+CHECKPOINT_KEY = 'warapidpro:backfill-checkpoint:%s'
+
+
+class Command(BaseCommand):
+    help = (
+        'Look up all contacts of an org on WhatsApp. No more lookups are '
+        'queued than the org\'s channels have slots for, and progress is '
+        'checkpointed so an interrupted backfill resumes where it stopped. '
+        'Contacts looked up more recently than the lookup cache TTL are '
+        'skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('org_id', type=int)
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_LOOKUP_BATCH_SIZE,
+            help='Number of contacts per lookup task.')
+        parser.add_argument(
+            '--report-every', type=int, default=60,
+            help='Report progress every this many seconds.')
+        parser.add_argument(
+            '--poll-interval', type=float, default=5,
+            help='Seconds between checks for completed lookups.')
+        parser.add_argument(
+            '--stall-timeout', type=int, default=60 * 10,
+            help='Give up waiting on lookups that have not completed after '
+                 'this many seconds without any progress.')
+        parser.add_argument(
+            '--restart', action='store_true', default=False,
+            help='Ignore any checkpoint and start from the first contact.')
+
+    def handle(self, *args, **options):
+        from temba.contacts.models import Contact
+        from temba.orgs.models import Org
+        from warapidpro.models import lookup_cache_ttl
+
+        org_id = options['org_id']
+        batch_size = options['batch_size']
+        self.poll_interval = options['poll_interval']
+        self.stall_timeout = options['stall_timeout']
+        self.report_every = options['report_every']
+
+        org = Org.objects.filter(pk=org_id).first()
+        if org is None:
+            raise CommandError('Org %s does not exist.' % (org_id,))
+
+        channels = get_lookup_channels(org)
+        if not channels:
+            raise CommandError(
+                'Org %s has no active WhatsApp channels.' % (org_id,))
+
+        checkpoint_key = CHECKPOINT_KEY % (org_id,)
+        if options['restart']:
+            cache.delete(checkpoint_key)
+        checkpoint = cache.get(checkpoint_key, 0)
+        if checkpoint:
+            self.stdout.write(
+                'Resuming from contact %s.' % (checkpoint,))
+
+        # Queue a batch for every lookup channel at a time so the
+        # batches get spread over all of them, and only as many as the
+        # channels have lookup slots for so tasks don't retry waiting
+        # for one
+        chunk_size = batch_size * len(channels)
+        concurrency = getattr(
+            settings, 'WASSUP_LOOKUP_CONCURRENCY', DEFAULT_LOOKUP_CONCURRENCY)
+        self.max_in_flight = chunk_size * concurrency
+
+        contacts = Contact.objects.filter(
+            org=org, is_active=True, pk__gt=checkpoint).order_by('pk')
+        # A lookup served from the shared cache records the checked_at
+        # the cached result already has, for contacts recorded from
+        # that same result it wouldn't change and they'd never be seen
+        # to complete. Their lookup is fresh anyway.
+        cache_ttl = lookup_cache_ttl()
+        if cache_ttl:
+            contacts = contacts.exclude(
+                whatsapp_lookup__checked_at__gt=(
+                    timezone.now() - timedelta(seconds=cache_ttl)))
+        self.total = contacts.count()
+
+        # iterator() streams through a server side cursor on PostgreSQL
+        # rather than loading every contact id into memory
+        contact_pks = contacts.values_list('pk', flat=True).iterator()
+
+        self.started = self.reported = time.time()
+        self.done = 0
+        self.in_flight = {}
+        batch = []
+        for contact_pk in contact_pks:
+            batch.append(contact_pk)
+            if len(batch) < chunk_size:
+                continue
+
+            self.wait_for(self.max_in_flight - len(batch))
+            self.queue_batch(batch, channels, checkpoint_key, batch_size)
+            batch = []
+
+        if batch:
+            self.wait_for(self.max_in_flight - len(batch))
+            self.queue_batch(batch, channels, checkpoint_key, batch_size)
+
+        self.wait_for(0)
+        self.report()
+        cache.delete(checkpoint_key)
+        self.stdout.write('Backfill for org %s done.' % (org_id,))
+
+    def queue_batch(self, batch, channels, checkpoint_key, batch_size):
+        from warapidpro.models import WhatsAppLookup
+
+        # A lookup is done once its contact's checked_at changes
+        self.in_flight.update(dict.fromkeys(batch))
+        self.in_flight.update(WhatsAppLookup.objects.filter(
+            contact_id__in=batch).values_list('contact_id', 'checked_at'))
+        dispatch_lookups(batch, channels, batch_size=batch_size)
+        cache.set(checkpoint_key, batch[-1], None)
+
+    def wait_for(self, max_in_flight):
+        """
+        Waits until at most max_in_flight lookups are outstanding,
+        reporting progress along the way.
+        """
+        progressed = time.time()
+        while True:
+            if self.collect_done():
+                progressed = time.time()
+            if time.time() - self.reported >= self.report_every:
+                self.report()
+            if len(self.in_flight) <= max(max_in_flight, 0):
+                return
+            if time.time() - progressed > self.stall_timeout:
+                self.stdout.write(
+                    'No lookups completed in %ss, giving up on %s '
+                    'contacts.' % (self.stall_timeout, len(self.in_flight)))
+                self.in_flight = {}
+                return
+            time.sleep(self.poll_interval)
+
+    def collect_done(self):
+        from warapidpro.models import WhatsAppLookup
+
+        if not self.in_flight:
+            return 0
+        lookups = WhatsAppLookup.objects.filter(
+            contact_id__in=list(self.in_flight)).values_list(
+                'contact_id', 'checked_at')
+        done = [
+            contact_pk for contact_pk, checked_at in lookups
+            if checked_at != self.in_flight[contact_pk]]
+        for contact_pk in done:
+            del self.in_flight[contact_pk]
+        self.done += len(done)
+        return len(done)
+
+    def report(self):
+        self.reported = time.time()
+        elapsed = max(self.reported - self.started, 0.001)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate else 0
+        self.stdout.write(
+            '%s/%s contacts looked up, %s in flight, %.1f contacts/s, '
+            'ETA %ds.' % (
+                self.done, self.total, len(self.in_flight), rate, eta))
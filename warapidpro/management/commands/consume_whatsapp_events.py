@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from warapidpro.types import WHATSAPP_CHANNEL_TYPES
+from warapidpro.streaming import EventConsumer
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream inbound and status events for all active WhatsApp '
+        'channels over websockets instead of receiving them as webhooks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help=(
+                'Maximum number of events processed together, each event '
+                'is committed on its own.'))
+        parser.add_argument(
+            '--flush-interval', type=float, default=1.0,
+            help='Maximum seconds an event waits for its batch to fill.')
+
+    def handle(self, *args, **options):
+        from temba.channels.models import Channel
+
+        try:
+            import websocket  # noqa
+        except ImportError:
+            raise CommandError(
+                'websocket-client is required, install warapidpro[websocket]')
+
+        channels = Channel.objects.filter(
+            channel_type__in=WHATSAPP_CHANNEL_TYPES,
+            is_active=True).exclude(org=None)
+
+        consumer = EventConsumer(
+            list(channels), batch_size=options['batch_size'],
+            flush_interval=options['flush_interval'])
+        consumer.start()
+        self.stdout.write(
+            'Consuming events for %s numbers.' % (
+                len(consumer.channels_by_number),))
+        try:
+            consumer.consume()
+        except KeyboardInterrupt:
+            consumer.stop()
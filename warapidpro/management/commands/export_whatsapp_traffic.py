@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from warapidpro.codec import dumps
+from warapidpro.replay import Anonymiser, export_events
+from warapidpro.types import WHATSAPP_CHANNEL_TYPES
+
+
+class Command(BaseCommand):
+    help = (
+        'Export anonymised inbound and delivery receipt webhooks from the '
+        'ChannelLogs of WhatsApp channels as JSON lines, for '
+        'replay_whatsapp_traffic.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='File to write the events to.')
+        parser.add_argument(
+            '--hours', type=float, default=1,
+            help='Export the traffic of the last this many hours.')
+        parser.add_argument(
+            '--channel', action='append', dest='channels', default=None,
+            help='Only export this channel uuid, can be repeated.')
+
+    def handle(self, *args, **options):
+        from temba.channels.models import ChannelLog
+
+        logs = ChannelLog.objects.filter(
+            channel__channel_type__in=WHATSAPP_CHANNEL_TYPES,
+            is_error=False,
+            created_on__gte=timezone.now() - timedelta(
+                hours=options['hours']))
+        if options['channels']:
+            logs = logs.filter(channel__uuid__in=options['channels'])
+        logs = logs.select_related('channel').order_by('created_on')
+
+        exported = 0
+        with open(options['output'], 'w') as fp:
+            for event in export_events(logs.iterator(), Anonymiser()):
+                fp.write(dumps(event) + '\n')
+                exported += 1
+        self.stdout.write(
+            'Exported %s events to %s.' % (exported, options['output']))
@@ -0,0 +1,73 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from warapidpro.codec import loads
+from warapidpro.replay import Replayer
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay events exported by export_whatsapp_traffic against '
+        'WhatsAppHandler and report throughput, errors and latency.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='File of exported events.')
+        parser.add_argument(
+            '--speed', type=float, default=1.0,
+            help=(
+                'Replay this many times faster than the events were '
+                'received, 0 to replay as fast as possible.'))
+        parser.add_argument(
+            '--concurrency', type=int, default=4,
+            help='Number of events handled at the same time.')
+        parser.add_argument(
+            '--url',
+            help='Base URL of a running RapidPro to post the events to.')
+        parser.add_argument(
+            '--in-process', action='store_true', default=False,
+            help=(
+                'Handle the events in this process instead, creating '
+                'messages in this database.'))
+        parser.add_argument(
+            '--channel',
+            help='Send all events to this channel uuid instead.')
+        parser.add_argument(
+            '--output', help='File to also write the JSON report to.')
+
+    def handle(self, *args, **options):
+        if bool(options['url']) == options['in_process']:
+            raise CommandError('Pass either --url or --in-process.')
+
+        def events():
+            with open(options['input']) as fp:
+                for line in fp:
+                    if line.strip():
+                        yield loads(line)
+
+        report = Replayer(
+            events(), speed=options['speed'],
+            concurrency=options['concurrency'], url=options['url'],
+            channel=options['channel'],
+            in_process=options['in_process']).run()
+
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                json.dump(report, fp, indent=2, sort_keys=True)
+
+        # There is no rate for runs that took no measurable time
+        events_per_sec = report['events_per_sec']
+        self.stdout.write(
+            'Replayed %s events in %.1fs, %s events/s, '
+            'error rate %.2f%%.' % (
+                report['events'], report['duration'],
+                'n/a' if events_per_sec is None else '%.1f' % (
+                    events_per_sec,),
+                report['error_rate'] * 100))
+        latency = report.get('latency_ms')
+        if latency:
+            self.stdout.write(
+                'Latency p50 %(p50).1fms, p90 %(p90).1fms, '
+                'p99 %(p99).1fms, max %(max).1fms.' % latency)
+        for name, count in sorted(report['events_by_type'].items()):
+            self.stdout.write('  %s: %s' % (name, count))
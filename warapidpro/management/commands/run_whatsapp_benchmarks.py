@@ -0,0 +1,51 @@
+import json
+import platform
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+
+from warapidpro.benchmarks import base
+from warapidpro.utils import get_version
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the webhook, send and lookup benchmarks against a test '
+        'database and write the results as JSON, compare two runs with '
+        'python -m warapidpro.benchmarks.compare.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'labels', nargs='*', default=['warapidpro.benchmarks'],
+            help='Benchmark modules, classes or methods to run.')
+        parser.add_argument(
+            '--output', default='benchmarks.json',
+            help='File the JSON results are written to.')
+        parser.add_argument(
+            '--keepdb', action='store_true', default=False,
+            help='Keep the test database between runs.')
+
+    def handle(self, *args, **options):
+        runner = DiscoverRunner(
+            pattern='bench_*.py', keepdb=options['keepdb'],
+            verbosity=options['verbosity'])
+        failures = runner.run_tests(options['labels'])
+        if failures:
+            raise CommandError('%s benchmarks failed.' % (failures,))
+
+        with open(options['output'], 'w') as fp:
+            json.dump({
+                'version': get_version(),
+                'python': platform.python_version(),
+                'timestamp': time.time(),
+                'results': base.results,
+            }, fp, indent=2, sort_keys=True)
+
+        for name, result in sorted(base.results.items()):
+            self.stdout.write(
+                '%-28s %8.1f/s  p50 %7.2fms  p99 %7.2fms  %5.1f queries' % (
+                    name, result['ops_per_sec'],
+                    result['latency_ms']['p50'], result['latency_ms']['p99'],
+                    result['queries_per_call']))
+        self.stdout.write('Results written to %s' % (options['output'],))
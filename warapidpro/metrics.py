@@ -0,0 +1,133 @@
+"""
+Metrics for the send, webhook and lookup hot paths.
+
+Metrics go to the backend named by the WASSUP_METRICS_BACKEND setting,
+a dotted path to a Metrics subclass. The default discards everything,
+StatsdMetrics sends them to statsd and other systems can be plugged in
+with a subclass of their own.
+"""
+import re
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_METRICS_BACKEND = 'warapidpro.metrics.Metrics'
+
+_backend = None
+
+
+class Metrics(object):
+    """
+    The no-op backend, the base class for the others. Tags are a dict
+    of dimension name to value, e.g. {'event': 'message.direct_inbound'}.
+    """
+    enabled = False
+
+    def incr(self, name, value=1, tags=None):
+        """
+        Increments a counter.
+        """
+
+    def histogram(self, name, value, tags=None):
+        """
+        Records a value in a distribution, e.g. a batch size.
+        """
+
+    def timing(self, name, seconds, tags=None):
+        """
+        Records a duration in a distribution.
+        """
+
+
+class StatsdMetrics(Metrics):
+    """
+    Sends metrics with the statsd package to WASSUP_STATSD_HOST and
+    WASSUP_STATSD_PORT. Statsd has no tags so tag values are appended to
+    the metric name, in order of the tag names.
+    """
+    enabled = True
+
+    def __init__(self):
+        import statsd
+        self.client = statsd.StatsClient(
+            getattr(settings, 'WASSUP_STATSD_HOST', 'localhost'),
+            getattr(settings, 'WASSUP_STATSD_PORT', 8125),
+            prefix=getattr(settings, 'WASSUP_STATSD_PREFIX', 'warapidpro'))
+
+    def stat(self, name, tags):
+        if not tags:
+            return name
+        return '.'.join([name] + [
+            re.sub(r'[^\w-]', '_', str(tags[key])) for key in sorted(tags)])
+
+    def incr(self, name, value=1, tags=None):
+        self.client.incr(self.stat(name, tags), value)
+
+    def histogram(self, name, value, tags=None):
+        # statsd timers are its only distributions
+        self.client.timing(self.stat(name, tags), value)
+
+    def timing(self, name, seconds, tags=None):
+        self.client.timing(self.stat(name, tags), seconds * 1000)
+
+
+def get_metrics():
+    global _backend
+    if _backend is None:
+        _backend = import_string(getattr(
+            settings, 'WASSUP_METRICS_BACKEND', DEFAULT_METRICS_BACKEND))()
+    return _backend
+
+
+def incr(name, value=1, **tags):
+    get_metrics().incr(name, value, tags)
+
+
+def histogram(name, value, **tags):
+    get_metrics().histogram(name, value, tags)
+
+
+def timing(name, seconds, **tags):
+    get_metrics().timing(name, seconds, tags)
+
+
+@contextmanager
+def timer(name, **tags):
+    started = time.time()
+    try:
+        yield
+    finally:
+        timing(name, time.time() - started, **tags)
+
+
+@contextmanager
+def count_queries(name, **tags):
+    """
+    Records the number of queries run in the block, query capturing has
+    a cost so nothing is captured unless a backend is configured.
+    """
+    if not get_metrics().enabled:
+        yield
+        return
+
+    # django.test is slow to import and rarely needed
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    with CaptureQueriesContext(connection) as queries:
+        yield
+    histogram(name, len(queries.captured_queries), **tags)
+
+
+def wassup_request_hook(endpoint):
+    """
+    A requests response hook recording the latency and status of calls
+    to a Wassup endpoint, pass as ``hooks={'response': ...}``.
+    """
+    def hook(response, *args, **kwargs):
+        timing(
+            'wassup.request', response.elapsed.total_seconds(),
+            endpoint=endpoint, status=response.status_code)
+        return response
+    return hook
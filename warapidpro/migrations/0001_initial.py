@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.migrations.loader import MigrationLoader
+import django.db.models.deletion
+
+# The apps whose tables POPULATE_SQL reads
+SEED_APPS = ('orgs', 'contacts', 'values')
+
+
+# Seed the lookup table from the has_whatsapp contact fields so
+# contacts that were checked before don't get checked all over again.
+POPULATE_SQL = """
+INSERT INTO "integration_whatsapplookup"
+    ("org_id", "contact_id", "wa_exists", "checked_at")
+SELECT DISTINCT ON ("contacts_contact"."id")
+    "contacts_contact"."org_id",
+    "contacts_contact"."id",
+    CASE "has_whatsapp"."string_value"
+        WHEN 'yes' THEN TRUE
+        WHEN 'no' THEN FALSE
+        ELSE NULL
+    END,
+    COALESCE("has_whatsapp_timestamp"."datetime_value", NOW())
+FROM "contacts_contact"
+INNER JOIN "contacts_contactfield" AS "field"
+    ON "field"."org_id" = "contacts_contact"."org_id"
+    AND "field"."key" = 'has_whatsapp'
+INNER JOIN "values_value" AS "has_whatsapp"
+    ON "has_whatsapp"."contact_id" = "contacts_contact"."id"
+    AND "has_whatsapp"."contact_field_id" = "field"."id"
+LEFT JOIN "contacts_contactfield" AS "timestamp_field"
+    ON "timestamp_field"."org_id" = "contacts_contact"."org_id"
+    AND "timestamp_field"."key" = 'has_whatsapp_timestamp'
+LEFT JOIN "values_value" AS "has_whatsapp_timestamp"
+    ON "has_whatsapp_timestamp"."contact_id" = "contacts_contact"."id"
+    AND "has_whatsapp_timestamp"."contact_field_id" = "timestamp_field"."id"
+ORDER BY "contacts_contact"."id",
+    "has_whatsapp_timestamp"."datetime_value" DESC NULLS LAST
+"""
+
+
+def populate_lookups(apps, schema_editor):
+    # The seed reads columns added by later migrations of the RapidPro
+    # apps, so it only runs once they are all applied. That's always
+    # the case when adding warapidpro to an existing install, a new
+    # database migrated from scratch has nothing to seed.
+    loader = MigrationLoader(schema_editor.connection)
+    for app_label in SEED_APPS:
+        for node in loader.graph.leaf_nodes(app_label):
+            if node not in loader.applied_migrations:
+                return
+    schema_editor.execute(POPULATE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('orgs', '__first__'),
+        ('contacts', '__first__'),
+        ('values', '__first__'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WhatsAppLookup',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID')),
+                ('wa_exists', models.NullBooleanField()),
+                ('checked_at', models.DateTimeField()),
+                ('contact', models.OneToOneField(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='whatsapp_lookup',
+                    to='contacts.Contact')),
+                ('org', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='whatsapp_lookups', to='orgs.Org')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='whatsapplookup',
+            index_together=set([
+                ('org', 'checked_at'),
+                ('org', 'wa_exists'),
+            ]),
+        ),
+        migrations.RunPython(populate_lookups, migrations.RunPython.noop),
+    ]
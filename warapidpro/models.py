@@ -1,4 +1,9 @@
-from temba.contacts.models import ContactField, ContactGroup
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction, IntegrityError
+from temba.contacts.models import Contact, ContactField, ContactGroup
 from temba.values.models import Value
 
 WHATSAPPABLE_GROUP = 'Contacts on WhatsApp'
@@ -6,28 +11,182 @@ HAS_WHATSAPP_KEY = 'has_whatsapp'
 YES = 'yes'
 NO = 'no'
 HAS_WHATSAPP_TIMESTAMP_KEY = 'has_whatsapp_timestamp'
+# The query of the dynamic group created by earlier versions
+LEGACY_WHATSAPPABLE_QUERY = '%s="%s"' % (HAS_WHATSAPP_KEY, YES)
+LOOKUP_CACHE_KEY = 'warapidpro:lookup:%s'
+DEFAULT_LOOKUP_CACHE_TTL = 60 * 60 * 24
+ORG_CACHE_TTL = 60 * 5
+
+# Per process cache of the objects each lookup task needs for an org,
+# entries are invalidated by the receivers in warapidpro.signals and
+# expire after ORG_CACHE_TTL for changes made by other processes.
+_org_cache = {}
+
+
+class WhatsAppLookup(models.Model):
+    """
+    The latest lookup result for a contact, kept alongside the
+    has_whatsapp contact fields so the lookup tasks can select contacts
+    with index scans rather than joining on values.
+    """
+    org = models.ForeignKey(
+        'orgs.Org', related_name='whatsapp_lookups',
+        on_delete=models.CASCADE)
+    contact = models.OneToOneField(
+        'contacts.Contact', related_name='whatsapp_lookup',
+        on_delete=models.CASCADE)
+    wa_exists = models.NullBooleanField()
+    checked_at = models.DateTimeField()
+
+    class Meta:
+        index_together = (
+            ('org', 'checked_at'),
+            ('org', 'wa_exists'),
+        )
+
+    @classmethod
+    def record(cls, org, contact_lookups):
+        """
+        Stores a dict of contact pk -> (wa_exists, checked_at)
+        """
+        existing = set(cls.objects.filter(
+            contact_id__in=contact_lookups.keys()).values_list(
+                'contact_id', flat=True))
+
+        # Lookups in a batch share a handful of distinct results so
+        # updating per result keeps this to a few statements
+        by_result = {}
+        for contact_pk, lookup in contact_lookups.items():
+            if contact_pk in existing:
+                by_result.setdefault(lookup, []).append(contact_pk)
+        for (wa_exists, checked_at), contact_pks in by_result.items():
+            cls.objects.filter(contact_id__in=contact_pks).update(
+                wa_exists=wa_exists, checked_at=checked_at)
+
+        new_lookups = [
+            cls(org=org, contact_id=contact_pk,
+                wa_exists=wa_exists, checked_at=checked_at)
+            for contact_pk, (wa_exists, checked_at) in contact_lookups.items()
+            if contact_pk not in existing]
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create(new_lookups)
+        except IntegrityError:
+            # Another lookup for the same contacts beat us to it
+            for lookup in new_lookups:
+                cls.objects.update_or_create(
+                    contact_id=lookup.contact_id, defaults={
+                        'org': org,
+                        'wa_exists': lookup.wa_exists,
+                        'checked_at': lookup.checked_at,
+                    })
+
+
+def org_cached(org, name, factory):
+    now = time.time()
+    entry = _org_cache.get(org.pk)
+    if entry is None or entry['expires_at'] < now:
+        entry = _org_cache[org.pk] = {'expires_at': now + ORG_CACHE_TTL}
+    if name not in entry:
+        entry[name] = factory()
+    return entry[name]
+
+
+def invalidate_org_cache(org_pk):
+    _org_cache.pop(org_pk, None)
+
+
+def get_org_administrator(org):
+    return org_cached(
+        org, 'administrator', lambda: org.administrators.first())
 
 
 def has_whatsapp_contactfield(org):
-    return ContactField.get_or_create(
-        org, user=org.administrators.first(),
-        key=HAS_WHATSAPP_KEY, value_type=Value.TYPE_TEXT)
+    return org_cached(
+        org, HAS_WHATSAPP_KEY, lambda: ContactField.get_or_create(
+            org, user=get_org_administrator(org),
+            key=HAS_WHATSAPP_KEY, value_type=Value.TYPE_TEXT))
 
 
 def has_whatsapp_timestamp_contactfield(org):
-    return ContactField.get_or_create(
-        org, user=org.administrators.first(),
-        key=HAS_WHATSAPP_TIMESTAMP_KEY, value_type=Value.TYPE_DATETIME)
+    return org_cached(
+        org, HAS_WHATSAPP_TIMESTAMP_KEY, lambda: ContactField.get_or_create(
+            org, user=get_org_administrator(org),
+            key=HAS_WHATSAPP_TIMESTAMP_KEY, value_type=Value.TYPE_DATETIME))
 
 
 def get_whatsappable_group(org):
-    user = org.administrators.first()
-    whatsapp_groups = ContactGroup.user_groups.filter(
-        org=org, name=WHATSAPPABLE_GROUP)
-    if whatsapp_groups.exists():
-        return ContactGroup.get_or_create(
-            org, user=user, name=WHATSAPPABLE_GROUP)
-
-    return ContactGroup.create_dynamic(
-        org, user=user, name=WHATSAPPABLE_GROUP,
-        query='%s="%s"' % (HAS_WHATSAPP_KEY, YES))
+    return org_cached(
+        org, WHATSAPPABLE_GROUP, lambda: get_or_create_whatsappable_group(org))
+
+
+def get_or_create_whatsappable_group(org):
+    """
+    The group is a static group whose membership is maintained from
+    lookup results by update_whatsappable_group. The dynamic group
+    earlier versions created is converted in place, keeping its
+    members, as it would be re-evaluated for every has_whatsapp field
+    write. Any other dynamic group, e.g. one a user created, keeps
+    following its query.
+    """
+    group = ContactGroup.get_or_create(
+        org, user=get_org_administrator(org), name=WHATSAPPABLE_GROUP)
+    if group.query == LEGACY_WHATSAPPABLE_QUERY:
+        group.query = None
+        group.save(update_fields=['query'])
+        group.query_fields.clear()
+    return group
+
+
+def update_whatsappable_group(group, user, add_contact_pks,
+                              remove_contact_pks):
+    """
+    Adds and removes contacts from a static group, going through
+    RapidPro so group counts, campaign events and the contacts'
+    modified_on are kept up to date. RapidPro refuses to add blocked,
+    stopped or inactive contacts to a group so they are left out.
+    """
+    if group.query:
+        # Dynamic groups are re-evaluated by RapidPro itself
+        return
+
+    if add_contact_pks:
+        group.update_contacts(user, Contact.objects.filter(
+            pk__in=add_contact_pks, is_blocked=False, is_stopped=False,
+            is_active=True), True)
+    if remove_contact_pks:
+        group.update_contacts(
+            user, Contact.objects.filter(pk__in=remove_contact_pks), False)
+
+
+def lookup_cache_ttl():
+    return getattr(
+        settings, 'WASSUP_LOOKUP_CACHE_TTL', DEFAULT_LOOKUP_CACHE_TTL)
+
+
+def get_cached_lookups(msisdns):
+    """
+    Returns a dict of msisdn -> (wa_exists, checked_at) for all msisdns
+    that have a cached lookup result. The cache is shared across orgs.
+    """
+    if not lookup_cache_ttl():
+        return {}
+
+    keys = dict((LOOKUP_CACHE_KEY % (msisdn,), msisdn) for msisdn in msisdns)
+    cached = cache.get_many(keys.keys())
+    return dict((keys[key], value) for key, value in cached.items())
+
+
+def cache_lookups(lookups):
+    """
+    Stores a dict of msisdn -> (wa_exists, checked_at), lookups that
+    are still pending at Wassup (wa_exists is None) are not cached.
+    """
+    ttl = lookup_cache_ttl()
+    if not ttl:
+        return
+
+    cache.set_many(dict(
+        (LOOKUP_CACHE_KEY % (msisdn,), (wa_exists, checked_at))
+        for msisdn, (wa_exists, checked_at) in lookups.items()
+        if wa_exists is not None), ttl)
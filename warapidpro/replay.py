@@ -0,0 +1,245 @@
+"""
+Exporting and replaying production shaped webhook traffic.
+
+export_events turns the ChannelLogs of WhatsApp channels into anonymised
+webhook bodies, inbound messages from the logged webhook requests and
+delivery receipts from the logged sends. Replayer posts them to
+WhatsAppHandler at the original pace, scaled by a speed factor, from a
+number of concurrent workers and reports throughput, errors and latency.
+
+Receipts for messages that don't exist where the traffic is replayed are
+handled like the receipts Wassup sends for other systems' messages.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+import requests
+from six.moves import queue
+
+from django.db import connection
+from django.test import RequestFactory
+
+from warapidpro.benchmarks.base import percentile
+from warapidpro.codec import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+INBOUND_DESCRIPTION = 'Handled inbound message.'
+ANONYMISED_TEXT_FIELDS = (
+    'content', 'image_attachment_caption', 'document_attachment_caption')
+ANONYMISED_URL_FIELDS = (
+    'image_attachment', 'audio_attachment', 'video_attachment',
+    'document_attachment')
+
+
+class Anonymiser(object):
+    """
+    Replaces numbers, ids, content and media with stand-ins. The same
+    value gets the same stand-in within an export so conversations keep
+    their shape, the salt keeps stand-ins from being matched across
+    exports.
+    """
+
+    def __init__(self, salt=None):
+        self.salt = salt or os.urandom(16)
+
+    def digest(self, value):
+        return hashlib.sha256(
+            self.salt + value.encode('utf-8')).hexdigest()
+
+    def msisdn(self, value):
+        return '+99%09d' % (int(self.digest(value), 16) % 10 ** 9,)
+
+    def uuid(self, value):
+        return str(uuid.UUID(hex=self.digest(value)[:32]))
+
+    def url(self, value):
+        _, extension = os.path.splitext(value)
+        return 'https://example.com/media/%s%s' % (
+            self.digest(value)[:16], extension)
+
+    def inbound(self, data):
+        data = dict(data)
+        data['uuid'] = self.uuid(data['uuid'])
+        for key in ('from_addr', 'to_addr', 'number'):
+            if data.get(key):
+                data[key] = self.msisdn(data[key])
+        for key in ANONYMISED_TEXT_FIELDS:
+            if data.get(key):
+                data[key] = 'x' * len(data[key])
+        for key in ANONYMISED_URL_FIELDS:
+            if data.get(key):
+                data[key] = self.url(data[key])
+        if data.get('location'):
+            data['location'] = {'type': 'Point', 'coordinates': [0, 0]}
+        if data.get('group'):
+            data['group'] = {'uuid': self.uuid(data['group']['uuid'])}
+        return data
+
+
+def export_events(channel_logs, anonymiser):
+    """
+    Yields an {'offset', 'channel', 'body'} dict per replayable event in
+    the ChannelLogs, which should be ordered by created_on. Offsets are
+    seconds since the first event.
+    """
+    from warapidpro.types import WhatsAppGroupType
+
+    started = None
+    for log in channel_logs:
+        kind = 'group' if (
+            log.channel.channel_type == WhatsAppGroupType.code) else 'direct'
+        try:
+            if log.description.startswith(INBOUND_DESCRIPTION):
+                request = loads(log.request)
+                body = {
+                    # The hook's URL has the production hostname
+                    'hook': {'event': request['hook']['event']},
+                    'data': anonymiser.inbound(request['data']),
+                }
+            elif log.method == 'POST' and log.url.endswith('/messages/'):
+                response = loads(log.response)
+                body = {
+                    'hook': {'event': 'message.%s_outbound.status' % (kind,)},
+                    'data': {
+                        'message_uuid': anonymiser.uuid(response['uuid']),
+                        'status': 'delivered',
+                    },
+                }
+            else:
+                continue
+        except (ValueError, TypeError, KeyError):
+            logger.warning('Skipping unreadable ChannelLog %s.' % (log.pk,))
+            continue
+
+        if started is None:
+            started = log.created_on
+        yield {
+            'offset': (log.created_on - started).total_seconds(),
+            'channel': str(log.channel.uuid),
+            'body': body,
+        }
+
+
+class Replayer(object):
+    """
+    Replays exported events over HTTP to the base URL of a running
+    RapidPro, or in process through WhatsAppHandler when in_process is
+    set. In process replays create messages in this process' database
+    so they have to be asked for.
+
+    speed: 2 replays twice as fast as the events were received, 0 as
+        fast as the workers can go
+    channel: a channel uuid all events are sent to instead of their own
+    """
+
+    def __init__(self, events, speed=1.0, concurrency=4, url=None,
+                 channel=None, in_process=False):
+        if not url and not in_process:
+            raise ValueError(
+                'Replaying needs a url or in_process to handle events in '
+                'this process.')
+        self.events = events
+        self.speed = speed
+        self.concurrency = concurrency
+        self.url = url
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=concurrency * 10)
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.statuses = {}
+        self.events_by_type = {}
+        self.errors = 0
+
+    def run(self):
+        workers = [
+            threading.Thread(target=self.work)
+            for _ in range(self.concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        started = time.time()
+        for event in self.events:
+            if self.speed:
+                delay = started + event['offset'] / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self.queue.put(event)
+        for _ in workers:
+            self.queue.put(None)
+        for worker in workers:
+            worker.join()
+        return self.report(time.time() - started)
+
+    def work(self):
+        handler = factory = session = None
+        if self.url:
+            session = requests.Session()
+        else:
+            from warapidpro.handlers import WhatsAppHandler
+            handler = WhatsAppHandler()
+            factory = RequestFactory()
+        try:
+            while True:
+                event = self.queue.get()
+                if event is None:
+                    return
+                self.replay(event, handler, factory, session)
+        finally:
+            # Each worker thread has a connection of its own
+            connection.close()
+
+    def replay(self, event, handler, factory, session):
+        channel_uuid = self.channel or event['channel']
+        body = dumps(event['body'])
+        started = time.time()
+        try:
+            if self.url:
+                status = session.post(
+                    '%s/handlers/whatsapp/%s/' % (self.url, channel_uuid),
+                    data=body,
+                    headers={'Content-Type': 'application/json'}).status_code
+            else:
+                request = factory.post(
+                    '/', data=body, content_type='application/json')
+                status = handler.dispatch(
+                    request, uuid=channel_uuid).status_code
+        except Exception:
+            logger.exception('Replaying event failed.')
+            status = None
+        elapsed = time.time() - started
+
+        with self.lock:
+            self.latencies.append(elapsed)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            name = event['body']['hook'].get('event')
+            self.events_by_type[name] = self.events_by_type.get(name, 0) + 1
+            if status is None or status >= 400:
+                self.errors += 1
+
+    def report(self, duration):
+        ordered = sorted(self.latencies)
+        total = len(ordered)
+        report = {
+            'events': total,
+            'duration': duration,
+            'events_per_sec': total / duration if duration else None,
+            'error_rate': float(self.errors) / total if total else 0.0,
+            'statuses': dict(
+                (str(status), count)
+                for status, count in self.statuses.items()),
+            'events_by_type': self.events_by_type,
+        }
+        if ordered:
+            report['latency_ms'] = {
+                'p50': percentile(ordered, 0.5) * 1000,
+                'p90': percentile(ordered, 0.9) * 1000,
+                'p99': percentile(ordered, 0.99) * 1000,
+                'max': ordered[-1] * 1000,
+            }
+        return report
@@ -0,0 +1,177 @@
+from django.conf import settings
+from django.core.cache import cache
+
+LOOKUP_LATENCY_KEY = 'warapidpro:lookup-latency:%s'
+LOOKUP_ERROR_RATE_KEY = 'warapidpro:lookup-error-rate:%s'
+DEFAULT_MAX_ERROR_RATE = 0.5
+DEFAULT_ERROR_RATE_TTL = 60 * 30
+# How much weight the latest measurement carries in the moving average
+SMOOTHING = 0.3
+
+
+def fair_share(demands, capacity, weights=None):
+    """
+    Divides capacity between the keys of demands using weighted max-min
+    fairness. Every key gets a share of the capacity proportional to
+    its weight (default 1), keys that need less than their share keep
+    only what they need and the remainder is redistributed between the
+    others. Returns a dict of key -> allocation.
+    """
+    weights = weights or {}
+    allocations = dict((key, 0) for key in demands)
+    remaining = capacity
+    unsatisfied = set(
+        key for key, demand in demands.items()
+        if demand > 0 and weights.get(key, 1) > 0)
+
+    while unsatisfied and remaining > 0:
+        total_weight = float(sum(weights.get(key, 1) for key in unsatisfied))
+        shares = dict(
+            (key, remaining * weights.get(key, 1) / total_weight)
+            for key in unsatisfied)
+        satisfied = set(
+            key for key in unsatisfied if demands[key] <= shares[key])
+
+        if not satisfied:
+            # Nobody can be satisfied, hand out whole shares and give
+            # what rounding leaves over to the heaviest keys
+            for key in unsatisfied:
+                allocations[key] = int(shares[key])
+            leftover = remaining - sum(
+                allocations[key] for key in unsatisfied)
+            for key in sorted(
+                    unsatisfied,
+                    key=lambda key: (-weights.get(key, 1), key))[:leftover]:
+                allocations[key] += 1
+            break
+
+        for key in satisfied:
+            allocations[key] = demands[key]
+            remaining -= demands[key]
+        unsatisfied -= satisfied
+
+    return allocations
+
+
+def adaptive_sample_size(backlog, latency, channels, interval, concurrency,
+                         minimum, maximum):
+    """
+    Sizes an org's sample for an interval: as much of its backlog as its
+    channels can look up in the interval at the recent per msisdn
+    latency, bounded by minimum and maximum. Orgs with a backlog smaller
+    than minimum only get their backlog.
+    """
+    if not backlog:
+        return 0
+
+    size = maximum
+    if latency:
+        size = min(size, int(channels * concurrency * interval / latency))
+    return max(min(backlog, size), min(backlog, minimum))
+
+
+def record_moving_average(key, value, timeout=None):
+    previous = cache.get(key)
+    if previous is not None:
+        value = SMOOTHING * value + (1 - SMOOTHING) * previous
+    cache.set(key, value, timeout)
+
+
+def record_lookup_latency(channel_pk, seconds, msisdns):
+    """
+    Keeps an exponential moving average of the seconds a lookup takes
+    per msisdn for a channel.
+    """
+    if not msisdns:
+        return
+    record_moving_average(
+        LOOKUP_LATENCY_KEY % (channel_pk,), float(seconds) / msisdns)
+
+
+def record_lookup_error(channel_pk, failed):
+    """
+    Keeps an exponential moving average of the share of lookups that
+    failed for a channel. Channels above the maximum error rate get no
+    lookups to update it with, so it expires after
+    WASSUP_LOOKUP_ERROR_RATE_TTL seconds and the channel is tried again.
+    """
+    record_moving_average(
+        LOOKUP_ERROR_RATE_KEY % (channel_pk,), 1.0 if failed else 0.0,
+        getattr(
+            settings, 'WASSUP_LOOKUP_ERROR_RATE_TTL',
+            DEFAULT_ERROR_RATE_TTL))
+
+
+def get_lookup_latency(channel_pks):
+    """
+    The average per msisdn lookup latency of the channels, None if
+    none of them have been measured yet.
+    """
+    latencies = [
+        latency for latency in cache.get_many([
+            LOOKUP_LATENCY_KEY % (channel_pk,)
+            for channel_pk in channel_pks]).values()
+        if latency is not None]
+    if not latencies:
+        return None
+    return sum(latencies) / len(latencies)
+
+
+def channel_weights(channel_pks, max_error_rate=DEFAULT_MAX_ERROR_RATE):
+    """
+    Weighs channels by their recent lookup success rate over their
+    per msisdn latency. Channels failing more than max_error_rate are
+    left out unless all of them are, then only the least failing one is
+    kept so its health can still recover. Returns an ordered list of
+    (channel_pk, weight) tuples.
+    """
+    if not channel_pks:
+        return []
+
+    latencies = cache.get_many(
+        [LOOKUP_LATENCY_KEY % (channel_pk,) for channel_pk in channel_pks])
+    error_rates = cache.get_many(
+        [LOOKUP_ERROR_RATE_KEY % (channel_pk,) for channel_pk in channel_pks])
+
+    measured = [
+        latency for latency in latencies.values() if latency is not None]
+    # Unmeasured channels are assumed to be as fast as the measured ones
+    default_latency = (
+        sum(measured) / len(measured) if measured else 1.0) or 1.0
+
+    health = []
+    for channel_pk in channel_pks:
+        error_rate = error_rates.get(
+            LOOKUP_ERROR_RATE_KEY % (channel_pk,)) or 0.0
+        latency = latencies.get(
+            LOOKUP_LATENCY_KEY % (channel_pk,)) or default_latency
+        health.append((channel_pk, error_rate, (1 - error_rate) / latency))
+
+    healthy = [
+        (channel_pk, weight)
+        for channel_pk, error_rate, weight in health
+        if error_rate <= max_error_rate]
+    if healthy:
+        return healthy
+
+    channel_pk, error_rate, weight = min(
+        health, key=lambda channel_health: channel_health[1])
+    return [(channel_pk, weight or 1.0)]
+
+
+def weighted_round_robin(weights, count):
+    """
+    Picks count keys from an ordered list of (key, weight) tuples so
+    each key is picked in proportion to its weight, spread as evenly
+    as possible (the smooth weighted round robin nginx uses).
+    """
+    total = sum(weight for _, weight in weights)
+    current = dict((key, 0) for key, _ in weights)
+    picks = []
+    for _ in range(count):
+        for key, weight in weights:
+            current[key] += weight
+        picked = max(weights, key=lambda key_weight: current[key_weight[0]])[0]
+        current[picked] -= total
+        picks.append(picked)
+    return picks
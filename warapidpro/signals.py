@@ -0,0 +1,43 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from temba.contacts.models import (
+    ContactURN, ContactField, ContactGroup, TEL_SCHEME)
+from warapidpro.models import (
+    invalidate_org_cache, HAS_WHATSAPP_KEY, HAS_WHATSAPP_TIMESTAMP_KEY,
+    WHATSAPPABLE_GROUP)
+
+
+@receiver(post_save, sender=ContactURN)
+def enqueue_new_tel_urn(sender, instance, created, update_fields, **kwargs):
+    from warapidpro.tasks import org_has_whatsapp, enqueue_contact_lookup
+
+    if instance.scheme != TEL_SCHEME or instance.contact_id is None:
+        return
+
+    # URNs are saved for all sorts of reasons (channel affinity, priority)
+    # only new URNs or URNs that changed number need a lookup
+    if not created and update_fields and 'path' not in update_fields:
+        return
+
+    if not org_has_whatsapp(instance.org_id):
+        return
+
+    org_pk, contact_pk = instance.org_id, instance.contact_id
+    transaction.on_commit(
+        lambda: enqueue_contact_lookup(org_pk, contact_pk))
+
+
+@receiver(post_save, sender=ContactField)
+@receiver(post_delete, sender=ContactField)
+def invalidate_contactfield(sender, instance, **kwargs):
+    if instance.key in (HAS_WHATSAPP_KEY, HAS_WHATSAPP_TIMESTAMP_KEY):
+        invalidate_org_cache(instance.org_id)
+
+
+@receiver(post_save, sender=ContactGroup)
+@receiver(post_delete, sender=ContactGroup)
+def invalidate_contactgroup(sender, instance, **kwargs):
+    if instance.name == WHATSAPPABLE_GROUP:
+        invalidate_org_cache(instance.org_id)
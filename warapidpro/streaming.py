@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+
+import six
+from six.moves import queue
+from six.moves.urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import connection, transaction, close_old_connections
+
+from warapidpro.codec import loads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEBSOCKET_URL = 'wss://wassup.p16n.org/ws/'
+
+
+class EventRequest(object):
+    """
+    Stands in for the HttpRequest WhatsAppHandler logs in ChannelLogs
+    for events that did not arrive over a webhook.
+    """
+    method = 'WS'
+
+    def __init__(self, path, body):
+        self.path = path
+        self.body = body
+
+    def get_full_path(self):
+        return self.path
+
+
+class NumberStream(threading.Thread):
+    """
+    Holds a websocket open for a number and puts every message it
+    receives on the events queue, reconnecting with a backoff whenever
+    the connection drops. A number's events are the same for all its
+    channels so the channel's authorization is used for all of them.
+    """
+    daemon = True
+    max_backoff = 60
+
+    def __init__(self, url, number, channel, events):
+        super(NumberStream, self).__init__(name='wassup-%s' % (number,))
+        self.url = '%s?%s' % (url, urlencode({'number': number}))
+        self.number = number
+        self.channel = channel
+        self.events = events
+        self.stopped = threading.Event()
+
+    def get_headers(self):
+        from warapidpro.types import WhatsAppType
+
+        # Tokens are rotated by refresh_channel_auth_token while the
+        # stream runs, so the config is read again for every connection
+        try:
+            self.channel.refresh_from_db(fields=['config'])
+        finally:
+            if threading.current_thread() is self:
+                # Not needed again until the next reconnect
+                connection.close()
+        return WhatsAppType().api_request_headers(self.channel)
+
+    def run(self):
+        import websocket
+
+        backoff = 1
+        while not self.stopped.is_set():
+            connected = time.time()
+            try:
+                headers = self.get_headers()
+            except Exception:
+                logger.exception(
+                    'Unable to load the authorization for %s.' % (
+                        self.number,))
+            else:
+                app = websocket.WebSocketApp(
+                    self.url,
+                    header=['%s: %s' % item for item in headers.items()],
+                    on_message=self.on_message)
+                app.run_forever(ping_interval=30)
+
+            if time.time() - connected > self.max_backoff:
+                backoff = 1
+            logger.warning(
+                'Websocket for %s closed, reconnecting in %ss.' % (
+                    self.number, backoff))
+            self.stopped.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def on_message(self, ws, message):
+        self.events.put((self.number, message))
+
+    def stop(self):
+        self.stopped.set()
+
+
+class EventConsumer(object):
+    """
+    Streams inbound and status events for WhatsApp channels over
+    websockets and processes them in batches with WhatsAppHandler.
+    """
+
+    def __init__(self, channels, batch_size=100, flush_interval=1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.events = queue.Queue()
+        self.channels_by_number = {}
+        for channel in channels:
+            self.channels_by_number.setdefault(
+                channel.address, []).append(channel)
+        self.streams = []
+
+    def start(self):
+        url = getattr(
+            settings, 'WASSUP_WEBSOCKET_URL', DEFAULT_WEBSOCKET_URL)
+        for number, channels in self.channels_by_number.items():
+            stream = NumberStream(url, number, channels[0], self.events)
+            stream.start()
+            self.streams.append(stream)
+
+    def stop(self):
+        for stream in self.streams:
+            stream.stop()
+
+    def consume(self):
+        while True:
+            self.process_batch(self.next_batch())
+
+    def next_batch(self):
+        batch = [self.events.get()]
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.events.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def channels_for(self, number, event):
+        from warapidpro.types import (
+            WHATSAPP_DIRECT_CHANNEL_TYPE, WHATSAPP_GROUP_CHANNEL_TYPE)
+
+        channel_type = (
+            WHATSAPP_GROUP_CHANNEL_TYPE
+            if event.startswith('message.group')
+            else WHATSAPP_DIRECT_CHANNEL_TYPE)
+        return [
+            channel for channel in self.channels_by_number.get(number, [])
+            if channel.channel_type == channel_type]
+
+    def process_batch(self, batch):
+        from warapidpro.handlers import WhatsAppHandler
+
+        handler = WhatsAppHandler()
+        close_old_connections()
+        for number, message in batch:
+            try:
+                body = loads(message)
+                event = body['hook']['event']
+            except (ValueError, TypeError, KeyError):
+                event = None
+            if not isinstance(event, six.string_types):
+                logger.warning(
+                    'Invalid event on websocket for %s: %r' % (
+                        number, message))
+                continue
+
+            for channel in self.channels_for(number, event):
+                request = EventRequest('websocket:%s' % (number,), message)
+                try:
+                    # Each event is committed on its own so its messages
+                    # reach flows straight away
+                    with transaction.atomic():
+                        handler.handle_event(request, channel.uuid, body)
+                except Exception:
+                    logger.exception(
+                        'Unable to process %s event for %s.' % (
+                            event, channel.uuid))
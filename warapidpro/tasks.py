@@ -1,14 +1,40 @@
-import json
+import time
+from uuid import uuid4
+from six.moves.urllib.parse import urlencode
 from datetime import datetime, timedelta
 from temba import celery_app
 from dateutil import parser
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q
 from warapidpro.types import (
     WhatsAppDirectType, WhatsAppGroupType, WHATSAPP_CHANNEL_TYPES)
 from warapidpro.views import DEFAULT_AUTH_URL
-from warapidpro.utils import session_for_channel
+from celery.signals import worker_process_shutdown
+from warapidpro.utils import session_for_channel, close_sessions
+from warapidpro.codec import channel_config, dumps, loads
+from warapidpro import metrics
+from warapidpro.scheduling import DEFAULT_MAX_ERROR_RATE
+
+LOOKUP_SLOT_KEY = 'warapidpro:lookup-slot:%s:%s'
+LOOKUP_QUEUE_KEY = 'warapidpro:lookup-queue:%s'
+LOOKUP_QUEUE_ORGS_KEY = 'warapidpro:lookup-queue-orgs'
+ORG_HAS_WHATSAPP_KEY = 'warapidpro:org-has-whatsapp:%s'
+DEFAULT_LOOKUP_DEBOUNCE = 60
+DEFAULT_LOOKUP_INTERVAL = 60 * 5
+DEFAULT_LOOKUP_BATCH_SIZE = 100
+DEFAULT_LOOKUP_CONCURRENCY = 4
+DEFAULT_LOOKUP_SLOT_TTL = 60 * 10
+DEFAULT_LOOKUP_REFRESH_SHARE = 0.25
+DEFAULT_CATCH_UP_OVERLAP = 60 * 5
+
+
+@worker_process_shutdown.connect
+def close_http_sessions(**kwargs):
+    # Pool processes exit without running atexit handlers
+    close_sessions()
 
 
 @celery_app.task
@@ -16,7 +42,7 @@ def refresh_channel_auth_token(channel_pk):
     from temba.channels.models import Channel
 
     channel = Channel.objects.get(pk=channel_pk)
-    config = channel.config_json()
+    config = channel_config(channel)
     authorization = config['authorization']
 
     wassup_url = getattr(
@@ -27,20 +53,26 @@ def refresh_channel_auth_token(channel_pk):
         settings, 'WASSUP_AUTH_CLIENT_SECRET', None)
 
     session = session_for_channel(channel)
-    response = session.post(
-        '%s/oauth/token/' % (wassup_url,),
-        {
-            "grant_type": "refresh_token",
-            "refresh_token": authorization['refresh_token'],
-            "client_id": client_id,
-            "client_secret": client_secret,
-        },
-        {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Accept": "application/json",
-        })
-    response.raise_for_status()
-    new_authorization = response.json()
+    try:
+        response = session.post(
+            '%s/oauth/token/' % (wassup_url,),
+            {
+                "grant_type": "refresh_token",
+                "refresh_token": authorization['refresh_token'],
+                "client_id": client_id,
+                "client_secret": client_secret,
+            },
+            {
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Accept": "application/json",
+            },
+            hooks={'response': metrics.wassup_request_hook('oauth_token')})
+        response.raise_for_status()
+        new_authorization = response.json()
+    except Exception:
+        metrics.incr('token_refresh', outcome='failure')
+        raise
+    metrics.incr('token_refresh', outcome='success')
 
     config.update({
         'authorization': new_authorization,
@@ -49,7 +81,7 @@ def refresh_channel_auth_token(channel_pk):
                 seconds=new_authorization['expires_in'])).isoformat(),
     })
 
-    channel.config = json.dumps(config)
+    channel.config = dumps(config)
     channel.save()
 
 
@@ -61,7 +93,7 @@ def refresh_channel_auth_tokens(delta=timedelta(minutes=5)):
         Q(channel_type=WhatsAppGroupType.code),
         is_active=True)
     for channel in channels:
-        config = channel.config_json()
+        config = channel_config(channel)
         # This is for integrations that are pre-oauth
         # and which use an api_token which doesn't expire
         if 'expires_at' not in config:
@@ -73,107 +105,270 @@ def refresh_channel_auth_tokens(delta=timedelta(minutes=5)):
 
 
 @celery_app.task
-def update_whatsappable_contacts(sample_size=100):
+def update_whatsappable_contacts(sample_size=100, delta=timedelta(days=7)):
+    """
+    Shares the lookup capacity for this interval between orgs using
+    weighted max-min fairness, capacity an org doesn't need goes to
+    the orgs with a backlog.
+
+    Each org asks for as much of its backlog of unchecked and stale
+    contacts as its channels can look up in the interval at their
+    recent latency, between WASSUP_LOOKUP_MIN_SAMPLE and its channels'
+    quota.
+
+    WASSUP_LOOKUP_CAPACITY defaults to what every org would have been
+    given before, a sample of new and a sample of stale contacts.
+
+    WASSUP_LOOKUP_REFRESH_SHARE of each org's allocation is kept for
+    stale contacts so a steady stream of new contacts can't hold up
+    refreshes, whatever either side doesn't use goes to the other.
+    """
     from temba.orgs.models import Org
+    from warapidpro.scheduling import (
+        fair_share, adaptive_sample_size, get_lookup_latency)
 
     orgs_with_whatsapp = Org.objects.filter(
         channels__channel_type__in=WHATSAPP_CHANNEL_TYPES).distinct('id')
+
+    channel_quota = getattr(
+        settings, 'WASSUP_LOOKUP_CHANNEL_QUOTA', sample_size * 2)
+    minimum = getattr(settings, 'WASSUP_LOOKUP_MIN_SAMPLE', 10)
+    interval = getattr(
+        settings, 'WASSUP_LOOKUP_INTERVAL', DEFAULT_LOOKUP_INTERVAL)
+    concurrency = getattr(
+        settings, 'WASSUP_LOOKUP_CONCURRENCY', DEFAULT_LOOKUP_CONCURRENCY)
+    weights = getattr(settings, 'WASSUP_LOOKUP_ORG_WEIGHTS', {})
+    refresh_share = getattr(
+        settings, 'WASSUP_LOOKUP_REFRESH_SHARE', DEFAULT_LOOKUP_REFRESH_SHARE)
+
+    demands = {}
+    orgs = {}
     for org in orgs_with_whatsapp:
-        check_org_whatsappable(org.pk, sample_size=sample_size)
-        refresh_org_whatsappable(org.pk, sample_size=sample_size)
+        orgs[org.pk] = org
+        channels = get_lookup_channels(org)
+        maximum = channel_quota * len(channels)
+        demands[org.pk] = adaptive_sample_size(
+            lookup_backlog(org, maximum, delta=delta),
+            get_lookup_latency([channel_pk for channel_pk, _ in channels]),
+            len(channels), interval, concurrency, minimum, maximum)
+
+    capacity = getattr(
+        settings, 'WASSUP_LOOKUP_CAPACITY', sample_size * 2 * len(demands))
+    allocations = fair_share(demands, capacity, weights=weights)
+
+    for org_pk, allocation in allocations.items():
+        if not allocation:
+            continue
+        # New contacts get what's left after the refresh share, or less
+        # if there aren't that many, and refreshes get the rest
+        new_share = min(
+            unchecked_contacts(orgs[org_pk])[:allocation].count(),
+            allocation - int(allocation * refresh_share))
+        refreshed = 0
+        if allocation > new_share:
+            refreshed = refresh_org_whatsappable(
+                org_pk, sample_size=allocation - new_share, delta=delta)
+        if allocation > refreshed:
+            check_org_whatsappable(
+                org_pk, sample_size=allocation - refreshed)
+
+
+def get_lookup_channels(org):
+    """
+    The org's active WhatsApp channels that are healthy enough to do
+    lookups, as an ordered list of (channel_pk, weight) tuples.
+    """
+    from warapidpro.scheduling import channel_weights
+
+    channel_pks = org.channels.filter(
+        channel_type__in=WHATSAPP_CHANNEL_TYPES,
+        is_active=True).order_by('-modified_on').values_list('pk', flat=True)
+    return channel_weights(
+        list(channel_pks),
+        max_error_rate=getattr(
+            settings, 'WASSUP_LOOKUP_MAX_ERROR_RATE',
+            DEFAULT_MAX_ERROR_RATE))
+
+
+def lookup_backlog(org, limit, delta=timedelta(days=7)):
+    """
+    The number of unchecked and stale contacts for an org, counting
+    stops at limit so this stays cheap for orgs with millions of
+    contacts.
+    """
+    from warapidpro.models import WhatsAppLookup
+
+    if not limit:
+        return 0
+
+    unchecked = unchecked_contacts(org)[:limit].count()
+    if unchecked >= limit:
+        return limit
+
+    stale = WhatsAppLookup.objects.filter(
+        org=org,
+        checked_at__lte=timezone.now() - delta)[:limit - unchecked].count()
+    return unchecked + stale
+
+
+def unchecked_contacts(org):
+    """
+    The org's contacts that have a tel URN but no lookup row, contacts
+    without a tel URN can't be looked up and would otherwise be picked
+    first on every run.
+    """
+    from temba.contacts.models import Contact, TEL_SCHEME
+
+    # The reverse one-to-one isnull filter is a LEFT JOIN, the URN
+    # filter a join that needs distinct for contacts with several
+    return Contact.objects.filter(
+        org=org, is_active=True, whatsapp_lookup__isnull=True,
+        urns__scheme=TEL_SCHEME).distinct()
 
 
 @celery_app.task
-def check_org_whatsappable(org_pk, sample_size=100):
-    from warapidpro.models import (
-        has_whatsapp_contactfield, has_whatsapp_timestamp_contactfield)
-    from temba.contacts.models import Contact
+def check_org_whatsappable(org_pk, sample_size=100, batch_size=None):
     from temba.orgs.models import Org
 
     org = Org.objects.get(pk=org_pk)
 
-    channels = org.channels.filter(
-        channel_type__in=WHATSAPP_CHANNEL_TYPES, is_active=True)
-    if not channels.exists():
-        return
-
-    channel = channels.order_by('-modified_on').first()
+    channels = get_lookup_channels(org)
+    if not channels:
+        return 0
 
-    has_whatsapp = has_whatsapp_contactfield(org)
-    has_whatsapp_timestamp = has_whatsapp_timestamp_contactfield(org)
-
-    # Django's ORM only way of modelling this query is by using
-    # .exclude() which introduces a massive subquery which is extremely
-    # inefficient.
-    new_contacts = Contact.objects.raw("""
-        SELECT "contacts_contact".*
-        FROM "contacts_contact"
-        LEFT JOIN "values_value"
-            ON "contacts_contact"."id" = "values_value"."contact_id"
-        WHERE "contacts_contact"."org_id" = %s
-        AND (("values_value"."contact_field_id" != %s
-                AND "values_value"."contact_field_id" != %s)
-                OR "values_value"."contact_field_id" IS NULL)
-        ORDER BY RANDOM() ASC
-        LIMIT %s
-        """, [org.pk, has_whatsapp.pk, has_whatsapp_timestamp.pk, sample_size])
+    new_contacts = list(unchecked_contacts(org).order_by(
+        'pk').values_list('pk', flat=True)[:sample_size])
 
     if not new_contacts:
-        return
+        return 0
 
-    check_contact_whatsappable.delay(
-        [contact.pk for contact in new_contacts], channel.pk)
+    dispatch_lookups(new_contacts, channels, batch_size=batch_size)
+    return len(new_contacts)
 
 
 @celery_app.task
-def refresh_org_whatsappable(org_pk, sample_size=100, delta=timedelta(days=7)):
-    from warapidpro.models import (
-        has_whatsapp_contactfield, has_whatsapp_timestamp_contactfield)
-    from temba.contacts.models import Contact
+def refresh_org_whatsappable(org_pk, sample_size=100, delta=timedelta(days=7),
+                             batch_size=None):
+    from warapidpro.models import WhatsAppLookup
     from temba.orgs.models import Org
 
     org = Org.objects.get(pk=org_pk)
 
-    channels = org.channels.filter(
-        channel_type__in=WHATSAPP_CHANNEL_TYPES, is_active=True)
-    if not channels.exists():
-        return
-
-    channel = channels.order_by('-modified_on').first()
-
-    has_whatsapp = has_whatsapp_contactfield(org)
-    has_whatsapp_timestamp = has_whatsapp_timestamp_contactfield(org)
+    channels = get_lookup_channels(org)
+    if not channels:
+        return 0
 
-    checked_before = Contact.objects.filter(
-        org=org, values__contact_field=has_whatsapp)
+    selected_for_refreshing = list(WhatsAppLookup.objects.filter(
+        org=org, checked_at__lte=timezone.now() - delta).order_by(
+            'checked_at').values_list('contact_id', flat=True)[:sample_size])
 
-    needing_refreshing = checked_before.filter(
-        values__contact_field=has_whatsapp_timestamp,
-        values__datetime_value__lte=timezone.now() - delta)
+    if not selected_for_refreshing:
+        return 0
+
+    dispatch_lookups(
+        selected_for_refreshing, channels, batch_size=batch_size)
+    return len(selected_for_refreshing)
+
+
+def dispatch_lookups(contact_pks, channels, batch_size=None):
+    """
+    Splits contact_pks into chunks of batch_size and queues a lookup
+    task for each, spreading the chunks over the (channel_pk, weight)
+    tuples in channels in proportion to their weight. Chunks run
+    concurrently up to the per channel limit of WASSUP_LOOKUP_CONCURRENCY.
+    """
+    from warapidpro.scheduling import weighted_round_robin
+
+    batch_size = batch_size or getattr(
+        settings, 'WASSUP_LOOKUP_BATCH_SIZE', DEFAULT_LOOKUP_BATCH_SIZE)
+    chunks = [
+        contact_pks[index:index + batch_size]
+        for index in range(0, len(contact_pks), batch_size)]
+    for chunk, channel_pk in zip(
+            chunks, weighted_round_robin(channels, len(chunks))):
+        check_contact_whatsappable.delay(chunk, channel_pk)
+
+
+def acquire_lookup_slot(channel_pk):
+    """
+    Claims one of the channel's WASSUP_LOOKUP_CONCURRENCY lookup slots,
+    returns the slot to release or None if they're all taken. Each slot
+    is a key of its own so one leaked by a killed worker expires by
+    itself without affecting the others.
+    """
+    limit = getattr(
+        settings, 'WASSUP_LOOKUP_CONCURRENCY', DEFAULT_LOOKUP_CONCURRENCY)
+    token = uuid4().hex
+    for slot in range(limit):
+        key = LOOKUP_SLOT_KEY % (channel_pk, slot)
+        if cache.add(key, token, DEFAULT_LOOKUP_SLOT_TTL):
+            return key, token
+    return None
+
+
+def release_lookup_slot(slot):
+    key, token = slot
+    # The slot may have expired and been taken by another lookup
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def lookup_msisdns(channel, msisdns, wait=True):
+    """
+    Submits msisdns to Wassup's lookup API for the given channel's number.
+    When ``wait`` is False Wassup returns immediately and records that
+    have not been resolved yet are returned with ``wa_exists`` set to None.
+    """
+    config = channel_config(channel)
+    authorization = config.get('authorization', {})
+    token = authorization.get('access_token') or config.get('api_token')
 
-    selected_for_refreshing = needing_refreshing.order_by('?')[:sample_size]
+    wassup_url = getattr(
+        settings, 'WASSUP_AUTH_URL', DEFAULT_AUTH_URL)
 
-    if not selected_for_refreshing:
-        return
+    session = session_for_channel(channel)
+    response = session.post(
+        '%s/api/v1/lookups/' % (wassup_url,),
+        data=dumps({
+            "number": channel.address,
+            "msisdns": msisdns,
+            "wait": wait,
+        }),
+        headers={
+            'Authorization': '%s %s' % (
+                authorization.get('token_type', 'Token'), token,),
+            'Content-Type': 'application/json',
+        },
+        hooks={'response': metrics.wassup_request_hook('lookups')})
 
-    check_contact_whatsappable.delay(
-        [contact.pk for contact in selected_for_refreshing], channel.pk)
+    response.raise_for_status()
+    return loads(response.content)
 
 
-@celery_app.task
-def check_contact_whatsappable(contact_pks, channel_pk):
+@celery_app.task(bind=True, max_retries=None)
+def check_contact_whatsappable(self, contact_pks, channel_pk, attempt=0):
     from warapidpro.models import (
         has_whatsapp_contactfield, has_whatsapp_timestamp_contactfield,
-        get_whatsappable_group, YES, NO)
+        get_whatsappable_group, update_whatsappable_group,
+        get_org_administrator, get_cached_lookups, cache_lookups,
+        WhatsAppLookup, YES, NO)
+    from warapidpro.scheduling import (
+        record_lookup_latency, record_lookup_error)
     from temba.contacts.models import Contact, TEL_SCHEME
     from temba.channels.models import Channel
 
+    # When not waiting we submit the lookup and return straight away,
+    # whatever Wassup hasn't resolved yet is collected by this same task
+    # being scheduled again for the pending contacts.
+    wait = getattr(settings, 'WASSUP_LOOKUP_WAIT', True)
+    poll_interval = getattr(settings, 'WASSUP_LOOKUP_POLL_INTERVAL', 30)
+    poll_attempts = getattr(settings, 'WASSUP_LOOKUP_POLL_ATTEMPTS', 10)
+
     channel = Channel.objects.get(pk=channel_pk)
     org = channel.org
     has_whatsapp = has_whatsapp_contactfield(org)
     has_whatsapp_timestamp = has_whatsapp_timestamp_contactfield(org)
-    # Make sure the group exists
-    get_whatsappable_group(org)
+    group = get_whatsappable_group(org)
 
     contacts = Contact.objects.filter(pk__in=contact_pks)
     contacts_and_urns = [
@@ -183,43 +378,256 @@ def check_contact_whatsappable(contact_pks, channel_pk):
          for urn, contact in contacts_and_urns
          if urn is not None])
 
-    config = channel.config_json()
-    authorization = config.get('authorization', {})
-    token = authorization.get('access_token') or config.get('api_token')
+    # Serve what we can from the shared lookup cache and only send
+    # the misses to Wassup
+    lookups = get_cached_lookups(contacts_and_msisdns.keys())
+    msisdns_to_lookup = [
+        msisdn for msisdn in contacts_and_msisdns
+        if msisdn not in lookups]
+
+    if msisdns_to_lookup:
+        slot = acquire_lookup_slot(channel_pk)
+        if slot is None:
+            raise self.retry(countdown=poll_interval)
+        metrics.histogram('lookup.batch_size', len(msisdns_to_lookup))
+        try:
+            started = time.time()
+            records = lookup_msisdns(channel, msisdns_to_lookup, wait=wait)
+            record_lookup_latency(
+                channel_pk, time.time() - started, len(msisdns_to_lookup))
+        except Exception:
+            record_lookup_error(channel_pk, True)
+            raise
+        else:
+            record_lookup_error(channel_pk, False)
+        finally:
+            release_lookup_slot(slot)
+
+        checked_at = timezone.now()
+        new_lookups = dict(
+            (record['msisdn'], (record['wa_exists'], checked_at))
+            for record in records)
+        cache_lookups(new_lookups)
+        lookups.update(new_lookups)
+
+    pending = [
+        msisdn for msisdn, (wa_exists, _) in lookups.items()
+        if wa_exists is None and msisdn in contacts_and_msisdns]
+    if not wait and pending and attempt < poll_attempts:
+        check_contact_whatsappable.apply_async(
+            ([contacts_and_msisdns[msisdn].pk for msisdn in pending],
+             channel_pk),
+            {'attempt': attempt + 1},
+            countdown=poll_interval)
+        for msisdn in pending:
+            del lookups[msisdn]
+
+    # Commit per chunk so a failure elsewhere doesn't lose this work
+    with transaction.atomic():
+        contact_lookups = dict(
+            (contacts_and_msisdns[msisdn].pk, lookup)
+            for msisdn, lookup in lookups.items()
+            if msisdn in contacts_and_msisdns)
+        # Contacts that lost their tel URN are marked as checked so
+        # refreshes don't keep selecting them
+        now = timezone.now()
+        contact_lookups.update(
+            (contact.pk, (None, now))
+            for urn, contact in contacts_and_urns if urn is None)
+        WhatsAppLookup.record(org, contact_lookups)
+        user = get_org_administrator(org)
+        update_whatsappable_group(
+            group, user,
+            [contact_pk
+             for contact_pk, (wa_exists, _) in contact_lookups.items()
+             if wa_exists is True],
+            [contact_pk
+             for contact_pk, (wa_exists, _) in contact_lookups.items()
+             if wa_exists is False])
+
+        for msisdn, (wa_exists, checked_at) in lookups.items():
+            contact = contacts_and_msisdns.get(msisdn)
+            if contact is None:
+                continue
+
+            if wa_exists is True:
+                contact.set_field(
+                    user=user, key=has_whatsapp.key, value=YES)
+            elif wa_exists is False:
+                contact.set_field(
+                    user=user, key=has_whatsapp.key, value=NO)
 
-    wassup_url = getattr(
-        settings, 'WASSUP_AUTH_URL', DEFAULT_AUTH_URL)
+            contact.set_field(
+                user=user, key=has_whatsapp_timestamp.key, value=checked_at)
 
-    session = session_for_channel(channel)
-    response = session.post(
-        '%s/api/v1/lookups/' % (wassup_url,),
-        data=json.dumps({
-            "number": channel.address,
-            "msisdns": [urn for urn in contacts_and_msisdns],
-            "wait": True,
-        }),
-        headers={
-            'Authorization': '%s %s' % (
-                authorization.get('token_type', 'Token'), token,),
-            'Content-Type': 'application/json',
-        })
 
-    response.raise_for_status()
+def org_has_whatsapp(org_pk):
+    from temba.channels.models import Channel
 
-    for record in response.json():
-        msisdn = record['msisdn']
-        wa_exists = record['wa_exists']
+    key = ORG_HAS_WHATSAPP_KEY % (org_pk,)
+    has_whatsapp = cache.get(key)
+    if has_whatsapp is None:
+        has_whatsapp = Channel.objects.filter(
+            org_id=org_pk, channel_type__in=WHATSAPP_CHANNEL_TYPES,
+            is_active=True).exists()
+        cache.set(key, has_whatsapp, 60 * 5)
+    return has_whatsapp
 
-        contact = contacts_and_msisdns.get(msisdn)
-        if wa_exists is True:
-            contact.set_field(
-                user=org.administrators.first(),
-                key=has_whatsapp.key, value=YES)
-        elif wa_exists is False:
-            contact.set_field(
-                user=org.administrators.first(),
-                key=has_whatsapp.key, value=NO)
 
-        contact.set_field(
-            user=org.administrators.first(),
-            key=has_whatsapp_timestamp.key, value=timezone.now())
+def enqueue_contact_lookup(org_pk, contact_pk):
+    """
+    Adds a contact to the org's lookup queue, the queue is flushed
+    into lookup tasks once it reaches WASSUP_LOOKUP_BATCH_SIZE or once
+    the oldest entry is WASSUP_LOOKUP_DEBOUNCE seconds old.
+    """
+    from django_redis import get_redis_connection
+
+    batch_size = getattr(
+        settings, 'WASSUP_LOOKUP_BATCH_SIZE', DEFAULT_LOOKUP_BATCH_SIZE)
+
+    pipe = get_redis_connection().pipeline()
+    pipe.sadd(LOOKUP_QUEUE_KEY % (org_pk,), contact_pk)
+    pipe.scard(LOOKUP_QUEUE_KEY % (org_pk,))
+    pipe.hsetnx(LOOKUP_QUEUE_ORGS_KEY, org_pk, time.time())
+    _, queue_size, _ = pipe.execute()
+
+    if queue_size >= batch_size:
+        flush_org_lookup_queue.delay(org_pk)
+
+
+@celery_app.task
+def flush_org_lookup_queue(org_pk):
+    from django_redis import get_redis_connection
+    from temba.orgs.models import Org
+
+    pipe = get_redis_connection().pipeline()
+    pipe.smembers(LOOKUP_QUEUE_KEY % (org_pk,))
+    pipe.delete(LOOKUP_QUEUE_KEY % (org_pk,))
+    pipe.hdel(LOOKUP_QUEUE_ORGS_KEY, org_pk)
+    contact_pks, _, _ = pipe.execute()
+
+    if not contact_pks:
+        return
+
+    org = Org.objects.get(pk=org_pk)
+    channels = get_lookup_channels(org)
+    if not channels:
+        return
+
+    dispatch_lookups(
+        sorted(int(contact_pk) for contact_pk in contact_pks), channels)
+
+
+@celery_app.task
+def flush_lookup_queues():
+    from django_redis import get_redis_connection
+
+    debounce = getattr(
+        settings, 'WASSUP_LOOKUP_DEBOUNCE', DEFAULT_LOOKUP_DEBOUNCE)
+    marker = time.time() - debounce
+
+    queued_orgs = get_redis_connection().hgetall(LOOKUP_QUEUE_ORGS_KEY)
+    for org_pk, queued_at in queued_orgs.items():
+        if float(queued_at) <= marker:
+            flush_org_lookup_queue.delay(int(org_pk))
+
+
+@celery_app.task
+def catch_up_channels():
+    from temba.channels.models import Channel
+
+    channels = Channel.objects.filter(
+        channel_type__in=WHATSAPP_CHANNEL_TYPES,
+        is_active=True).exclude(org=None)
+    for channel in channels:
+        catch_up_channel.delay(channel.pk)
+
+
+@celery_app.task
+def catch_up_channel(channel_pk):
+    """
+    Pages through Wassup's messages for the channel's number since the
+    last completed catch up and ingests whatever inbound messages and
+    delivery statuses we missed while webhooks weren't getting through.
+    """
+    from warapidpro.handlers import get_event_cursor, set_event_cursor
+    from temba.channels.models import Channel
+
+    channel = Channel.objects.get(pk=channel_pk)
+    started = time.time()
+    cursor = get_event_cursor(channel.uuid)
+    if cursor is None:
+        # Start catching up from the first run for the channel
+        set_event_cursor(channel.uuid, started)
+        return
+
+    # Go back a bit in case events arrived out of order, duplicates
+    # are skipped by their external ids.
+    overlap = getattr(
+        settings, 'WASSUP_CATCH_UP_OVERLAP', DEFAULT_CATCH_UP_OVERLAP)
+    since = datetime.utcfromtimestamp(cursor - overlap).isoformat()
+
+    channel_type = channel.get_type()
+    headers = channel_type.api_request_headers(channel)
+    session = session_for_channel(channel)
+    url = '%s/messages/?%s' % (
+        channel_type.wassup_url(),
+        urlencode({'number': channel.address, 'since': since}))
+
+    while url:
+        response = session.get(
+            url, headers=headers,
+            hooks={'response': metrics.wassup_request_hook('messages')})
+        response.raise_for_status()
+        data = loads(response.content)
+        with transaction.atomic():
+            ingest_missed_messages(channel, data['results'])
+        url = data.get('next')
+
+    set_event_cursor(channel.uuid, started)
+
+
+def ingest_missed_messages(channel, messages):
+    from warapidpro.handlers import WhatsAppHandler
+    from warapidpro.streaming import EventRequest
+    from temba.msgs.models import Msg, INCOMING, OUTGOING, DELIVERED, FAILED
+
+    kind = 'group' if channel.channel_type == WhatsAppGroupType.code else (
+        'direct')
+    inbound = [
+        message for message in messages
+        if message['from_addr'] != channel.address]
+    outbound = [
+        message for message in messages
+        if message['from_addr'] == channel.address and
+        message.get('status') in ('delivered', 'failed')]
+
+    # One query per direction to find out what we already have
+    seen_inbound = set(Msg.objects.filter(
+        channel=channel, direction=INCOMING,
+        external_id__in=[message['uuid'] for message in inbound]).values_list(
+            'external_id', flat=True))
+    outbound_statuses = dict(Msg.objects.filter(
+        channel=channel, direction=OUTGOING,
+        external_id__in=[message['uuid'] for message in outbound]).values_list(
+            'external_id', 'status'))
+
+    events = [
+        ('message.%s_inbound' % (kind,), message)
+        for message in inbound
+        if message['uuid'] not in seen_inbound]
+    events.extend([
+        ('message.%s_outbound.status' % (kind,), {
+            'message_uuid': message['uuid'],
+            'status': message['status'],
+        })
+        for message in outbound
+        if message['uuid'] in outbound_statuses and
+        outbound_statuses[message['uuid']] not in (DELIVERED, FAILED)])
+
+    handler = WhatsAppHandler()
+    for event, data in events:
+        body = {'hook': {'event': event}, 'data': data}
+        handler.handle_event(
+            EventRequest('catch-up:%s' % (channel.address,), dumps(body)),
+            channel.uuid, body)
@@ -0,0 +1,137 @@
+"""
+Query and wall time budgets for the hot paths.
+
+Tests wrap a call to a budgeted handler in assertWithinBudget, which
+fails with a report of every query run if the call makes more queries
+than its budget, with repeated statements called out as likely N+1s.
+Batches are run at two sizes by assertBatchWithinBudget so the queries
+per item are budgeted separately from the fixed cost.
+
+Wall time depends on the machine running the tests so it is only
+checked against the budgets with WASSUP_BUDGET_TIMINGS=1 in the
+environment.
+"""
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# The budgets are upper bounds that still need to be measured on the
+# RapidPro image this is tested against.
+# name -> (maximum queries, maximum seconds) for a single event
+BUDGETS = {
+    'handle_direct_inbound': (25, 1.0),
+    'handle_group_inbound': (25, 1.0),
+    'handle_duplicate_inbound': (1, 0.5),
+    'handle_outbound_status': (8, 1.0),
+    'handle_foreign_status': (3, 0.5),
+}
+# name -> (maximum fixed queries, maximum queries per item, maximum
+# seconds for a batch of twice LOOKUP_BATCH_SIZE). The per contact
+# queries are RapidPro's set_field and group updates, everything of
+# our own is done per batch.
+BATCH_BUDGETS = {
+    'check_contact_whatsappable': (20, 14, 10.0),
+}
+LOOKUP_BATCH_SIZE = 10
+
+# Literals are replaced so statements repeated with different values
+# are grouped together in the report
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def normalize(sql):
+    return LITERALS.sub('?', sql)
+
+
+def time_budgets_enabled():
+    return os.environ.get('WASSUP_BUDGET_TIMINGS') == '1'
+
+
+def budget_report(name, queries, elapsed, max_queries, max_seconds=None):
+    """
+    max_seconds is None when wall time isn't budgeted.
+    """
+    budget = '%s queries' % (max_queries,)
+    if max_seconds is not None:
+        budget = '%s in %.3fs' % (budget, max_seconds)
+    lines = [
+        '%s ran %s queries in %.3fs, its budget is %s.' % (
+            name, len(queries), elapsed, budget),
+    ]
+    repeated = [
+        (count, sql) for sql, count in Counter(
+            normalize(query['sql']) for query in queries).most_common()
+        if count > 1]
+    if repeated:
+        lines.append('Repeated statements:')
+        lines.extend(
+            '  %sx %s' % (count, sql[:200]) for count, sql in repeated)
+    lines.append('Queries:')
+    lines.extend(
+        '  %s. %s' % (index, query['sql'][:200])
+        for index, query in enumerate(queries, 1))
+    return '\n'.join(lines)
+
+
+def batch_report(name, small, large, size, max_fixed, max_per_item,
+                 max_seconds=None):
+    (small_queries, _), (large_queries, elapsed) = small, large
+    per_item = (len(large_queries) - len(small_queries)) / float(size)
+    fixed = len(small_queries) - per_item * size
+    if (fixed <= max_fixed and per_item <= max_per_item and
+            (max_seconds is None or elapsed <= max_seconds)):
+        return None
+    return '\n'.join([
+        '%s ran %s queries for %s items and %s for %s, %.1f fixed and %.1f '
+        'per item, its budget is %s fixed and %s per item.' % (
+            name, len(small_queries), size, len(large_queries), size * 2,
+            fixed, per_item, max_fixed, max_per_item),
+        budget_report(
+            name, large_queries, elapsed,
+            max_fixed + max_per_item * size * 2, max_seconds),
+    ])
+
+
+class BudgetMixin(object):
+
+    @contextmanager
+    def assertWithinBudget(self, name):
+        max_queries, max_seconds = BUDGETS[name]
+        if not time_budgets_enabled():
+            max_seconds = None
+        with CaptureQueriesContext(connection) as captured:
+            started = time.time()
+            yield
+            elapsed = time.time() - started
+
+        queries = captured.captured_queries
+        if len(queries) > max_queries or (
+                max_seconds is not None and elapsed > max_seconds):
+            self.fail(budget_report(
+                name, queries, elapsed, max_queries, max_seconds))
+
+    def capture(self, func, *args):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.time()
+            func(*args)
+            elapsed = time.time() - started
+        return captured.captured_queries, elapsed
+
+    def assertBatchWithinBudget(self, name, run, size=LOOKUP_BATCH_SIZE):
+        """
+        Calls run with batch sizes of size and twice size, an N+1 in
+        the batch shows up as more queries per item than budgeted.
+        """
+        max_fixed, max_per_item, max_seconds = BATCH_BUDGETS[name]
+        if not time_budgets_enabled():
+            max_seconds = None
+        report = batch_report(
+            name, self.capture(run, size), self.capture(run, size * 2),
+            size, max_fixed, max_per_item, max_seconds)
+        if report is not None:
+            self.fail(report)
@@ -0,0 +1,65 @@
+import json
+import os
+import shutil
+import tempfile
+
+from mock import patch
+from six import StringIO
+from django.test import SimpleTestCase
+
+from warapidpro.benchmarks.base import percentile
+from warapidpro.benchmarks.compare import compare, main
+
+
+def result(ops_per_sec, p90, queries, peak_kb=None):
+    return {
+        'ops_per_sec': ops_per_sec,
+        'latency_ms': {'p90': p90},
+        'queries_per_call': queries,
+        'peak_alloc_kb': peak_kb,
+    }
+
+
+class BenchmarkTestCase(SimpleTestCase):
+
+    def test_percentile(self):
+        ordered = list(range(1, 101))
+        self.assertEqual(percentile(ordered, 0.5), 50)
+        self.assertEqual(percentile(ordered, 0.99), 99)
+        self.assertEqual(percentile([7], 0.9), 7)
+
+    def test_compare(self):
+        rows = compare(
+            {'a': result(100, 10, 5), 'gone': result(1, 1, 1)},
+            {'a': result(95, 12, 5), 'new': result(1, 1, 1)},
+            0.1)
+        self.assertEqual(
+            [(name, metric, regressed)
+             for name, metric, _, _, _, regressed in rows],
+            [('gone', 'missing', True),
+             ('a', 'ops_per_sec', False), ('a', 'p90_ms', True),
+             ('a', 'queries', False)])
+
+    def test_compare_extra_query(self):
+        [_, _, queries] = compare(
+            {'a': result(100, 10, 5)}, {'a': result(100, 10, 5.5)}, 0.1)
+        self.assertEqual(queries[1], 'queries')
+        self.assertTrue(queries[-1])
+
+    def test_main_missing_benchmark(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        paths = []
+        for name, results in (
+                ('old', {'a': result(100, 10, 5), 'b': result(1, 1, 1)}),
+                ('new', {'a': result(100, 10, 5)})):
+            path = os.path.join(directory, '%s.json' % (name,))
+            with open(path, 'w') as fp:
+                json.dump({'version': name, 'results': results}, fp)
+            paths.append(path)
+
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.assertEqual(main(paths), 1)
+        self.assertTrue('b                            MISSING' in
+                        stdout.getvalue())
+        self.assertTrue('1 regressions.' in stdout.getvalue())
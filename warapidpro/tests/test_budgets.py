@@ -0,0 +1,83 @@
+import os
+
+from django.test import SimpleTestCase
+from mock import patch
+
+from warapidpro.tests.budgets import (
+    BudgetMixin, batch_report, budget_report, normalize)
+
+
+class BudgetReportTestCase(SimpleTestCase):
+
+    def test_normalize(self):
+        self.assertEqual(
+            normalize("SELECT * FROM msgs_msg WHERE id = 12 AND x = 'it''s'"),
+            'SELECT * FROM msgs_msg WHERE id = ? AND x = ?')
+
+    def test_report(self):
+        report = budget_report('handle_outbound_status', [
+            {'sql': 'SELECT 1 FROM channels_channel'},
+            {'sql': 'UPDATE msgs_msg SET status = 1 WHERE id = 10'},
+            {'sql': 'UPDATE msgs_msg SET status = 1 WHERE id = 11'},
+        ], 0.05, 2, 1.0)
+        self.assertEqual(report.splitlines(), [
+            'handle_outbound_status ran 3 queries in 0.050s, '
+            'its budget is 2 queries in 1.000s.',
+            'Repeated statements:',
+            '  2x UPDATE msgs_msg SET status = ? WHERE id = ?',
+            'Queries:',
+            '  1. SELECT 1 FROM channels_channel',
+            '  2. UPDATE msgs_msg SET status = 1 WHERE id = 10',
+            '  3. UPDATE msgs_msg SET status = 1 WHERE id = 11',
+        ])
+
+    def test_report_without_time_budget(self):
+        report = budget_report('handle_outbound_status', [
+            {'sql': 'SELECT 1 FROM channels_channel'},
+        ], 0.05, 2)
+        self.assertEqual(
+            report.splitlines()[0],
+            'handle_outbound_status ran 1 queries in 0.050s, '
+            'its budget is 2 queries.')
+
+    def test_batch_report(self):
+        def queries(count):
+            return [{'sql': 'SELECT %s' % (i,)} for i in range(count)]
+
+        self.assertEqual(batch_report(
+            'lookups', (queries(15), 0.1), (queries(25), 0.2), 5,
+            5, 2, 1.0), None)
+        report = batch_report(
+            'lookups', (queries(20), 0.1), (queries(35), 0.2), 5,
+            5, 2, 1.0)
+        self.assertEqual(
+            report.splitlines()[0],
+            'lookups ran 20 queries for 5 items and 35 for 10, 5.0 fixed '
+            'and 3.0 per item, its budget is 5 fixed and 2 per item.')
+
+        # Slow batches only fail when wall time is budgeted
+        self.assertEqual(batch_report(
+            'lookups', (queries(15), 0.1), (queries(25), 2.0), 5,
+            5, 2), None)
+        self.assertNotEqual(batch_report(
+            'lookups', (queries(15), 0.1), (queries(25), 2.0), 5,
+            5, 2, 1.0), None)
+
+
+class BudgetMixinTestCase(BudgetMixin, SimpleTestCase):
+
+    @patch('warapidpro.tests.budgets.CaptureQueriesContext')
+    @patch('warapidpro.tests.budgets.time.time')
+    def test_wall_time_opt_in(self, mock_time, mock_capture):
+        # No queries and every call appears to take 10 seconds
+        mock_capture.return_value.__enter__.return_value.captured_queries = []
+        mock_time.side_effect = [0, 10, 20, 30]
+
+        with patch.dict(os.environ, {'WASSUP_BUDGET_TIMINGS': ''}):
+            with self.assertWithinBudget('handle_outbound_status'):
+                pass
+
+        with patch.dict(os.environ, {'WASSUP_BUDGET_TIMINGS': '1'}):
+            with self.assertRaises(AssertionError):
+                with self.assertWithinBudget('handle_outbound_status'):
+                    pass
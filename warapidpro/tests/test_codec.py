@@ -0,0 +1,38 @@
+import json
+
+from django.test import SimpleTestCase, override_settings
+
+from warapidpro import codec
+
+
+class CodecTestCase(SimpleTestCase):
+
+    def setUp(self):
+        codec._codec = None
+        self.addCleanup(setattr, codec, '_codec', None)
+
+    def test_round_trip(self):
+        payload = {'content': u'Sawubona \xe9', 'msisdns': ['+27000000000']}
+        self.assertEqual(codec.loads(codec.dumps(payload)), payload)
+        self.assertEqual(json.loads(codec.dumps(payload)), payload)
+
+    def test_loads_bytes(self):
+        self.assertEqual(codec.loads(b'{"uuid": "the-uuid"}'), {
+            'uuid': 'the-uuid'})
+
+    def test_stdlib_is_available(self):
+        self.assertEqual(codec.available_codecs()[-1], 'json')
+
+    @override_settings(WASSUP_JSON_CODEC='json')
+    def test_setting(self):
+        self.assertEqual(codec.get_codec(), (json.loads, json.dumps))
+
+    def test_channel_config(self):
+        class FakeChannel(object):
+            config = None
+
+        channel = FakeChannel()
+        self.assertEqual(codec.channel_config(channel), {})
+        channel.config = '{"number": "+27000000000"}'
+        self.assertEqual(codec.channel_config(channel), {
+            'number': '+27000000000'})
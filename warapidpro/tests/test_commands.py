@@ -0,0 +1,132 @@
+from datetime import timedelta
+
+from mock import patch
+from six import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import override_settings
+from django.utils import timezone
+
+from temba.tests import TembaTest
+
+from temba.channels.models import Channel
+from warapidpro.types import WhatsAppDirectType
+from warapidpro.models import WhatsAppLookup
+from warapidpro.tasks import check_contact_whatsappable
+from warapidpro.management.commands.backfill_whatsappable import (
+    CHECKPOINT_KEY)
+
+
+class BackfillWhatsAppableTestCase(TembaTest):
+
+    def setUp(self):
+        super(BackfillWhatsAppableTestCase, self).setUp()
+        self.channel = Channel.create(
+            self.org, self.user, 'RW', WhatsAppDirectType.code,
+            None, '+27000000000',
+            config={
+                'authorization': {
+                    'token_type': 'Bearer',
+                    'access_token': 'foo',
+                }
+            },
+            uuid='00000000-0000-0000-0000-000000005678',
+            role=Channel.DEFAULT_ROLE)
+
+    def look_up(self, contact_pks, channel_pk):
+        WhatsAppLookup.record(self.org, dict(
+            (contact_pk, (True, timezone.now()))
+            for contact_pk in contact_pks))
+
+    @patch.object(check_contact_whatsappable, 'delay')
+    def test_backfill(self, mock_check):
+        mock_check.side_effect = self.look_up
+        contacts = [
+            self.create_contact("Contact %s" % (i,), "+2778838338%s" % (i,))
+            for i in range(3)]
+
+        stdout = StringIO()
+        call_command(
+            'backfill_whatsappable', self.org.pk, batch_size=2,
+            poll_interval=0, stdout=stdout)
+
+        self.assertEqual(
+            [args for args, _ in mock_check.call_args_list], [
+                ([contacts[0].pk, contacts[1].pk], self.channel.pk),
+                ([contacts[2].pk], self.channel.pk),
+            ])
+        self.assertTrue('3/3 contacts looked up' in stdout.getvalue())
+        self.assertEqual(cache.get(CHECKPOINT_KEY % (self.org.pk,)), None)
+
+    @override_settings(WASSUP_LOOKUP_CONCURRENCY=1)
+    @patch.object(check_contact_whatsappable, 'delay')
+    def test_backfill_throttled(self, mock_check):
+        contacts = [
+            self.create_contact("Contact %s" % (i,), "+2778838338%s" % (i,))
+            for i in range(3)]
+        WhatsAppLookup.record(self.org, {
+            contacts[0].pk: (False, timezone.now() - timedelta(days=2))})
+
+        def look_up(contact_pks, channel_pk):
+            # The last lookup never completes
+            if contact_pks != [contacts[2].pk]:
+                self.look_up(contact_pks, channel_pk)
+
+        mock_check.side_effect = look_up
+        stdout = StringIO()
+        call_command(
+            'backfill_whatsappable', self.org.pk, batch_size=1,
+            poll_interval=0, stall_timeout=0, stdout=stdout)
+
+        self.assertEqual(mock_check.call_count, 3)
+        self.assertTrue('giving up on 1 contacts' in stdout.getvalue())
+        self.assertTrue('2/3 contacts looked up' in stdout.getvalue())
+
+    @patch.object(check_contact_whatsappable, 'delay')
+    def test_backfill_skips_fresh_lookups(self, mock_check):
+        contacts = [
+            self.create_contact("Contact %s" % (i,), "+2778838338%s" % (i,))
+            for i in range(3)]
+        # Looked up within the cache TTL, a lookup now would be served
+        # from the cache with this same checked_at
+        checked_at = timezone.now() - timedelta(hours=1)
+        WhatsAppLookup.record(self.org, {
+            contacts[0].pk: (True, checked_at)})
+
+        def look_up(contact_pks, channel_pk):
+            WhatsAppLookup.record(self.org, dict(
+                (contact_pk, (True, checked_at))
+                for contact_pk in contact_pks))
+
+        mock_check.side_effect = look_up
+        stdout = StringIO()
+        call_command(
+            'backfill_whatsappable', self.org.pk, poll_interval=0,
+            stall_timeout=0, stdout=stdout)
+
+        mock_check.assert_called_once_with(
+            [contacts[1].pk, contacts[2].pk], self.channel.pk)
+        self.assertTrue('2/2 contacts looked up' in stdout.getvalue())
+        self.assertFalse('giving up' in stdout.getvalue())
+
+    @patch.object(check_contact_whatsappable, 'delay')
+    def test_backfill_resume(self, mock_check):
+        contacts = [
+            self.create_contact("Contact %s" % (i,), "+2778838338%s" % (i,))
+            for i in range(3)]
+        cache.set(CHECKPOINT_KEY % (self.org.pk,), contacts[1].pk)
+
+        mock_check.side_effect = self.look_up
+        call_command(
+            'backfill_whatsappable', self.org.pk, poll_interval=0,
+            stdout=StringIO())
+        mock_check.assert_called_once_with([contacts[2].pk], self.channel.pk)
+
+    def test_backfill_no_channel(self):
+        self.channel.is_active = False
+        self.channel.save()
+        with self.assertRaises(CommandError):
+            call_command(
+                'backfill_whatsappable', self.org.pk, stdout=StringIO())
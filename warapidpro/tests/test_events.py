@@ -0,0 +1,61 @@
+from django.test import SimpleTestCase
+
+from warapidpro.events import (
+    parse_event, InvalidEvent, InboundEvent, StatusEvent)
+
+
+class ParseEventTest(SimpleTestCase):
+
+    def test_inbound(self):
+        method_name, event = parse_event({
+            'hook': {'event': 'message.group_inbound'},
+            'data': {
+                'uuid': 'the-uuid',
+                'from_addr': '+31000000000',
+                'image_attachment': 'https://example.com/pic.jpg',
+                'image_attachment_caption': 'the caption',
+                'location': {'coordinates': [18.4, -33.9]},
+                'group': {'uuid': 'the-group-uuid'},
+            },
+        })
+        self.assertEqual(method_name, 'handle_group_inbound')
+        self.assertTrue(isinstance(event, InboundEvent))
+        self.assertEqual(event.uuid, 'the-uuid')
+        self.assertEqual(event.from_addr, '+31000000000')
+        self.assertEqual(event.content, 'the caption')
+        self.assertEqual(event.attachments, [
+            'image:https://example.com/pic.jpg',
+            'geo:-33.9,18.4',
+        ])
+        self.assertEqual(event.group_uuid, 'the-group-uuid')
+
+    def test_status(self):
+        method_name, event = parse_event({
+            'hook': {'event': 'message.direct_outbound.status'},
+            'data': {'message_uuid': 'the-uuid', 'status': 'delivered'},
+        })
+        self.assertEqual(method_name, 'handle_outbound_status')
+        self.assertTrue(isinstance(event, StatusEvent))
+        self.assertEqual(event.message_uuid, 'the-uuid')
+        self.assertEqual(event.status, 'delivered')
+
+    def test_unknown_event(self):
+        self.assertEqual(parse_event({'hook': {'event': 'foo'}}), None)
+        self.assertEqual(parse_event({}), None)
+
+    def test_invalid(self):
+        for body in [
+                [],
+                {'hook': 'message.direct_inbound'},
+                {'hook': {'event': 'message.direct_inbound'}, 'data': []},
+                {'hook': {'event': 'message.direct_inbound'},
+                 'data': {'uuid': 'the-uuid'}},
+                {'hook': {'event': 'message.direct_inbound'},
+                 'data': {'uuid': 'the-uuid', 'from_addr': 31000000000}},
+                {'hook': {'event': 'message.direct_inbound'},
+                 'data': {'uuid': 'the-uuid', 'from_addr': '+31000000000',
+                          'location': {'coordinates': []}}},
+                {'hook': {'event': 'message.direct_outbound.status'},
+                 'data': {'message_uuid': 'the-uuid'}}]:
+            with self.assertRaises(InvalidEvent):
+                parse_event(body)
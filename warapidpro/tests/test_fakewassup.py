@@ -0,0 +1,139 @@
+import json
+import threading
+
+import requests
+from django.test import SimpleTestCase
+from six.moves import BaseHTTPServer, queue
+
+from warapidpro.fakewassup import FakeWassup, FakeWassupServer
+
+
+class CaptureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length'))
+        self.server.received.put(json.loads(self.rfile.read(length)))
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeWassupTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.wassup = FakeWassup(page_size=2, groups=3, status_delay=0)
+        self.server = FakeWassupServer(('127.0.0.1', 0), self.wassup)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.url = self.server.url
+
+    def start_capture(self):
+        capture = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), CaptureHandler)
+        capture.received = queue.Queue()
+        thread = threading.Thread(
+            target=capture.serve_forever, kwargs={'poll_interval': 0.1})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(capture.server_close)
+        self.addCleanup(capture.shutdown)
+        return capture
+
+    def test_token(self):
+        response = requests.post('%s/oauth/token/' % (self.url,), {
+            'grant_type': 'authorization_code',
+            'code': 'the-code',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['token_type'], 'Bearer')
+
+    def test_groups_paginated(self):
+        response = requests.get('%s/api/v1/groups/' % (self.url,))
+        data = response.json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(len(data['results']), 2)
+
+        data = requests.get(data['next']).json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(data['next'], None)
+
+    def test_lookups(self):
+        self.wassup.wa_exists_rate = 1
+        response = requests.post('%s/api/v1/lookups/' % (self.url,), json={
+            'number': '+27000000000',
+            'msisdns': ['+27123456789'],
+            'wait': True,
+        })
+        self.assertEqual(response.json(), [
+            {'msisdn': '+27123456789', 'wa_exists': True}])
+
+    def test_pending_lookups(self):
+        self.wassup.pending_rate = 1
+        response = requests.post('%s/api/v1/lookups/' % (self.url,), json={
+            'number': '+27000000000',
+            'msisdns': ['+27123456789'],
+            'wait': False,
+        })
+        self.assertEqual(response.json(), [
+            {'msisdn': '+27123456789', 'wa_exists': None}])
+
+    def test_errors_and_throttling(self):
+        self.wassup.error_rate = 1
+        response = requests.get('%s/api/v1/numbers/' % (self.url,))
+        self.assertEqual(response.status_code, 500)
+
+        self.wassup.rate_limit = 1
+        requests.get('%s/api/v1/numbers/' % (self.url,))
+        response = requests.get('%s/api/v1/numbers/' % (self.url,))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+    def test_send_emits_status_webhook(self):
+        capture = self.start_capture()
+        webhook = requests.post('%s/api/v1/webhooks/' % (self.url,), json={
+            'event': 'message.direct_outbound.status',
+            'url': 'http://127.0.0.1:%s/' % (capture.server_address[1],),
+            'number': '+27000000000',
+        }).json()
+
+        response = requests.post('%s/api/v1/messages/' % (self.url,), json={
+            'number': '+27000000000',
+            'to_addr': '+27123456789',
+            'content': 'hello',
+        })
+        self.assertEqual(response.status_code, 201)
+        message_uuid = response.json()['uuid']
+
+        body = capture.received.get(timeout=5)
+        self.assertEqual(body['hook']['id'], webhook['id'])
+        self.assertEqual(
+            body['hook']['event'], 'message.direct_outbound.status')
+        self.assertEqual(body['data']['message_uuid'], message_uuid)
+        self.assertEqual(body['data']['status'], 'delivered')
+
+    def test_multipart_send(self):
+        response = requests.post(
+            '%s/api/v1/messages/' % (self.url,),
+            data={'number': '+27000000000', 'to_addr': '+27123456789'},
+            files={'image_attachment': ('a.jpg', b'\xff\xd8', 'image/jpeg')})
+        self.assertEqual(response.json()['to_addr'], '+27123456789')
+
+    def test_inbound_listed_for_catch_up(self):
+        capture = self.start_capture()
+        requests.post('%s/api/v1/webhooks/' % (self.url,), json={
+            'event': 'message.direct_inbound',
+            'url': 'http://127.0.0.1:%s/' % (capture.server_address[1],),
+            'number': '+27000000000',
+        })
+        self.wassup.drop_webhooks = 1
+        message = self.wassup.receive('+27000000000', '+27123456789', 'hi')
+        self.assertEqual(self.wassup.stats['webhooks_dropped'], 1)
+        self.assertTrue(capture.received.empty())
+
+        response = requests.get('%s/api/v1/messages/' % (self.url,), params={
+            'number': '+27000000000',
+            'since': '2000-01-01T00:00:00',
+        })
+        self.assertEqual(response.json()['results'], [message])
@@ -1,16 +1,20 @@
 import json
+from mock import patch
+from django.core.cache import cache
 from django.test import RequestFactory
 
 from temba.tests import TembaTest
 
 from temba.msgs.models import Msg, DELIVERED, FAILED
 
-from temba.channels.models import Channel
-from warapidpro.handlers import WhatsAppHandler
+from temba.channels.models import Channel, ChannelLog
+from warapidpro.handlers import WhatsAppHandler, get_event_cursor
+from warapidpro.timing import parse_timings
+from warapidpro.tests.budgets import BudgetMixin
 from warapidpro.types import WhatsAppDirectType, WhatsAppGroupType
 
 
-class DirectHandlerTest(TembaTest):
+class DirectHandlerTest(BudgetMixin, TembaTest):
 
     def setUp(self):
         super(DirectHandlerTest, self).setUp()
@@ -42,6 +46,117 @@ class DirectHandlerTest(TembaTest):
         self.assertEqual(msg.text, 'hello world')
         self.assertEqual(msg.channel, self.channel)
 
+        [log] = ChannelLog.objects.filter(msg=msg)
+        self.assertEqual(json.loads(log.response), {'message_id': msg.pk})
+        self.assertTrue(log.description.startswith('Handled inbound message.'))
+        self.assertEqual(
+            [phase for phase, _ in parse_timings(log.description)],
+            ['json', 'parse', 'channel', 'dedupe', 'db', 'total'])
+        # Only completed catch ups move the cursor
+        self.assertEqual(get_event_cursor(self.channel.uuid), None)
+
+    @patch('django.db.transaction.on_commit', side_effect=lambda fn: fn())
+    def test_message_direct_inbound_duplicate(self, mock_on_commit):
+        def post():
+            request = self.factory.post('/', data=json.dumps({
+                'hook': {
+                    'event': 'message.direct_inbound'
+                },
+                'data': {
+                    'uuid': 'the-uuid',
+                    'from_addr': '+31000000000',
+                    'to_addr': '+27000000000',
+                    'content': 'hello world',
+                }
+            }), content_type='application/json')
+            return self.handler.dispatch(request, uuid=self.channel.uuid)
+
+        response = post()
+        self.assertEqual(response.status_code, 201)
+        message_id = json.loads(response.content)['message_id']
+
+        # answered from the recent external id cache
+        response = post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content)['message_id'], message_id)
+
+        # answered from the database
+        cache.clear()
+        response = post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content)['message_id'], message_id)
+
+        self.assertEqual(
+            Msg.objects.filter(external_id='the-uuid').count(), 1)
+
+    def test_message_direct_inbound_in_flight(self):
+        request = self.factory.post('/', data=json.dumps({
+            'hook': {
+                'event': 'message.direct_inbound'
+            },
+            'data': {
+                'uuid': 'the-uuid',
+                'from_addr': '+31000000000',
+                'to_addr': '+27000000000',
+                'content': 'hello world',
+            }
+        }), content_type='application/json')
+
+        # claimed by a request that hasn't committed its message yet
+        self.assertEqual(
+            self.handler.claim_external_id(self.channel, 'the-uuid'), None)
+        response = self.handler.dispatch(request, uuid=self.channel.uuid)
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Msg.objects.filter(external_id='the-uuid').exists())
+
+    def test_message_direct_inbound_stored_on_commit(self):
+        def post():
+            request = self.factory.post('/', data=json.dumps({
+                'hook': {
+                    'event': 'message.direct_inbound'
+                },
+                'data': {
+                    'uuid': 'the-uuid',
+                    'from_addr': '+31000000000',
+                    'to_addr': '+27000000000',
+                    'content': 'hello world',
+                }
+            }), content_type='application/json')
+            return self.handler.dispatch(request, uuid=self.channel.uuid)
+
+        with patch('django.db.transaction.on_commit') as mock_on_commit:
+            response = post()
+        self.assertEqual(response.status_code, 201)
+        message_id = json.loads(response.content)['message_id']
+
+        # retried before the message is committed
+        self.assertEqual(post().status_code, 409)
+
+        [(callback,), _] = mock_on_commit.call_args
+        callback()
+        response = post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content)['message_id'], message_id)
+
+    def test_message_direct_inbound_invalid(self):
+        request = self.factory.post('/', data=json.dumps({
+            'hook': {
+                'event': 'message.direct_inbound'
+            },
+            'data': {
+                'uuid': 'the-uuid',
+                'content': 'hello world',
+            }
+        }), content_type='application/json')
+
+        with self.assertNumQueries(0):
+            response = self.handler.dispatch(
+                request, uuid=self.channel.uuid)
+        self.assertEqual(response.status_code, 400)
+
     def test_message_direct_outbound_status(self):
         joe = self.create_contact("Joe Biden", "+254788383383")
         msg = joe.send("Hey Joe, it's Obama, pick up!", self.admin)[0]
@@ -68,8 +183,52 @@ class DirectHandlerTest(TembaTest):
         assertStatus(msg, 'delivered', DELIVERED)
         assertStatus(msg, 'failed', FAILED)
 
+    def post_event(self, event, data):
+        request = self.factory.post('/', data=json.dumps({
+            'hook': {'event': event},
+            'data': data,
+        }), content_type='application/json')
+        return self.handler.dispatch(request, uuid=self.channel.uuid)
+
+    @patch('django.db.transaction.on_commit', side_effect=lambda fn: fn())
+    def test_direct_inbound_budget(self, mock_on_commit):
+        data = {
+            'uuid': 'the-uuid',
+            'from_addr': '+31000000000',
+            'to_addr': '+27000000000',
+            'content': 'hello world',
+        }
+        with self.assertWithinBudget('handle_direct_inbound'):
+            response = self.post_event('message.direct_inbound', data)
+        self.assertEqual(response.status_code, 201)
+
+        with self.assertWithinBudget('handle_duplicate_inbound'):
+            response = self.post_event('message.direct_inbound', data)
+        self.assertEqual(response.status_code, 200)
+
+    def test_outbound_status_budget(self):
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        msg = joe.send("Hey Joe, it's Obama, pick up!", self.admin)[0]
+        msg.external_id = 'the-uuid'
+        msg.channel = self.channel
+        msg.save(update_fields=('channel', 'external_id',))
+
+        with self.assertWithinBudget('handle_outbound_status'):
+            response = self.post_event('message.direct_outbound.status', {
+                'message_uuid': 'the-uuid',
+                'status': 'delivered',
+            })
+        self.assertEqual(response.status_code, 201)
 
-class GroupHandlerTest(TembaTest):
+        with self.assertWithinBudget('handle_foreign_status'):
+            response = self.post_event('message.direct_outbound.status', {
+                'message_uuid': 'someone-elses-uuid',
+                'status': 'delivered',
+            })
+        self.assertEqual(response.status_code, 200)
+
+
+class GroupHandlerTest(BudgetMixin, TembaTest):
 
     def setUp(self):
         super(GroupHandlerTest, self).setUp()
@@ -106,6 +265,22 @@ class GroupHandlerTest(TembaTest):
         self.assertEqual(msg.text, 'hello world')
         self.assertEqual(msg.channel, self.channel)
 
+    def test_group_inbound_budget(self):
+        request = self.factory.post('/', data=json.dumps({
+            'hook': {'event': 'message.group_inbound'},
+            'data': {
+                'uuid': 'the-uuid',
+                'from_addr': '+31000000000',
+                'to_addr': '+27000000000',
+                'group': {'uuid': 'the-group-uuid'},
+                'content': 'hello world',
+            }
+        }), content_type='application/json')
+
+        with self.assertWithinBudget('handle_group_inbound'):
+            response = self.handler.dispatch(request, uuid=self.channel.uuid)
+        self.assertEqual(response.status_code, 201)
+
     def test_message_group_inbound_other_group(self):
         request = self.factory.post('/', data=json.dumps({
             'hook': {
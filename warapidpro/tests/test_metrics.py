@@ -0,0 +1,92 @@
+import json
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from temba.tests import TembaTest
+from temba.channels.models import Channel
+
+from warapidpro import metrics
+from warapidpro.handlers import WhatsAppHandler
+from warapidpro.types import WhatsAppDirectType
+
+
+RECORDING_BACKEND = 'warapidpro.tests.test_metrics.RecordingMetrics'
+
+
+class RecordingMetrics(metrics.Metrics):
+    enabled = True
+    recorded = []
+
+    def incr(self, name, value=1, tags=None):
+        self.recorded.append(('incr', name, value, tags))
+
+    def histogram(self, name, value, tags=None):
+        self.recorded.append(('histogram', name, value, tags))
+
+    def timing(self, name, seconds, tags=None):
+        self.recorded.append(('timing', name, seconds, tags))
+
+
+class MetricsMixin(object):
+
+    def setUp(self):
+        super(MetricsMixin, self).setUp()
+        metrics._backend = None
+        RecordingMetrics.recorded = []
+        self.addCleanup(setattr, metrics, '_backend', None)
+
+
+class MetricsTestCase(MetricsMixin, SimpleTestCase):
+
+    def test_default_is_noop(self):
+        self.assertEqual(type(metrics.get_metrics()), metrics.Metrics)
+        metrics.incr('anything', tag='value')
+
+    @override_settings(WASSUP_METRICS_BACKEND=RECORDING_BACKEND)
+    def test_backend_setting(self):
+        with metrics.timer('thing', kind='test'):
+            pass
+        metrics.histogram('size', 10)
+        [(kind, name, seconds, tags), histogram] = RecordingMetrics.recorded
+        self.assertEqual((kind, name, tags), ('timing', 'thing', {
+            'kind': 'test'}))
+        self.assertEqual(histogram, ('histogram', 'size', 10, {}))
+
+    def test_statsd_names(self):
+        backend = metrics.StatsdMetrics.__new__(metrics.StatsdMetrics)
+        self.assertEqual(backend.stat('webhook.time', {}), 'webhook.time')
+        self.assertEqual(
+            backend.stat('webhook.time', {
+                'status': 201, 'event': 'message.direct_inbound'}),
+            'webhook.time.message_direct_inbound.201')
+
+
+@override_settings(WASSUP_METRICS_BACKEND=RECORDING_BACKEND)
+class WebhookMetricsTestCase(MetricsMixin, TembaTest):
+
+    def test_webhook_metrics(self):
+        channel = Channel.create(
+            self.org, self.user, 'RW', WhatsAppDirectType.code,
+            None, '+27000000000',
+            config=dict(access_token='access-token', secret='secret'),
+            uuid='00000000-0000-0000-0000-000000001234',
+            role=Channel.DEFAULT_ROLE)
+        request = RequestFactory().post('/', data=json.dumps({
+            'hook': {'event': 'message.direct_inbound'},
+            'data': {
+                'uuid': 'the-uuid',
+                'from_addr': '+31000000000',
+                'content': 'hello world',
+            },
+        }), content_type='application/json')
+        WhatsAppHandler().dispatch(request, uuid=channel.uuid)
+
+        recorded = dict(
+            (name, (value, tags))
+            for _, name, value, tags in RecordingMetrics.recorded)
+        queries, tags = recorded['webhook.queries']
+        self.assertTrue(queries > 0)
+        self.assertEqual(tags, {'event': 'message.direct_inbound'})
+        _, tags = recorded['webhook.time']
+        self.assertEqual(tags, {
+            'event': 'message.direct_inbound', 'status': 201})
@@ -0,0 +1,166 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+from mock import patch
+from six import StringIO
+from six.moves import BaseHTTPServer
+
+from warapidpro.replay import Anonymiser, Replayer, export_events
+from warapidpro.types import WhatsAppDirectType
+
+
+class StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length'))
+        body = json.loads(self.rfile.read(length))
+        self.send_response(201 if body['data'].get('uuid') else 400)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeChannel(object):
+    channel_type = WhatsAppDirectType.code
+    uuid = '00000000-0000-0000-0000-000000001234'
+
+
+class FakeLog(object):
+    pk = 1
+    channel = FakeChannel()
+    method = 'POST'
+    url = 'https://wassup.p16n.org/api/v1/messages/'
+
+    def __init__(self, created_on, description, request='', response=''):
+        self.created_on = created_on
+        self.description = description
+        self.request = request
+        self.response = response
+
+
+class ReplayTestCase(SimpleTestCase):
+
+    def test_anonymise_inbound(self):
+        anonymiser = Anonymiser(salt=b'salt')
+        data = anonymiser.inbound({
+            'uuid': 'the-uuid',
+            'from_addr': '+31000000000',
+            'to_addr': '+27000000000',
+            'content': 'hello world',
+            'image_attachment': 'https://wassup.p16n.org/media/pic.jpg',
+            'group': {'uuid': 'the-group-uuid', 'subject': 'Secret'},
+        })
+        self.assertEqual(data['content'], 'x' * len('hello world'))
+        self.assertEqual(data['from_addr'], anonymiser.msisdn('+31000000000'))
+        self.assertTrue(data['from_addr'].startswith('+99'))
+        self.assertNotEqual(data['uuid'], 'the-uuid')
+        self.assertTrue(data['image_attachment'].endswith('.jpg'))
+        self.assertEqual(data['group'], {
+            'uuid': anonymiser.uuid('the-group-uuid')})
+        self.assertNotEqual(
+            Anonymiser(salt=b'other').msisdn('+31000000000'),
+            data['from_addr'])
+
+    def test_export_events(self):
+        anonymiser = Anonymiser(salt=b'salt')
+        now = datetime(2018, 3, 1, 10, 0, 0)
+        events = list(export_events([
+            FakeLog(
+                now, 'Handled inbound message. '
+                'Server-Timing: db;dur=12.0, total;dur=13.0',
+                request=json.dumps({
+                    'hook': {
+                        'event': 'message.direct_inbound',
+                        'url': 'https://rapidpro.example.org/handlers/',
+                    },
+                    'data': {
+                        'uuid': 'the-uuid', 'from_addr': '+31000000000'},
+                })),
+            FakeLog(
+                now + timedelta(seconds=2), 'Successfully Sent',
+                response='{"uuid": "sent-uuid"}'),
+            FakeLog(now, 'Something else'),
+            FakeLog(now, 'Handled inbound message.', request='not json'),
+        ], anonymiser))
+
+        self.assertEqual(len(events), 2)
+        inbound, status = events
+        self.assertEqual(inbound['offset'], 0)
+        self.assertEqual(inbound['channel'], FakeChannel.uuid)
+        self.assertEqual(
+            inbound['body']['hook'], {'event': 'message.direct_inbound'})
+        self.assertEqual(status['offset'], 2)
+        self.assertEqual(status['body'], {
+            'hook': {'event': 'message.direct_outbound.status'},
+            'data': {
+                'message_uuid': anonymiser.uuid('sent-uuid'),
+                'status': 'delivered',
+            },
+        })
+
+    def test_replay_over_http(self):
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StatusHandler)
+        thread = threading.Thread(
+            target=server.serve_forever, kwargs={'poll_interval': 0.1})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        events = [{
+            'offset': 0,
+            'channel': FakeChannel.uuid,
+            'body': {
+                'hook': {'event': 'message.direct_inbound'},
+                'data': {'uuid': 'uuid-%s' % (i,)},
+            },
+        } for i in range(9)]
+        events.append({
+            'offset': 0,
+            'channel': FakeChannel.uuid,
+            'body': {
+                'hook': {'event': 'message.direct_outbound.status'},
+                'data': {},
+            },
+        })
+
+        report = Replayer(
+            events, speed=0, concurrency=2,
+            url='http://127.0.0.1:%s' % (server.server_address[1],)).run()
+        self.assertEqual(report['events'], 10)
+        self.assertEqual(report['error_rate'], 0.1)
+        self.assertEqual(report['statuses'], {'201': 9, '400': 1})
+        self.assertEqual(report['events_by_type'], {
+            'message.direct_inbound': 9,
+            'message.direct_outbound.status': 1,
+        })
+        self.assertTrue(report['latency_ms']['max'] > 0)
+
+    def test_replay_needs_url_or_in_process(self):
+        with self.assertRaises(ValueError):
+            Replayer([], speed=0)
+        with self.assertRaises(CommandError):
+            call_command(
+                'replay_whatsapp_traffic', 'traffic.jsonl', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command(
+                'replay_whatsapp_traffic', 'traffic.jsonl',
+                url='http://localhost:8000', in_process=True,
+                stdout=StringIO())
+
+    @patch.object(Replayer, 'run')
+    def test_replay_command_empty_run(self, mock_run):
+        mock_run.return_value = Replayer([], url='http://localhost').report(0)
+        stdout = StringIO()
+        call_command(
+            'replay_whatsapp_traffic', 'traffic.jsonl',
+            url='http://localhost:8000',
+            stdout=stdout)
+        self.assertTrue(
+            'Replayed 0 events in 0.0s, n/a events/s' in stdout.getvalue())
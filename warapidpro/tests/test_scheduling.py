@@ -0,0 +1,126 @@
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from temba.tests import TembaTest
+
+from warapidpro.scheduling import (
+    fair_share, adaptive_sample_size, record_lookup_latency,
+    record_lookup_error, get_lookup_latency, channel_weights,
+    weighted_round_robin)
+
+
+class FairShareTestCase(SimpleTestCase):
+
+    def test_capacity_to_spare(self):
+        self.assertEqual(
+            fair_share({'a': 10, 'b': 20}, 100),
+            {'a': 10, 'b': 20})
+
+    def test_equal_split(self):
+        self.assertEqual(
+            fair_share({'a': 1000, 'b': 1000}, 100),
+            {'a': 50, 'b': 50})
+
+    def test_idle_capacity_redistributed(self):
+        self.assertEqual(
+            fair_share({'a': 10, 'b': 1000, 'c': 1000}, 100),
+            {'a': 10, 'b': 45, 'c': 45})
+
+    def test_weights(self):
+        self.assertEqual(
+            fair_share({'a': 1000, 'b': 1000}, 100, weights={'a': 3}),
+            {'a': 75, 'b': 25})
+
+    def test_zero_weight(self):
+        self.assertEqual(
+            fair_share({'a': 1000, 'b': 1000}, 100, weights={'a': 0}),
+            {'a': 0, 'b': 100})
+
+    def test_rounding(self):
+        allocations = fair_share({'a': 1000, 'b': 1000, 'c': 1000}, 100)
+        self.assertEqual(sum(allocations.values()), 100)
+        self.assertEqual(sorted(allocations.values()), [33, 33, 34])
+
+
+class AdaptiveSampleSizeTestCase(SimpleTestCase):
+
+    def size(self, backlog, latency=None, channels=1):
+        return adaptive_sample_size(
+            backlog, latency, channels, interval=300, concurrency=4,
+            minimum=10, maximum=1000)
+
+    def test_no_backlog(self):
+        self.assertEqual(self.size(0), 0)
+
+    def test_small_backlog(self):
+        self.assertEqual(self.size(5), 5)
+        self.assertEqual(self.size(5, latency=1000), 5)
+
+    def test_unmeasured_latency(self):
+        self.assertEqual(self.size(100000), 1000)
+
+    def test_latency(self):
+        # 4 concurrent lookups for 300 seconds at 2 seconds per msisdn
+        self.assertEqual(self.size(100000, latency=2), 600)
+        self.assertEqual(self.size(100000, latency=2, channels=2), 1000)
+        self.assertEqual(self.size(100000, latency=1000), 10)
+
+
+class LookupLatencyTestCase(TembaTest):
+
+    def test_record_lookup_latency(self):
+        self.assertEqual(get_lookup_latency([1, 2]), None)
+        record_lookup_latency(1, 10, 10)
+        self.assertEqual(get_lookup_latency([1, 2]), 1.0)
+        record_lookup_latency(1, 20, 10)
+        self.assertAlmostEqual(get_lookup_latency([1]), 1.3)
+        record_lookup_latency(2, 0, 0)
+        record_lookup_latency(2, 30, 10)
+        self.assertAlmostEqual(get_lookup_latency([1, 2]), 2.15)
+
+
+class ChannelWeightsTestCase(TembaTest):
+
+    def test_unmeasured(self):
+        self.assertEqual(channel_weights([1, 2]), [(1, 1.0), (2, 1.0)])
+
+    def test_latency_and_errors(self):
+        record_lookup_latency(1, 1, 1)
+        record_lookup_latency(2, 2, 1)
+        record_lookup_error(2, False)
+        record_lookup_error(2, True)
+        self.assertEqual(
+            channel_weights([1, 2, 3]),
+            [(1, 1.0), (2, 0.35), (3, 1 / 1.5)])
+
+    def test_unhealthy(self):
+        record_lookup_error(1, True)
+        self.assertEqual(channel_weights([1, 2]), [(2, 1.0)])
+
+    @override_settings(WASSUP_LOOKUP_ERROR_RATE_TTL=1)
+    def test_unhealthy_recovers(self):
+        record_lookup_error(1, True)
+        self.assertEqual(channel_weights([1, 2]), [(2, 1.0)])
+        time.sleep(1.5)
+        self.assertEqual(channel_weights([1, 2]), [(1, 1.0), (2, 1.0)])
+
+    def test_all_unhealthy(self):
+        record_lookup_error(1, True)
+        record_lookup_error(2, False)
+        record_lookup_error(2, True)
+        record_lookup_error(2, True)
+        [(channel_pk, weight)] = channel_weights([1, 2])
+        self.assertEqual(channel_pk, 2)
+        self.assertAlmostEqual(weight, 0.49)
+
+
+class WeightedRoundRobinTestCase(SimpleTestCase):
+
+    def test_weighted_round_robin(self):
+        self.assertEqual(
+            weighted_round_robin([('a', 5), ('b', 1), ('c', 1)], 7),
+            ['a', 'a', 'b', 'a', 'c', 'a', 'a'])
+        self.assertEqual(
+            weighted_round_robin([('a', 1), ('b', 1)], 3),
+            ['a', 'b', 'a'])
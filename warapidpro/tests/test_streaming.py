@@ -0,0 +1,106 @@
+import json
+
+from temba.tests import TembaTest
+
+from temba.channels.models import Channel
+from temba.msgs.models import Msg
+from warapidpro.codec import dumps
+from warapidpro.handlers import get_event_cursor
+from warapidpro.streaming import EventConsumer, NumberStream
+from warapidpro.types import WhatsAppDirectType, WhatsAppGroupType
+
+
+class EventConsumerTest(TembaTest):
+
+    def setUp(self):
+        super(EventConsumerTest, self).setUp()
+        self.direct_channel = Channel.create(
+            self.org, self.user, 'RW', WhatsAppDirectType.code,
+            None, '+27000000000',
+            config=dict(api_token='api-token', secret='secret'),
+            uuid='00000000-0000-0000-0000-000000001234',
+            role=Channel.DEFAULT_ROLE)
+        self.group_channel = Channel.create(
+            self.org, self.user, 'RW', WhatsAppGroupType.code,
+            None, '+27000000000',
+            config=dict(api_token='api-token',
+                        secret='secret',
+                        group_uuid='the-group-uuid'),
+            uuid='00000000-0000-0000-0000-000000005678',
+            role=Channel.DEFAULT_ROLE)
+        self.consumer = EventConsumer(
+            [self.direct_channel, self.group_channel])
+
+    def inbound(self, event, uuid, content, **data):
+        data.update({
+            'uuid': uuid,
+            'from_addr': '+31000000000',
+            'to_addr': '+27000000000',
+            'content': content,
+        })
+        return ('+27000000000', json.dumps({
+            'hook': {'event': event},
+            'data': data,
+        }))
+
+    def test_channels_for(self):
+        self.assertEqual(
+            self.consumer.channels_for(
+                '+27000000000', 'message.direct_inbound'),
+            [self.direct_channel])
+        self.assertEqual(
+            self.consumer.channels_for(
+                '+27000000000', 'message.group_outbound.status'),
+            [self.group_channel])
+        self.assertEqual(
+            self.consumer.channels_for(
+                '+27000000001', 'message.direct_inbound'), [])
+
+    def test_process_batch(self):
+        self.consumer.process_batch([
+            self.inbound('message.direct_inbound', 'uuid-1', 'direct'),
+            ('+27000000000', 'not json'),
+            ('+27000000000', json.dumps({'hook': {'event': None}})),
+            ('+27000000000', json.dumps(['not', 'an', 'object'])),
+            self.inbound(
+                'message.group_inbound', 'uuid-2', 'group',
+                group={'uuid': 'the-group-uuid'}),
+        ])
+
+        direct = Msg.objects.get(external_id='uuid-1')
+        self.assertEqual(direct.text, 'direct')
+        self.assertEqual(direct.channel, self.direct_channel)
+        group = Msg.objects.get(external_id='uuid-2')
+        self.assertEqual(group.text, 'group')
+        self.assertEqual(group.channel, self.group_channel)
+
+    def test_process_batch_leaves_cursor(self):
+        # Only completed catch ups move the cursor
+        self.consumer.process_batch([
+            self.inbound('message.direct_inbound', 'uuid-1', 'direct'),
+        ])
+        self.assertTrue(Msg.objects.filter(external_id='uuid-1').exists())
+        self.assertEqual(get_event_cursor(self.direct_channel.uuid), None)
+
+    def test_stream_headers_follow_token_refresh(self):
+        stream = NumberStream(
+            'wss://example.com/ws/', '+27000000000', self.direct_channel,
+            self.consumer.events)
+        self.assertEqual(
+            stream.get_headers()['Authorization'], 'Token api-token')
+
+        Channel.objects.filter(pk=self.direct_channel.pk).update(
+            config=dumps({'api_token': 'new-token', 'secret': 'secret'}))
+        self.assertEqual(
+            stream.get_headers()['Authorization'], 'Token new-token')
+
+    def test_next_batch(self):
+        for i in range(3):
+            self.consumer.events.put(('+27000000000', str(i)))
+        self.consumer.batch_size = 2
+        self.assertEqual(
+            self.consumer.next_batch(),
+            [('+27000000000', '0'), ('+27000000000', '1')])
+        self.consumer.flush_interval = 0
+        self.assertEqual(
+            self.consumer.next_batch(), [('+27000000000', '2')])
@@ -1,25 +1,47 @@
 import responses
 import json
+import time
 import urlparse
 from mock import patch
 
 from temba.tests import TembaTest
 from datetime import datetime, timedelta
 
+from django.core.cache import cache
+from django.test import override_settings
 from django.utils import timezone
 
 from temba.channels.models import Channel, Org
+from temba.contacts.models import ContactGroup
+from temba.msgs.models import Msg, DELIVERED
 from warapidpro.types import WhatsAppDirectType
 from warapidpro.models import (
     has_whatsapp_contactfield,
     has_whatsapp_timestamp_contactfield,
-    get_whatsappable_group)
+    get_whatsappable_group,
+    update_whatsappable_group,
+    get_cached_lookups,
+    cache_lookups,
+    WhatsAppLookup,
+    _org_cache)
+from warapidpro.handlers import get_event_cursor, set_event_cursor
+from warapidpro.scheduling import record_lookup_error
+from warapidpro.tests.budgets import BudgetMixin, LOOKUP_BATCH_SIZE
 from warapidpro.tasks import (
     refresh_channel_auth_token,
     refresh_channel_auth_tokens,
     check_contact_whatsappable,
     check_org_whatsappable,
-    refresh_org_whatsappable)
+    refresh_org_whatsappable,
+    update_whatsappable_contacts,
+    lookup_backlog,
+    dispatch_lookups,
+    acquire_lookup_slot,
+    release_lookup_slot,
+    enqueue_contact_lookup,
+    flush_org_lookup_queue,
+    flush_lookup_queues,
+    catch_up_channel)
 
 
 class TaskTestCase(TembaTest):
@@ -104,7 +126,7 @@ class TaskTestCase(TembaTest):
             new_config['expires_at'] > old_config['expires_at'])
 
 
-class ContactRefreshTaskTestCase(TembaTest):
+class ContactRefreshTaskTestCase(BudgetMixin, TembaTest):
 
     def setUp(self):
         super(ContactRefreshTaskTestCase, self).setUp()
@@ -205,6 +227,41 @@ class ContactRefreshTaskTestCase(TembaTest):
         group = get_whatsappable_group(joe.org)
         self.assertEqual(set(group.contacts.all()), set([joe]))
 
+    @responses.activate
+    def test_check_contact_whatsappable_budget(self):
+
+        def cb(request):
+            data = json.loads(request.body)
+            return (200, {}, json.dumps([
+                {"msisdn": msisdn, "wa_exists": True}
+                for msisdn in data['msisdns']]))
+
+        responses.add_callback(
+            responses.POST,
+            "https://wassup.p16n.org/api/v1/lookups/",
+            callback=cb, content_type='application/json')
+
+        contacts = [
+            self.create_contact('Contact %s' % (i,), '+2782%07d' % (i,))
+            for i in range(LOOKUP_BATCH_SIZE * 3)]
+        # The group and contact fields are created by the first lookup
+        get_whatsappable_group(self.org)
+        has_whatsapp_contactfield(self.org)
+        has_whatsapp_timestamp_contactfield(self.org)
+        batches = iter([
+            contacts[:LOOKUP_BATCH_SIZE], contacts[LOOKUP_BATCH_SIZE:]])
+
+        def run(size):
+            batch = next(batches)
+            self.assertEqual(len(batch), size)
+            check_contact_whatsappable(
+                [contact.pk for contact in batch], self.new_style_channel.pk)
+
+        self.assertBatchWithinBudget('check_contact_whatsappable', run)
+
+        group = get_whatsappable_group(self.org)
+        self.assertEqual(group.contacts.count(), LOOKUP_BATCH_SIZE * 3)
+
     @responses.activate
     def test_check_contact_not_whatsappable(self):
 
@@ -242,13 +299,229 @@ class ContactRefreshTaskTestCase(TembaTest):
         group = get_whatsappable_group(joe.org)
         self.assertEqual(set(group.contacts.all()), set([]))
 
+        lookup = WhatsAppLookup.objects.get(contact=joe)
+        self.assertEqual(lookup.org, joe.org)
+        self.assertEqual(lookup.wa_exists, False)
+        self.assertEqual(
+            lookup.checked_at, has_whatsapp_timestamp.datetime_value)
+
+    @responses.activate
+    def test_check_contact_whatsappable_cached(self):
+
+        def cb(request):
+            data = json.loads(request.body)
+            self.assertEqual(data['msisdns'], ['+254788383384'])
+            return (200, {}, json.dumps([
+                {
+                    "msisdn": "+254788383384",
+                    "wa_exists": False,
+                }
+            ]))
+
+        responses.add_callback(
+            responses.POST,
+            "https://wassup.p16n.org/api/v1/lookups/",
+            callback=cb, content_type='application/json',
+            match_querystring=True)
+
+        checked_at = timezone.now() - timedelta(days=1)
+        cache_lookups({'+254788383383': (True, checked_at)})
+
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        jill = self.create_contact("Jill Biden", "+254788383384")
+        check_contact_whatsappable(
+            [joe.pk, jill.pk], self.new_style_channel.pk)
+        self.assertEqual(len(responses.calls), 1)
+
+        has_whatsapp = joe.values.get(contact_field__key='has_whatsapp')
+        self.assertEqual(has_whatsapp.string_value, 'yes')
+        has_whatsapp_timestamp = joe.values.get(
+            contact_field__key='has_whatsapp_timestamp')
+        self.assertEqual(has_whatsapp_timestamp.datetime_value, checked_at)
+
+        has_whatsapp = jill.values.get(contact_field__key='has_whatsapp')
+        self.assertEqual(has_whatsapp.string_value, 'no')
+        self.assertEqual(
+            set(get_cached_lookups(['+254788383383', '+254788383384'])),
+            set(['+254788383383', '+254788383384']))
+
+    @responses.activate
+    @override_settings(WASSUP_LOOKUP_WAIT=False)
+    @patch.object(check_contact_whatsappable, 'apply_async')
+    def test_check_contact_whatsappable_no_wait(self, mock_apply_async):
+
+        def cb(request):
+            data = json.loads(request.body)
+            self.assertEqual(data['wait'], False)
+            return (200, {}, json.dumps([
+                {
+                    "msisdn": "+254788383383",
+                    "wa_exists": True,
+                },
+                {
+                    "msisdn": "+254788383384",
+                    "wa_exists": None,
+                },
+            ]))
+
+        responses.add_callback(
+            responses.POST,
+            "https://wassup.p16n.org/api/v1/lookups/",
+            callback=cb, content_type='application/json',
+            match_querystring=True)
+
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        jill = self.create_contact("Jill Biden", "+254788383384")
+        check_contact_whatsappable(
+            [joe.pk, jill.pk], self.new_style_channel.pk)
+
+        has_whatsapp = joe.values.get(contact_field__key='has_whatsapp')
+        self.assertEqual(has_whatsapp.string_value, 'yes')
+        self.assertFalse(jill.values.filter(
+            contact_field__key='has_whatsapp_timestamp').exists())
+        mock_apply_async.assert_called_with(
+            ([jill.pk], self.new_style_channel.pk), {'attempt': 1},
+            countdown=30)
+
+    def test_get_whatsappable_group_converts_legacy_group(self):
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        jill = self.create_contact("Jill Biden", "+254788383384")
+        legacy_group = ContactGroup.create_dynamic(
+            self.org, user=self.admin, name='Contacts on WhatsApp',
+            query='has_whatsapp="yes"')
+        legacy_group.contacts.add(joe)
+
+        group = get_whatsappable_group(self.org)
+        self.assertEqual(group.pk, legacy_group.pk)
+        self.assertEqual(group.query, None)
+        self.assertEqual(list(group.query_fields.all()), [])
+
+        update_whatsappable_group(group, self.admin, [jill.pk], [])
+        self.assertEqual(set(group.contacts.all()), set([joe, jill]))
+
+    def test_get_whatsappable_group_keeps_dynamic_group(self):
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        jill = self.create_contact("Jill Biden", "+254788383384")
+        dynamic_group = ContactGroup.create_dynamic(
+            self.org, user=self.admin, name='Contacts on WhatsApp',
+            query='has_whatsapp="yes" AND name="Joe Biden"')
+        dynamic_group.contacts.add(joe)
+
+        group = get_whatsappable_group(self.org)
+        self.assertEqual(group.pk, dynamic_group.pk)
+        self.assertEqual(
+            group.query, 'has_whatsapp="yes" AND name="Joe Biden"')
+
+        update_whatsappable_group(group, self.admin, [jill.pk], [joe.pk])
+        self.assertEqual(set(group.contacts.all()), set([joe]))
+
+    def test_org_objects_memoized(self):
+        has_whatsapp = has_whatsapp_contactfield(self.org)
+        has_whatsapp_timestamp = has_whatsapp_timestamp_contactfield(
+            self.org)
+        group = get_whatsappable_group(self.org)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(has_whatsapp_contactfield(self.org), has_whatsapp)
+            self.assertEqual(
+                has_whatsapp_timestamp_contactfield(self.org),
+                has_whatsapp_timestamp)
+            self.assertEqual(get_whatsappable_group(self.org), group)
+
+        group.save()
+        self.assertFalse(self.org.pk in _org_cache)
+
+    def test_update_whatsappable_group(self):
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        jill = self.create_contact("Jill Biden", "+254788383384")
+        group = get_whatsappable_group(self.org)
+
+        self.assertEqual(group.query, None)
+
+        update_whatsappable_group(group, self.admin, [joe.pk, jill.pk], [])
+        update_whatsappable_group(group, self.admin, [joe.pk], [])
+        self.assertEqual(set(group.contacts.all()), set([joe, jill]))
+        self.assertEqual(group.get_member_count(), 2)
+
+        update_whatsappable_group(group, self.admin, [], [jill.pk])
+        self.assertEqual(set(group.contacts.all()), set([joe]))
+
+    def test_update_whatsappable_group_skips_stopped_contacts(self):
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        jill = self.create_contact("Jill Biden", "+254788383384")
+        jill.is_stopped = True
+        jill.save(update_fields=['is_stopped'])
+        group = get_whatsappable_group(self.org)
+
+        update_whatsappable_group(group, self.admin, [joe.pk, jill.pk], [])
+        self.assertEqual(set(group.contacts.all()), set([joe]))
+        self.assertEqual(group.get_member_count(), 1)
+
     @responses.activate
     @patch.object(check_contact_whatsappable, 'delay')
     def test_check_org_whatsappable(self, mock_check):
         joe = self.create_contact("Joe Biden", "+254788383383")
+        jill = self.create_contact("Jill Biden", "+254788383384")
+        WhatsAppLookup.record(jill.org, {jill.pk: (False, timezone.now())})
         check_org_whatsappable(joe.org.pk)
         mock_check.assert_called_with([joe.pk], self.new_style_channel.pk)
 
+    @patch.object(check_contact_whatsappable, 'delay')
+    def test_check_org_whatsappable_skips_contacts_without_tel_urns(
+            self, mock_check):
+        for index in range(3):
+            self.create_contact("Nobody %s" % (index,))
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        self.assertEqual(lookup_backlog(self.org, 2), 1)
+        check_org_whatsappable(joe.org.pk, sample_size=2)
+        mock_check.assert_called_once_with(
+            [joe.pk], self.new_style_channel.pk)
+
+    @patch.object(check_contact_whatsappable, 'delay')
+    def test_dispatch_lookups(self, mock_check):
+        dispatch_lookups(
+            list(range(5)),
+            [(self.new_style_channel.pk, 2.0),
+             (self.old_style_channel.pk, 1.0)],
+            batch_size=2)
+        self.assertEqual(
+            [args for args, _ in mock_check.call_args_list], [
+                ([0, 1], self.new_style_channel.pk),
+                ([2, 3], self.old_style_channel.pk),
+                ([4], self.new_style_channel.pk),
+            ])
+
+    @override_settings(WASSUP_LOOKUP_CONCURRENCY=2)
+    def test_lookup_slots(self):
+        channel_pk = self.new_style_channel.pk
+        first = acquire_lookup_slot(channel_pk)
+        second = acquire_lookup_slot(channel_pk)
+        self.assertNotEqual(first, None)
+        self.assertNotEqual(second, None)
+        self.assertEqual(acquire_lookup_slot(channel_pk), None)
+
+        # Releasing a slot that expired and was taken by another
+        # lookup doesn't make room for more lookups than the limit
+        cache.delete(first[0])
+        third = acquire_lookup_slot(channel_pk)
+        self.assertEqual(third[0], first[0])
+        release_lookup_slot(first)
+        self.assertEqual(acquire_lookup_slot(channel_pk), None)
+        release_lookup_slot(third)
+        self.assertNotEqual(acquire_lookup_slot(channel_pk), None)
+
+        release_lookup_slot(second)
+        self.assertEqual(acquire_lookup_slot(channel_pk)[0], second[0])
+
+    @patch.object(check_contact_whatsappable, 'delay')
+    def test_check_org_whatsappable_skips_unhealthy_channels(
+            self, mock_check):
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        for _ in range(5):
+            record_lookup_error(self.new_style_channel.pk, True)
+        check_org_whatsappable(joe.org.pk)
+        mock_check.assert_called_with([joe.pk], self.old_style_channel.pk)
+
     @responses.activate
     @patch.object(check_contact_whatsappable, 'delay')
     def test_check_org_whatsappable_no_contacts(self, mock_check):
@@ -259,19 +532,70 @@ class ContactRefreshTaskTestCase(TembaTest):
         check_org_whatsappable(org.pk)
         self.assertFalse(mock_check.called)
 
+    def test_lookup_backlog(self):
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        jill = self.create_contact("Jill Biden", "+254788383384")
+        self.create_contact("Hunter Biden", "+254788383385")
+        WhatsAppLookup.record(self.org, {
+            joe.pk: (True, timezone.now() - timedelta(days=8)),
+            jill.pk: (True, timezone.now()),
+        })
+        self.assertEqual(lookup_backlog(self.org, 10), 2)
+        self.assertEqual(lookup_backlog(self.org, 1), 1)
+        self.assertEqual(lookup_backlog(self.org, 0), 0)
+
+    @patch.object(check_contact_whatsappable, 'delay')
+    def test_update_whatsappable_contacts(self, mock_check):
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        jill = self.create_contact("Jill Biden", "+254788383384")
+        WhatsAppLookup.record(self.org, {
+            jill.pk: (True, timezone.now() - timedelta(days=8)),
+        })
+
+        with self.settings(WASSUP_LOOKUP_CAPACITY=1):
+            update_whatsappable_contacts()
+        mock_check.assert_called_once_with(
+            [joe.pk], self.new_style_channel.pk)
+
+        mock_check.reset_mock()
+        update_whatsappable_contacts()
+        self.assertEqual(
+            [args for args, _ in mock_check.call_args_list], [
+                ([jill.pk], self.new_style_channel.pk),
+                ([joe.pk], self.new_style_channel.pk),
+            ])
+
+    @override_settings(
+        WASSUP_LOOKUP_CAPACITY=4, WASSUP_LOOKUP_REFRESH_SHARE=0.25)
+    @patch.object(check_contact_whatsappable, 'delay')
+    def test_update_whatsappable_contacts_refresh_share(self, mock_check):
+        new_contacts = [
+            self.create_contact("Joe %s" % (index,), "+25478838330%s" % (
+                index,))
+            for index in range(5)]
+        jill = self.create_contact("Jill Biden", "+254788383384")
+        WhatsAppLookup.record(self.org, {
+            jill.pk: (True, timezone.now() - timedelta(days=8)),
+        })
+
+        update_whatsappable_contacts()
+        self.assertEqual(
+            [args for args, _ in mock_check.call_args_list], [
+                ([jill.pk], self.new_style_channel.pk),
+                ([contact.pk for contact in new_contacts[:3]],
+                 self.new_style_channel.pk),
+            ])
+
     @responses.activate
     @patch.object(check_contact_whatsappable, 'delay')
     def test_refresh_org_whatsappable(self, mock_check):
         joe = self.create_contact("Joe Biden", "+254788383383")
+        jill = self.create_contact("Jill Biden", "+254788383384")
 
-        has_whatsapp = has_whatsapp_contactfield(joe.org)
-        has_whatsapp_timestamp = has_whatsapp_timestamp_contactfield(joe.org)
-
-        joe.set_field(
-            self.admin, key=has_whatsapp.key, value='yes')
-        joe.set_field(
-            self.admin, key=has_whatsapp_timestamp.key,
-            value=(timezone.now() - timedelta(days=7)))
+        WhatsAppLookup.record(joe.org, {
+            joe.pk: (True, timezone.now() - timedelta(days=7)),
+            jill.pk: (True, timezone.now() - timedelta(days=1)),
+        })
         refresh_org_whatsappable(joe.org.pk, delta=timedelta(days=6))
         mock_check.assert_called_with([joe.pk], self.new_style_channel.pk)
 
@@ -284,3 +608,130 @@ class ContactRefreshTaskTestCase(TembaTest):
             created_by=user, modified_by=user)
         refresh_org_whatsappable(org.pk, delta=timedelta(days=6))
         self.assertFalse(mock_check.called)
+
+
+class LookupQueueTestCase(TembaTest):
+
+    def setUp(self):
+        super(LookupQueueTestCase, self).setUp()
+        self.whatsapp_channel = Channel.create(
+            self.org, self.user, 'RW', WhatsAppDirectType.code,
+            None, '+27000000000',
+            config={
+                'authorization': {
+                    'token_type': 'Bearer',
+                    'access_token': 'foo',
+                }
+            },
+            uuid='00000000-0000-0000-0000-000000005678',
+            role=Channel.DEFAULT_ROLE)
+
+    @patch('django.db.transaction.on_commit', side_effect=lambda fn: fn())
+    @patch.object(flush_org_lookup_queue, 'delay')
+    def test_new_contact_enqueued(self, mock_flush, mock_on_commit):
+        with self.settings(WASSUP_LOOKUP_BATCH_SIZE=2):
+            self.create_contact("Joe Biden", "+254788383383")
+            self.assertFalse(mock_flush.called)
+            self.create_contact("Jill Biden", "+254788383384")
+        mock_flush.assert_called_once_with(self.org.pk)
+
+    @patch.object(check_contact_whatsappable, 'delay')
+    def test_flush_org_lookup_queue(self, mock_check):
+        enqueue_contact_lookup(self.org.pk, 2)
+        enqueue_contact_lookup(self.org.pk, 1)
+        enqueue_contact_lookup(self.org.pk, 2)
+        flush_org_lookup_queue(self.org.pk)
+        mock_check.assert_called_once_with([1, 2], self.whatsapp_channel.pk)
+
+        mock_check.reset_mock()
+        flush_org_lookup_queue(self.org.pk)
+        self.assertFalse(mock_check.called)
+
+    @patch.object(flush_org_lookup_queue, 'delay')
+    def test_flush_lookup_queues(self, mock_flush):
+        enqueue_contact_lookup(self.org.pk, 1)
+
+        with self.settings(WASSUP_LOOKUP_DEBOUNCE=60):
+            flush_lookup_queues()
+        self.assertFalse(mock_flush.called)
+
+        with self.settings(WASSUP_LOOKUP_DEBOUNCE=0):
+            flush_lookup_queues()
+        mock_flush.assert_called_once_with(self.org.pk)
+
+
+class CatchUpTaskTestCase(TembaTest):
+
+    def setUp(self):
+        super(CatchUpTaskTestCase, self).setUp()
+        self.whatsapp_channel = Channel.create(
+            self.org, self.user, 'RW', WhatsAppDirectType.code,
+            None, '+27000000000',
+            config=dict(api_token='api-token', secret='secret'),
+            uuid='00000000-0000-0000-0000-000000001234',
+            role=Channel.DEFAULT_ROLE)
+
+    def test_catch_up_channel_without_cursor(self):
+        catch_up_channel(self.whatsapp_channel.pk)
+        self.assertTrue(get_event_cursor(self.whatsapp_channel.uuid))
+
+    @responses.activate
+    @override_settings(WASSUP_API_URL='https://wassup.p16n.org/api/v1')
+    def test_catch_up_channel(self):
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        sent = joe.send("Hey Joe, it's Obama, pick up!", self.admin)[0]
+        sent.external_id = 'outbound-uuid'
+        sent.channel = self.whatsapp_channel
+        sent.save(update_fields=('channel', 'external_id',))
+
+        existing = Msg.create_incoming(
+            self.whatsapp_channel, 'tel:+254788383383', 'seen',
+            external_id='seen-uuid')
+
+        set_event_cursor(self.whatsapp_channel.uuid, time.time() - 3600)
+
+        def page(request):
+            params = urlparse.parse_qs(urlparse.urlparse(request.url).query)
+            self.assertEqual(params['number'], ['+27000000000'])
+            if 'page' in params:
+                return (200, {}, json.dumps({
+                    'next': None,
+                    'results': [{
+                        'uuid': 'outbound-uuid',
+                        'from_addr': '+27000000000',
+                        'to_addr': '+254788383383',
+                        'status': 'delivered',
+                    }],
+                }))
+            return (200, {}, json.dumps({
+                'next': (
+                    'https://wassup.p16n.org/api/v1/messages/'
+                    '?number=%2B27000000000&page=2'),
+                'results': [{
+                    'uuid': 'seen-uuid',
+                    'from_addr': '+254788383383',
+                    'to_addr': '+27000000000',
+                    'content': 'seen',
+                }, {
+                    'uuid': 'missed-uuid',
+                    'from_addr': '+254788383383',
+                    'to_addr': '+27000000000',
+                    'content': 'missed',
+                }],
+            }))
+
+        responses.add_callback(
+            responses.GET, 'https://wassup.p16n.org/api/v1/messages/',
+            callback=page, content_type='application/json')
+
+        catch_up_channel(self.whatsapp_channel.pk)
+
+        self.assertEqual(
+            Msg.objects.filter(external_id='seen-uuid').get(), existing)
+        missed = Msg.objects.get(external_id='missed-uuid')
+        self.assertEqual(missed.text, 'missed')
+        self.assertEqual(missed.channel, self.whatsapp_channel)
+        sent.refresh_from_db()
+        self.assertEqual(sent.status, DELIVERED)
+        self.assertTrue(
+            get_event_cursor(self.whatsapp_channel.uuid) > time.time() - 60)
@@ -0,0 +1,53 @@
+from django.test import SimpleTestCase
+
+from warapidpro.timing import PhaseTimer, parse_timings
+
+
+class PhaseTimerTestCase(SimpleTestCase):
+
+    def test_describe(self):
+        timer = PhaseTimer('send')
+        with timer.phase('fetch'):
+            pass
+        with timer.phase('upload'):
+            pass
+
+        description = timer.describe('Handled inbound message.')
+        self.assertTrue(description.startswith(
+            'Handled inbound message. Server-Timing: fetch;dur='))
+        self.assertEqual(
+            [phase for phase, _ in parse_timings(description)],
+            ['fetch', 'upload', 'total'])
+
+    def test_describe_truncated(self):
+        timer = PhaseTimer('send')
+        for index in range(30):
+            with timer.phase('phase%s' % (index,)):
+                pass
+        description = timer.describe('Handled inbound message.')
+        self.assertEqual(len(description), 255)
+        phases = parse_timings(description)
+        self.assertTrue(phases)
+        self.assertEqual(phases[0][0], 'phase0')
+
+    def test_describe_shortens_description(self):
+        timer = PhaseTimer('send')
+        with timer.phase('upload'):
+            pass
+        description = timer.describe('error: %s' % ('x' * 300,))
+        self.assertEqual(len(description), 255)
+        self.assertTrue(description.startswith('error: xxx'))
+        self.assertEqual(
+            [phase for phase, _ in parse_timings(description)],
+            ['upload', 'total'])
+
+    def test_phase_recorded_on_error(self):
+        timer = PhaseTimer('send')
+        with self.assertRaises(ValueError):
+            with timer.phase('upload'):
+                raise ValueError()
+        self.assertEqual([phase for phase, _ in timer.phases], ['upload'])
+
+    def test_no_timings(self):
+        self.assertEqual(parse_timings('Handled inbound message.'), [])
+        self.assertEqual(parse_timings(None), [])
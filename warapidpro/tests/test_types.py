@@ -6,7 +6,8 @@ from mock import Mock, patch
 
 from temba.tests import TembaTest
 
-from temba.channels.models import Channel
+from temba.channels.models import Channel, ChannelLog, SendException
+from warapidpro.timing import parse_timings
 from warapidpro.types import WhatsAppDirectType, WhatsAppGroupType
 
 from temba.utils import dict_to_struct
@@ -151,6 +152,59 @@ class WhatsAppDirectTypeTest(TembaTest):
         self.assertEqual(args[1], msg_struct)
         self.assertEqual(kwargs['external_id'], 'the-uuid')
 
+    @responses.activate
+    @override_settings(WASSUP_API_URL='https://wassup.p16n.org/api/v1')
+    def test_send_logs_timings(self):
+        self.type = WhatsAppDirectType()
+
+        responses.add(
+            responses.POST,
+            'https://wassup.p16n.org/api/v1/messages/',
+            json={
+                'uuid': 'the-uuid',
+            })
+
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        msg = joe.send("Hey Joe, it's Obama, pick up!", self.admin)[0]
+        msg_struct = dict_to_struct(
+            'MsgStruct', msg.as_task_json())
+        channel_struct = dict_to_struct(
+            'ChannelStruct', self.channel.as_cached_json())
+
+        self.type.send(channel_struct, msg_struct, 'hello world')
+
+        [log] = ChannelLog.objects.filter(msg=msg)
+        self.assertFalse(log.is_error)
+        self.assertEqual(json.loads(log.response), {'uuid': 'the-uuid'})
+        self.assertEqual(
+            [phase for phase, _ in parse_timings(log.description)],
+            ['json', 'upload', 'parse', 'db', 'total'])
+
+    @responses.activate
+    @override_settings(WASSUP_API_URL='https://wassup.p16n.org/api/v1')
+    def test_send_error_timings(self):
+        self.type = WhatsAppDirectType()
+
+        responses.add(
+            responses.POST,
+            'https://wassup.p16n.org/api/v1/messages/',
+            status=500, body='oops')
+
+        joe = self.create_contact("Joe Biden", "+254788383383")
+        msg = joe.send("Hey Joe, it's Obama, pick up!", self.admin)[0]
+        msg_struct = dict_to_struct(
+            'MsgStruct', msg.as_task_json())
+        channel_struct = dict_to_struct(
+            'ChannelStruct', self.channel.as_cached_json())
+
+        with self.assertRaises(SendException) as context:
+            self.type.send(channel_struct, msg_struct, 'hello world')
+
+        self.assertEqual(
+            [phase for phase, _ in parse_timings(
+                context.exception.description)],
+            ['json', 'upload', 'total'])
+
     @responses.activate
     @override_settings(WASSUP_API_URL='https://wassup.p16n.org/api/v1')
     def test_send_with_attachment(self):
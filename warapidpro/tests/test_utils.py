@@ -0,0 +1,101 @@
+import pkg_resources
+import threading
+
+import responses
+from django.test import SimpleTestCase, override_settings
+
+from warapidpro import utils
+
+
+class VersionTestCase(SimpleTestCase):
+
+    def setUp(self):
+        utils._version = None
+        self.addCleanup(setattr, utils, '_version', None)
+
+    def test_get_version(self):
+        self.assertEqual(
+            utils.get_version(),
+            pkg_resources.get_distribution('warapidpro').version)
+
+    def test_get_version_cached(self):
+        utils._version = '1.2.3'
+        self.assertEqual(utils.get_version(), '1.2.3')
+
+
+class SessionTestCase(SimpleTestCase):
+
+    def setUp(self):
+        utils.close_sessions()
+        self.addCleanup(utils.close_sessions)
+
+    def test_session_per_thread(self):
+        session = utils.get_session()
+        self.assertTrue(utils.get_session() is session)
+
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append(utils.get_session()))
+        thread.start()
+        thread.join()
+        self.assertFalse(other[0] is session)
+
+    @override_settings(WASSUP_HTTP_POOL_SIZE=3)
+    def test_pool_size(self):
+        adapter = utils.get_session().get_adapter('https://wassup.p16n.org')
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+    def test_close_sessions(self):
+        session = utils.get_session()
+        utils.close_sessions()
+        self.assertFalse(utils.get_session() is session)
+
+    def test_close_sessions_other_threads(self):
+        sessions = []
+        closed = threading.Event()
+        done = threading.Event()
+
+        def work():
+            sessions.append(utils.get_session())
+            closed.wait()
+            sessions.append(utils.get_session())
+            done.set()
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        while not sessions:
+            closed.wait(0.01)
+        utils.close_sessions()
+        closed.set()
+        done.wait()
+        thread.join()
+        self.assertFalse(sessions[0] is sessions[1])
+
+    @responses.activate
+    def test_no_cookies(self):
+        responses.add(
+            responses.GET, 'https://wassup.p16n.org/api/v1/groups/',
+            headers={'Set-Cookie': 'sessionid=org-1; Path=/'})
+        session = utils.get_session()
+        session.get('https://wassup.p16n.org/api/v1/groups/')
+        session.get('https://wassup.p16n.org/api/v1/groups/')
+        self.assertEqual(len(session.cookies), 0)
+        self.assertFalse('Cookie' in responses.calls[1].request.headers)
+
+    @responses.activate
+    @override_settings(HOSTNAME='rapidpro.example.org')
+    def test_user_agent_per_request(self):
+        responses.add(responses.GET, 'https://wassup.p16n.org/api/v1/groups/')
+        utils._version = '1.2.3'
+        self.addCleanup(setattr, utils, '_version', None)
+
+        utils.session_for_warapidpro().get(
+            'https://wassup.p16n.org/api/v1/groups/',
+            headers={'Accept': 'application/json'})
+        [call] = responses.calls
+        self.assertEqual(
+            call.request.headers['User-Agent'],
+            'warapidpro/1.2.3 ([Auth Setup], rapidpro.example.org)')
+        self.assertEqual(call.request.headers['Accept'], 'application/json')
+        self.assertFalse(
+            'warapidpro' in utils.get_session().headers['User-Agent'])
@@ -0,0 +1,75 @@
+import responses
+
+from temba.tests import TembaTest
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from warapidpro.views import WhatsAppClaimView, listing_cache_key
+
+
+def number(index):
+    return {'from_addr': '+2771%07d' % (index,), 'vname': 'n%s' % (index,)}
+
+
+@override_settings(WASSUP_API_URL='https://wassup.example.com/api/v1')
+class ListingTestCase(TembaTest):
+
+    url = 'https://wassup.example.com/api/v1/numbers/'
+
+    def setUp(self):
+        super(ListingTestCase, self).setUp()
+        self.view = WhatsAppClaimView()
+        cache.delete(listing_cache_key('numbers', 'token'))
+
+    def add_pages(self, total, page_size):
+        for page in range(1, total // page_size + 2):
+            start = (page - 1) * page_size
+            results = [number(index) for index in range(
+                start, min(start + page_size, total))]
+            has_next = start + page_size < total
+            responses.add(
+                responses.GET,
+                self.url if page == 1 else '%s?page=%s' % (self.url, page),
+                match_querystring=True,
+                json={
+                    'count': total,
+                    'next': ('%s?page=%s' % (self.url, page + 1)
+                             if has_next else None),
+                    'results': results,
+                })
+            if not has_next:
+                break
+
+    @responses.activate
+    def test_fetches_every_page(self):
+        self.add_pages(25, 10)
+        numbers = self.view.get_numbers('token')
+        self.assertEqual(numbers, [number(index) for index in range(25)])
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(
+            responses.calls[0].request.headers['Authorization'],
+            'Bearer token')
+
+    @responses.activate
+    def test_follows_next_links(self):
+        responses.add(
+            responses.GET, self.url, match_querystring=True, json={
+                'next': '%s?cursor=abc' % (self.url,),
+                'results': [number(0)],
+            })
+        responses.add(
+            responses.GET, '%s?cursor=abc' % (self.url,),
+            match_querystring=True, json={
+                'next': None,
+                'results': [number(1)],
+            })
+        self.assertEqual(
+            self.view.get_numbers('token'), [number(0), number(1)])
+
+    @responses.activate
+    def test_cached(self):
+        self.add_pages(5, 10)
+        self.assertEqual(len(self.view.get_numbers('token')), 5)
+        self.assertEqual(len(self.view.get_numbers('token')), 5)
+        self.assertEqual(len(responses.calls), 1)
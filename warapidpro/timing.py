@@ -0,0 +1,83 @@
+"""
+Phase by phase timing of a send or an inbound event.
+
+Each phase is sent to warapidpro.metrics. The breakdown of a send or an
+inbound event is also added to the description of its ChannelLog as a
+Server-Timing style list, e.g.
+
+    Handled inbound message. Server-Timing: parse;dur=0.2, db;dur=31.2,
+    total;dur=33.0
+
+so slow messages can be diagnosed from the logs alone, while the logged
+request and response bodies stay exactly as they were sent.
+"""
+import time
+from contextlib import contextmanager
+
+from warapidpro import metrics
+
+TIMING_PREFIX = 'Server-Timing: '
+# The length of ChannelLog.description
+MAX_DESCRIPTION_LENGTH = 255
+
+
+class PhaseTimer(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, phase):
+        started = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - started
+            self.phases.append((phase, duration))
+            metrics.timing(
+                '%s.phase' % (self.name,), duration, phase=phase)
+
+    def finish(self):
+        """
+        Sends the total so far to the metrics backend.
+        """
+        metrics.timing(
+            '%s.phase' % (self.name,), time.time() - self.started,
+            phase='total')
+
+    def header(self):
+        phases = self.phases + [('total', time.time() - self.started)]
+        return TIMING_PREFIX + ', '.join(
+            '%s;dur=%.1f' % (phase, duration * 1000)
+            for phase, duration in phases)
+
+    def describe(self, description):
+        """
+        Adds the breakdown so far to a ChannelLog description, the
+        description is shortened to make room for it if need be.
+        """
+        header = self.header()
+        room = max(MAX_DESCRIPTION_LENGTH - len(header) - 1, 0)
+        return ('%s %s' % (description[:room], header))[
+            :MAX_DESCRIPTION_LENGTH]
+
+
+def parse_timings(description):
+    """
+    Returns the list of (phase, milliseconds) in a ChannelLog
+    description, empty if it has no breakdown.
+    """
+    _, prefix, timings = (description or '').partition(TIMING_PREFIX)
+    if not prefix:
+        return []
+    phases = []
+    for item in timings.split(', '):
+        phase, _, duration = item.partition(';dur=')
+        try:
+            phases.append((phase, float(duration)))
+        except ValueError:
+            # Cut off by the description's maximum length
+            break
+    return phases
@@ -1,19 +1,22 @@
 import logging
 import requests
-import json
 import time
 import os.path
 import six
 from io import BytesIO
 
 from temba.channels.models import (
-    Channel, ChannelType, TEMBA_HEADERS, SendException)
+    Channel, ChannelLog, ChannelType, TEMBA_HEADERS, SendException)
 from temba.msgs.models import WIRED, Msg, Attachment
 from temba.contacts.models import TEL_SCHEME
 from temba.utils.http import HttpEvent
 from django.shortcuts import reverse
 from django.conf import settings
 
+from . import metrics
+from .codec import channel_config, dumps, loads
+from .timing import PhaseTimer
+from .utils import get_session
 from .views import DirectClaimView, GroupClaimView
 
 logger = logging.getLogger(__name__)
@@ -44,13 +47,18 @@ class WhatsAppType(ChannelType):
         return getattr(
             settings, 'WASSUP_API_URL', 'https://wassup.p16n.org/api/v1')
 
+    def webhooks_enabled(self):
+        # Disabled when events are consumed over websockets instead,
+        # see the consume_whatsapp_events management command.
+        return getattr(settings, 'WASSUP_WEBHOOKS_ENABLED', True)
+
     def add_channel_webhook(self, channel, event):
         headers = self.api_request_headers(channel)
         headers.update({
             'Content-Type': 'application/json',
         })
 
-        response = requests.post(
+        response = get_session().post(
             '%s/webhooks/' % (self.wassup_url(),),
             json={
                 'event': event,
@@ -58,7 +66,8 @@ class WhatsAppType(ChannelType):
                 'number': channel.address,
                 'secret': channel.secret,
             },
-            headers=headers)
+            headers=headers,
+            hooks={'response': metrics.wassup_request_hook('webhooks')})
         response.raise_for_status()
         data = response.json()
         return data['id']
@@ -66,13 +75,15 @@ class WhatsAppType(ChannelType):
     def remove_channel_webhook(self, channel, webhook_id):
         headers = self.api_request_headers(channel)
 
-        response = requests.delete(
+        response = get_session().delete(
             '%s/webhooks/%s/' % (self.wassup_url(), webhook_id,),
-            headers=headers)
+            headers=headers,
+            hooks={'response': metrics.wassup_request_hook('webhooks')})
         response.raise_for_status()
 
     def remove_channel_webhooks(self, channel):
-        for webhook_id in channel.config_json().get('wassup_webhook_ids', []):
+        config = channel_config(channel)
+        for webhook_id in config.get('wassup_webhook_ids', []):
             self.remove_channel_webhook(channel, webhook_id)
 
     def fetch_attachment(self, attachment):
@@ -95,8 +106,10 @@ class WhatsAppType(ChannelType):
                     category,))
             return {}
 
-        response = requests.get(attachment.url, stream=True)
+        response = get_session().get(attachment.url, stream=True)
         response.raise_for_status()
+        metrics.histogram(
+            'attachment.bytes', len(response.content), category=category)
         return {
             attachment_type: (
                 os.path.basename(attachment.url),
@@ -106,7 +119,7 @@ class WhatsAppType(ChannelType):
 
     def api_request_headers(self, channelish):
         if(isinstance(channelish, Channel)):
-            config = channelish.config_json()
+            config = channel_config(channelish)
         else:
             config = channelish.config
 
@@ -132,8 +145,11 @@ class WhatsAppType(ChannelType):
 
     def send_whatsapp(self, channel_struct, msg, payload, attachments=None):
         url = ('%s/messages/' % (self.wassup_url(),))
+        timer = PhaseTimer('send')
         headers = self.api_request_headers(channel_struct)
-        event = HttpEvent('POST', url, json.dumps(payload))
+        with timer.phase('json'):
+            body = dumps(payload)
+        event = HttpEvent('POST', url, body)
         start = time.time()
 
         # Grab the first attachment if it exists
@@ -142,38 +158,58 @@ class WhatsAppType(ChannelType):
 
         try:
             if attachment:
-                files = self.fetch_attachment(attachment)
+                with timer.phase('fetch'):
+                    files = self.fetch_attachment(attachment)
                 data = payload
             else:
                 headers.update({
                     'Content-Type': 'application/json'
                 })
-                data = json.dumps(payload)
+                data = body
                 files = {}
 
-            response = requests.post(
-                url, data=data, files=files, headers=headers)
+            with timer.phase('upload'):
+                response = get_session().post(
+                    url, data=data, files=files, headers=headers,
+                    hooks={
+                        'response': metrics.wassup_request_hook('messages'),
+                    })
             response.raise_for_status()
             event.status_code = response.status_code
-            event.response_body = response.text
         except (requests.RequestException,) as e:
+            timer.finish()
+            # The description ends up in the ChannelLog of the failure
             raise SendException(
-                'error: %s, request: %r, response: %r' % (
-                    six.text_type(e), e.request.body, e.response.content),
+                timer.describe('error: %s, request: %r, response: %r' % (
+                    six.text_type(e), e.request.body, e.response.content)),
                 event=event, start=start)
 
-        data = response.json()
+        with timer.phase('parse'):
+            data = loads(response.content)
+        event.response_body = response.text
         try:
             message_id = data['uuid']
-            Channel.success(channel_struct, msg, WIRED, start,
-                            event=event, external_id=message_id)
         except (KeyError,) as e:
+            timer.finish()
             raise SendException(
-                "Unable to read external message_id: %r" % (e,),
+                timer.describe(
+                    "Unable to read external message_id: %r" % (e,)),
                 event=HttpEvent('POST', url,
-                                request_body=json.dumps(json.dumps(payload)),
-                                response_body=json.dumps(data)),
+                                request_body=body,
+                                response_body=dumps(data)),
                 start=start)
+        with timer.phase('db'):
+            Channel.success(channel_struct, msg, WIRED, start,
+                            event=event, external_id=message_id)
+        timer.finish()
+
+        # Add the breakdown to the ChannelLog Channel.success created
+        log = ChannelLog.objects.filter(msg_id=msg.id).order_by(
+            '-pk').values_list('pk', 'description').first()
+        if log is not None:
+            log_pk, description = log
+            ChannelLog.objects.filter(pk=log_pk).update(
+                description=timer.describe(description))
 
 
 class WhatsAppDirectType(WhatsAppType):
@@ -188,15 +224,17 @@ class WhatsAppDirectType(WhatsAppType):
     def activate(self, channel_struct):
         channel = Channel.objects.get(id=channel_struct.id)
         logger.info('Activating channel %s' % (channel,))
+        if not self.webhooks_enabled():
+            return
         dm_id = self.add_channel_webhook(
             channel, 'message.direct_inbound')
         status_id = self.add_channel_webhook(
             channel, 'message.direct_outbound.status')
-        config = channel.config_json()
+        config = channel_config(channel)
         config.update({
             'wassup_webhook_ids': [dm_id, status_id]
         })
-        channel.config = json.dumps(config)
+        channel.config = dumps(config)
         channel.save(update_fields=['config'])
 
     def deactivate(self, channel_struct):
@@ -238,15 +276,17 @@ class WhatsAppGroupType(WhatsAppType):
     def activate(self, channel_struct):
         channel = Channel.objects.get(id=channel_struct.id)
         logger.info('Activating channel %s' % (channel,))
+        if not self.webhooks_enabled():
+            return
         dm_id = self.add_channel_webhook(
             channel, 'message.group_inbound')
         status_id = self.add_channel_webhook(
             channel, 'message.group_outbound.status')
-        config = channel.config_json()
+        config = channel_config(channel)
         config.update({
             'wassup_webhook_ids': [dm_id, status_id]
         })
-        channel.config = json.dumps(config)
+        channel.config = dumps(config)
         channel.save(update_fields=['config'])
 
     def deactivate(self, channel_struct):
@@ -1,28 +1,141 @@
+import atexit
+import threading
+import weakref
+
 import requests
-import pkg_resources
+from requests.adapters import HTTPAdapter
+from six.moves.http_cookiejar import DefaultCookiePolicy
 from django.conf import settings
 
-distribution = pkg_resources.get_distribution('warapidpro')
+DEFAULT_HTTP_POOL_SIZE = 10
+
+_version = None
+
+# Sessions aren't thread safe so each thread gets its own, they are
+# kept for the life of the thread so connections to Wassup are reused.
+# close_sessions bumps the generation so every thread replaces its
+# closed session on next use.
+_local = threading.local()
+_sessions = weakref.WeakSet()
+_sessions_lock = threading.Lock()
+_generation = 0
+
+
+class NoCookiesPolicy(DefaultCookiePolicy):
+    """
+    A thread's session serves every org and channel, so cookies set in
+    response to one's requests must never be sent with another's.
+    """
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+def get_version():
+    """
+    The installed warapidpro version, resolved on first use. The
+    pkg_resources fallback for Pythons without importlib.metadata scans
+    every installed distribution so is only imported when needed.
+    """
+    global _version
+    if _version is None:
+        try:
+            from importlib.metadata import version
+        except ImportError:
+            try:
+                from importlib_metadata import version
+            except ImportError:
+                version = None
+
+        if version is not None:
+            _version = version('warapidpro')
+        else:
+            import pkg_resources
+            _version = pkg_resources.get_distribution('warapidpro').version
+    return _version
+
+
+def get_session():
+    """
+    The calling thread's pooled session, each keeps at most
+    WASSUP_HTTP_POOL_SIZE connections per host.
+    """
+    session = getattr(_local, 'session', None)
+    if session is None or _local.generation != _generation:
+        pool_size = getattr(
+            settings, 'WASSUP_HTTP_POOL_SIZE', DEFAULT_HTTP_POOL_SIZE)
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        session = requests.Session()
+        session.cookies.set_policy(NoCookiesPolicy())
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        with _sessions_lock:
+            _sessions.add(session)
+            _local.session = session
+            _local.generation = _generation
+    return session
+
+
+def close_sessions():
+    """
+    Closes the pooled sessions of all threads, for worker shutdown.
+    """
+    global _generation
+    with _sessions_lock:
+        sessions = list(_sessions)
+        _sessions.clear()
+        _generation += 1
+    for session in sessions:
+        session.close()
+    _local.session = None
+
+
+atexit.register(close_sessions)
+
+
+class PooledSession(object):
+    """
+    Sends requests over the thread's pooled session with headers of its
+    own, the headers are applied per request rather than to the shared
+    session.
+    """
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def request(self, method, url, **kwargs):
+        headers = dict(self.headers)
+        headers.update(kwargs.pop('headers', None) or {})
+        return get_session().request(method, url, headers=headers, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
 
 
 def session_for_warapidpro():
-    session = requests.Session()
-    session.headers.update({
+    return PooledSession({
         'User-Agent': 'warapidpro/%s (%s, %s)' % (
-            distribution.version, "[Auth Setup]", settings.HOSTNAME)
+            get_version(), "[Auth Setup]", settings.HOSTNAME)
     })
-    return session
 
 
 def session_for_channel(channel):
-    session = requests.Session()
-    session.headers.update({
+    return PooledSession({
         'User-Agent': 'warapidpro/%s (%s, %s, %s)' % (
-            distribution.version,
+            get_version(),
             (channel.org.name
              if channel.org
              else 'Unknown Org'),
             '%s/%s' % (channel.channel_type, channel.pk),
             settings.HOSTNAME)
     })
-    return session
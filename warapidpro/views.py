@@ -1,13 +1,16 @@
-import urllib
+import hashlib
 import logging
 
 from datetime import datetime, timedelta
 from uuid import uuid4
+from six.moves.urllib.parse import urlencode
 from django import forms
 from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
+from warapidpro import metrics
 from warapidpro.utils import session_for_warapidpro
 
 from smartmin.views import SmartFormView
@@ -19,6 +22,8 @@ from temba.channels.models import Channel
 DEFAULT_STATE_KEY = 'wassup_auth_state'
 DEFAULT_AUTHORIZATION_KEY = 'wassup_authorizations'
 DEFAULT_AUTH_URL = 'https://wassup.p16n.org'
+LISTING_CACHE_KEY = 'warapidpro:listing:%s:%s'
+DEFAULT_LISTING_CACHE_TTL = 60 * 15
 DEFAULT_SCOPES = " ".join([
     "numbers:read",
     "messages:read",
@@ -30,6 +35,11 @@ DEFAULT_SCOPES = " ".join([
 logger = logging.getLogger(__name__)
 
 
+def listing_cache_key(name, api_token):
+    return LISTING_CACHE_KEY % (
+        name, hashlib.sha256(api_token.encode('utf-8')).hexdigest())
+
+
 class NumberForm(ClaimViewMixin.Form):
 
     number = forms.ChoiceField(
@@ -71,7 +81,12 @@ class WhatsAppClaimView(ClaimViewMixin, SmartFormView):
             DEFAULT_AUTHORIZATION_KEY, {})
 
     def clear_session_authorization(self):
-        del self.request.session[DEFAULT_AUTHORIZATION_KEY]
+        authorization = self.request.session.pop(
+            DEFAULT_AUTHORIZATION_KEY, {})
+        if authorization.get('access_token'):
+            cache.delete_many([
+                listing_cache_key(name, authorization['access_token'])
+                for name in ('numbers', 'groups')])
 
     def get_authorization(self, code):
         wassup_url = getattr(
@@ -91,7 +106,8 @@ class WhatsAppClaimView(ClaimViewMixin, SmartFormView):
                 "redirect_uri": redirect_uri,
                 "client_id": client_id,
                 "client_secret": client_secret,
-            })
+            },
+            hooks={'response': metrics.wassup_request_hook('oauth_token')})
         response.raise_for_status()
         return response.json()
 
@@ -116,7 +132,7 @@ class WhatsAppClaimView(ClaimViewMixin, SmartFormView):
 
         auth_url = '%s/oauth/authorize/?%s' % (
             wassup_url,
-            urllib.urlencode({
+            urlencode({
                 "client_id": client_id,
                 "redirect_uri": self.get_redirect_uri(),
                 "scopes": auth_scopes,
@@ -139,17 +155,46 @@ class WhatsAppClaimView(ClaimViewMixin, SmartFormView):
         return getattr(
             settings, 'WASSUP_API_URL', '%s/api/v1' % (DEFAULT_AUTH_URL,))
 
-    def get_numbers(self, api_token):
+    def get_listing(self, name, api_token):
+        """
+        All of the numbers or groups the authorization has access to,
+        cached for the rest of the claim so rendering and validating
+        the form don't each list them again.
+        """
+        key = listing_cache_key(name, api_token)
+        results = cache.get(key)
+        if results is None:
+            results = self.fetch_listing(name, api_token)
+            cache.set(key, results, getattr(
+                settings, 'WASSUP_LISTING_CACHE_TTL',
+                DEFAULT_LISTING_CACHE_TTL))
+        return results
+
+    def fetch_listing(self, name, api_token):
+        """
+        Fetches every page of a listing by following the next links, so
+        items added or removed while paging aren't skipped or repeated
+        the way numbered pages would be.
+        """
         session = session_for_warapidpro()
-        response = session.get(
-            '%s/numbers/' % (self.wassup_url(),),
-            headers={
-                'Authorization': 'Bearer %s' % (api_token),
-                'Accept': 'application/json',
-            })
-        response.raise_for_status()
-        data = response.json()
-        return data['results']
+        url = '%s/%s/' % (self.wassup_url(), name)
+        results = []
+        while url:
+            response = session.get(
+                url,
+                headers={
+                    'Authorization': 'Bearer %s' % (api_token),
+                    'Accept': 'application/json',
+                },
+                hooks={'response': metrics.wassup_request_hook(name)})
+            response.raise_for_status()
+            data = response.json()
+            results.extend(data['results'])
+            url = data.get('next')
+        return results
+
+    def get_numbers(self, api_token):
+        return self.get_listing('numbers', api_token)
 
     def get_number_choices(self, api_token):
         return [(
@@ -158,16 +203,7 @@ class WhatsAppClaimView(ClaimViewMixin, SmartFormView):
         ) for number in self.get_numbers(api_token)]
 
     def get_groups(self, api_token):
-        session = session_for_warapidpro()
-        response = session.get(
-            '%s/groups/' % (self.wassup_url(),),
-            headers={
-                'Authorization': 'Bearer %s' % (api_token),
-                'Accept': 'application/json',
-            })
-        response.raise_for_status()
-        data = response.json()
-        return data['results']
+        return self.get_listing('groups', api_token)
 
     def get_group_choices(self, api_token):
         return [(group['uuid'], '%(subject)s for %(number)s' % group)
@@ -206,7 +242,7 @@ class DirectClaimView(WhatsAppClaimView):
             address=number, config=config,
             secret=Channel.generate_secret())
 
-        self.clear_session_authorization
+        self.clear_session_authorization()
         return super(WhatsAppClaimView, self).form_valid(form)
 
 